@@ -44,7 +44,9 @@ extern const Command diff_command;
 extern const Command diff_state_command;
 extern const Command diff_images_command;
 extern const Command dump_command;
+extern const Command index_command;
 extern const Command repack_command;
 extern const Command trace_command;
+extern const Command trim_command;
 
 #endif /* _APITRACE_CLI_HPP_ */
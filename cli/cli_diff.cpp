@@ -25,13 +25,33 @@
  *
  *********************************************************************/
 
+/*
+ * Compare two traces frame by frame.  Both traces are parsed side by side,
+ * one frame at a time, and every call is reduced to a hash of its function
+ * name and its argument and return values.  Frames whose hashes all match
+ * are skipped; within the others, the calls are aligned by their longest
+ * common subsequence, and only the ones that differ are listed.
+ */
+
 #include <string.h>
+#include <stdint.h>
+#include <stdlib.h>
+
+#include <algorithm>
 #include <iostream>
+#include <map>
+#include <string>
+#include <vector>
 
 #include "cli.hpp"
-#include "os_string.hpp"
-#include "os_process.hpp"
-#include "trace_resource.hpp"
+#include "glhandles.hpp"
+#include "trace_parser.hpp"
+
+
+// Frames are aligned by longest common subsequence only up to this many
+// pairs of calls; the differing middle of larger frames is listed whole
+#define MAX_LCS_SIZE (16 * 1024 * 1024)
+
 
 static const char *synopsis = "Identify differences between two traces.";
 
@@ -39,15 +59,461 @@ static void
 usage(void)
 {
     std::cout
-        << "usage: apitrace diff <trace-1> <trace-2>\n"
+        << "usage: apitrace diff [OPTIONS] <trace-1> <trace-2>\n"
         << synopsis << "\n"
         "\n"
-        "    Both input files should be the result of running 'apitrace trace'.\n";
+        "The traces are compared frame by frame, and the calls which differ\n"
+        "are listed, with - for calls only in the first trace, and + for calls\n"
+        "only in the second one.  The exit status is 0 when the traces match,\n"
+        "and 1 when they differ.\n"
+        "\n"
+        "    --ignore-pointers   Consider all pointers, object names and uniform\n"
+        "                        locations equal\n";
+}
+
+
+static bool
+isFrameMarker(const trace::Call *call)
+{
+    const char *name = call->name();
+    return strstr(name, "SwapBuffers") ||
+           strcmp(name, "glFrameTerminatorGREMEDY") == 0;
 }
 
+
+/**
+ * Arguments and return values of every function which are object names or
+ * uniform locations, as these usually change from run to run.
+ */
+class HandleTable
+{
+private:
+    typedef std::vector<int> Args;
+
+    std::map<std::string, Args> functions;
+
+    // Signatures are owned by the parsers, and outlive the comparison
+    std::map<const trace::FunctionSig *, const Args *> sigs;
+
+    Args none;
+
+public:
+    HandleTable() {
+        for (const HandleArg *handle = handleArgs; handle->function; ++handle) {
+            functions[handle->function].push_back(handle->arg);
+        }
+    }
+
+    /**
+     * Indices of the handle arguments of a function, with -1 standing for
+     * the return value.
+     */
+    const Args &
+    lookup(const trace::FunctionSig *sig) {
+        std::map<const trace::FunctionSig *, const Args *>::iterator it = sigs.find(sig);
+        if (it != sigs.end()) {
+            return *it->second;
+        }
+
+        std::map<std::string, Args>::const_iterator found = functions.find(sig->name);
+        const Args *args = found != functions.end() ? &found->second : &none;
+        sigs[sig] = args;
+        return *args;
+    }
+};
+
+
+/**
+ * FNV-1a hash of values.  Signatures are hashed by content, as their ids
+ * differ from trace to trace.
+ */
+class Hasher : public trace::Visitor
+{
+private:
+    bool ignorePointers;
+    HandleTable *handles;
+
+    enum {
+        TAG_NULL = 1,
+        TAG_FALSE,
+        TAG_TRUE,
+        TAG_SINT,
+        TAG_UINT,
+        TAG_FLOAT,
+        TAG_DOUBLE,
+        TAG_STRING,
+        TAG_ENUM,
+        TAG_BITMASK,
+        TAG_STRUCT,
+        TAG_ARRAY,
+        TAG_BLOB,
+        TAG_POINTER,
+        TAG_HANDLE,
+        TAG_MISSING
+    };
+
+    void
+    add(const void *data, size_t size) {
+        const unsigned char *bytes = (const unsigned char *)data;
+        for (size_t i = 0; i < size; ++i) {
+            hash ^= bytes[i];
+            hash *= 0x100000001b3ULL;
+        }
+    }
+
+    void
+    addUInt(unsigned long long value) {
+        add(&value, sizeof value);
+    }
+
+    void
+    addString(const char *str) {
+        size_t len = strlen(str);
+        addUInt(len);
+        add(str, len);
+    }
+
+    void
+    addValue(trace::Value *value) {
+        if (value) {
+            _visit(value);
+        } else {
+            addUInt(TAG_MISSING);
+        }
+    }
+
+public:
+    uint64_t hash;
+
+    /**
+     * Pointers are ignored when ignorePointers is true, and so are the
+     * object names and locations in the table, when given.
+     */
+    Hasher(bool _ignorePointers, HandleTable *_handles) :
+        ignorePointers(_ignorePointers),
+        handles(_handles),
+        hash(0xcbf29ce484222325ULL)
+    {}
+
+    void visit(trace::Null *) {
+        addUInt(TAG_NULL);
+    }
+
+    void visit(trace::Bool *node) {
+        addUInt(node->value ? TAG_TRUE : TAG_FALSE);
+    }
+
+    void visit(trace::SInt *node) {
+        addUInt(TAG_SINT);
+        addUInt(node->value);
+    }
+
+    void visit(trace::UInt *node) {
+        addUInt(TAG_UINT);
+        addUInt(node->value);
+    }
+
+    void visit(trace::Float *node) {
+        addUInt(TAG_FLOAT);
+        add(&node->value, sizeof node->value);
+    }
+
+    void visit(trace::Double *node) {
+        addUInt(TAG_DOUBLE);
+        add(&node->value, sizeof node->value);
+    }
+
+    void visit(trace::String *node) {
+        addUInt(TAG_STRING);
+        addString(node->value);
+    }
+
+    void visit(trace::Enum *node) {
+        addUInt(TAG_ENUM);
+        addString(node->sig->name);
+        addUInt(node->sig->value);
+    }
+
+    void visit(trace::Bitmask *node) {
+        addUInt(TAG_BITMASK);
+        addUInt(node->value);
+    }
+
+    void visit(trace::Struct *node) {
+        addUInt(TAG_STRUCT);
+        addString(node->sig->name);
+        for (unsigned i = 0; i < node->members.size(); ++i) {
+            addValue(node->members[i]);
+        }
+    }
+
+    void visit(trace::Array *node) {
+        addUInt(TAG_ARRAY);
+        addUInt(node->values.size());
+        for (unsigned i = 0; i < node->values.size(); ++i) {
+            addValue(node->values[i]);
+        }
+    }
+
+    void visit(trace::Blob *node) {
+        addUInt(TAG_BLOB);
+        addUInt(node->size);
+        add(node->buf, node->size);
+    }
+
+    void visit(trace::Pointer *node) {
+        addUInt(TAG_POINTER);
+        if (!ignorePointers) {
+            addUInt(node->value);
+        }
+    }
+
+    void visit(trace::Call *call) {
+        std::vector<bool> ignored(call->args.size() + 1);
+        if (handles) {
+            const std::vector<int> &args = handles->lookup(call->sig);
+            for (unsigned i = 0; i < args.size(); ++i) {
+                // The return value goes last
+                unsigned index = args[i] < 0 ? call->args.size() : args[i];
+                if (index < ignored.size()) {
+                    ignored[index] = true;
+                }
+            }
+        }
+
+        addString(call->name());
+        addUInt(call->args.size());
+        for (unsigned i = 0; i < call->args.size(); ++i) {
+            if (ignored[i]) {
+                addUInt(TAG_HANDLE);
+            } else {
+                addValue(call->args[i]);
+            }
+        }
+        if (ignored[call->args.size()]) {
+            addUInt(TAG_HANDLE);
+        } else {
+            addValue(call->ret);
+        }
+    }
+};
+
+
+struct Frame
+{
+    std::vector<trace::Call *> calls;
+    std::vector<uint64_t> hashes;
+
+    ~Frame() {
+        clear();
+    }
+
+    void
+    clear(void) {
+        for (unsigned i = 0; i < calls.size(); ++i) {
+            delete calls[i];
+        }
+        calls.clear();
+        hashes.clear();
+    }
+};
+
+
+/**
+ * Read the calls up to the next frame marker.
+ */
+static bool
+readFrame(trace::Parser &parser, Frame &frame, bool ignorePointers,
+          HandleTable *handles)
+{
+    frame.clear();
+
+    trace::Call *call;
+    while ((call = parser.parse_call())) {
+        Hasher hasher(ignorePointers, handles);
+        hasher.visit(call);
+        frame.calls.push_back(call);
+        frame.hashes.push_back(hasher.hash);
+        if (isFrameMarker(call)) {
+            break;
+        }
+    }
+
+    return !frame.calls.empty();
+}
+
+
+class Differ
+{
+private:
+    unsigned differentCalls;
+
+    void
+    remove(trace::Call *call) {
+        std::cout << "- ";
+        call->dump(std::cout, false);
+        ++differentCalls;
+    }
+
+    void
+    insert(trace::Call *call) {
+        std::cout << "+ ";
+        call->dump(std::cout, false);
+        ++differentCalls;
+    }
+
+public:
+    Differ() :
+        differentCalls(0)
+    {}
+
+    unsigned
+    getDifferentCalls(void) const {
+        return differentCalls;
+    }
+
+    /**
+     * List the calls of two frames which are not in their longest common
+     * subsequence.
+     */
+    void
+    diff(const Frame &a, const Frame &b) {
+        size_t n = a.hashes.size();
+        size_t m = b.hashes.size();
+
+        // Matching calls at either end need no alignment
+        size_t begin = 0;
+        while (begin < n && begin < m && a.hashes[begin] == b.hashes[begin]) {
+            ++begin;
+        }
+        size_t end = 0;
+        while (end < n - begin && end < m - begin &&
+               a.hashes[n - 1 - end] == b.hashes[m - 1 - end]) {
+            ++end;
+        }
+        n -= begin + end;
+        m -= begin + end;
+
+        const uint64_t *x = n ? &a.hashes[begin] : NULL;
+        const uint64_t *y = m ? &b.hashes[begin] : NULL;
+        trace::Call * const *xcalls = n ? &a.calls[begin] : NULL;
+        trace::Call * const *ycalls = m ? &b.calls[begin] : NULL;
+
+        if ((n + 1) * (m + 1) > MAX_LCS_SIZE) {
+            for (size_t i = 0; i < n; ++i) {
+                remove(xcalls[i]);
+            }
+            for (size_t j = 0; j < m; ++j) {
+                insert(ycalls[j]);
+            }
+            return;
+        }
+
+        // lengths[i*(m + 1) + j] is the length of the longest common
+        // subsequence of x[i..n) and y[j..m)
+        std::vector<unsigned> lengths((n + 1) * (m + 1));
+        for (size_t i = n; i-- > 0; ) {
+            for (size_t j = m; j-- > 0; ) {
+                unsigned &length = lengths[i*(m + 1) + j];
+                if (x[i] == y[j]) {
+                    length = lengths[(i + 1)*(m + 1) + j + 1] + 1;
+                } else {
+                    length = std::max(lengths[(i + 1)*(m + 1) + j],
+                                      lengths[i*(m + 1) + j + 1]);
+                }
+            }
+        }
+
+        size_t i = 0;
+        size_t j = 0;
+        while (i < n && j < m) {
+            if (x[i] == y[j]) {
+                ++i;
+                ++j;
+            } else if (lengths[(i + 1)*(m + 1) + j] >= lengths[i*(m + 1) + j + 1]) {
+                remove(xcalls[i++]);
+            } else {
+                insert(ycalls[j++]);
+            }
+        }
+        while (i < n) {
+            remove(xcalls[i++]);
+        }
+        while (j < m) {
+            insert(ycalls[j++]);
+        }
+    }
+};
+
+
+static int
+diff(const char *filename1, const char *filename2, bool ignorePointers)
+{
+    trace::Parser parser1;
+    if (!parser1.open(filename1)) {
+        std::cerr << "error: failed to open " << filename1 << "\n";
+        return 2;
+    }
+
+    trace::Parser parser2;
+    if (!parser2.open(filename2)) {
+        std::cerr << "error: failed to open " << filename2 << "\n";
+        return 2;
+    }
+
+    HandleTable handleTable;
+    HandleTable *handles = ignorePointers ? &handleTable : NULL;
+
+    Differ differ;
+    Frame frame1;
+    Frame frame2;
+    unsigned frameNo = 0;
+    unsigned differentFrames = 0;
+    unsigned extraFrames1 = 0;
+    unsigned extraFrames2 = 0;
+    while (true) {
+        bool more1 = readFrame(parser1, frame1, ignorePointers, handles);
+        bool more2 = readFrame(parser2, frame2, ignorePointers, handles);
+
+        if (more1 && more2) {
+            if (frame1.hashes != frame2.hashes) {
+                std::cout << "@@ frame " << frameNo << " @@\n";
+                differ.diff(frame1, frame2);
+                ++differentFrames;
+            }
+        } else if (more1) {
+            ++extraFrames1;
+        } else if (more2) {
+            ++extraFrames2;
+        } else {
+            break;
+        }
+
+        ++frameNo;
+    }
+
+    if (extraFrames1) {
+        std::cout << "@@ " << extraFrames1 << " more frames in " << filename1 << " @@\n";
+    }
+    if (extraFrames2) {
+        std::cout << "@@ " << extraFrames2 << " more frames in " << filename2 << " @@\n";
+    }
+
+    if (differentFrames) {
+        std::cout << differ.getDifferentCalls() << " calls differ, in "
+                  << differentFrames << " of "
+                  << frameNo - extraFrames1 - extraFrames2 << " frames\n";
+    }
+
+    return differentFrames || extraFrames1 || extraFrames2 ? 1 : 0;
+}
+
+
 static int
 command(int argc, char *argv[])
 {
+    bool ignorePointers = false;
+
     int i;
 
     for (i = 0; i < argc; ++i) {
@@ -63,6 +529,8 @@ command(int argc, char *argv[])
         } else if (!strcmp(arg, "--help")) {
             usage();
             return 0;
+        } else if (!strcmp(arg, "--ignore-pointers")) {
+            ignorePointers = true;
         } else {
             std::cerr << "error: unknown option " << arg << "\n";
             usage();
@@ -76,29 +544,7 @@ command(int argc, char *argv[])
         return 1;
     }
 
-    char *file1, *file2;
-
-    file1 = argv[i];
-    file2 = argv[i+1];
-
-    os::String command = trace::findScript("tracediff.sh");
-
-    char* args[4];
-
-    args[0] = (char *) command.str();
-    args[1] = file1;
-    args[2] = file2;
-    args[3] = NULL;
-
-#ifdef _WIN32
-    std::cerr << "The 'apitrace diff' command is not yet supported on this O/S.\n";
-    return 1;
-#else
-    os::String apitrace = os::getProcessName();
-    setenv("APITRACE", apitrace.str(), 1);
-
-    return os::execute(args);
-#endif
+    return diff(argv[i], argv[i + 1], ignorePointers);
 }
 
 const Command diff_command = {
@@ -42,7 +42,8 @@ usage(void)
         << "usage: apitrace diff-state <state-1> <state-2>\n"
         << synopsis << "\n"
         "\n"
-        "    Both input files should be the result of running 'glretrace -D XYZ <trace>'.\n";
+        "    Both input files should be the result of running 'glretrace -D XYZ <trace>',\n"
+        "    either in the default JSON format or with '--dump-format binary'.\n";
 }
 
 static int
@@ -0,0 +1,213 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+
+#include <string.h>
+
+#include <algorithm>
+#include <iostream>
+#include <string>
+#include <vector>
+
+#include "cli.hpp"
+
+#include "trace_index.hpp"
+
+
+static const char *synopsis = "Build or query the index of a trace.";
+
+static void
+usage(void)
+{
+    std::cout
+        << "usage: apitrace index [OPTIONS] <trace-file>\n"
+        << synopsis << "\n"
+        "\n"
+        "The index is stored next to the trace, and is built when missing or\n"
+        "out of date.  Queries print the matching calls, in the syntax taken\n"
+        "by glretrace -D; when several are given, calls must match all.\n"
+        "\n"
+        "    --rebuild           Rebuild the index even if up to date\n"
+        "    --function=NAME     Calls to functions whose name contains NAME\n"
+        "    --string=TEXT       Calls with strings containing TEXT\n"
+        "    --enum=NAME         Calls with enums whose name contains NAME\n"
+        "    --blob-size=SIZE    Calls with blobs of SIZE bytes\n"
+        "    --text=TEXT         Calls with any name or value containing TEXT\n"
+        "    -i, --ignore-case   Match names and values ignoring case\n";
+}
+
+
+struct Query {
+    unsigned kinds;
+    std::string text;
+};
+
+
+static void
+intersect(trace::CallSet &a, const trace::CallSet &b)
+{
+    const trace::CallSet::RangeList &ra = a.getRanges();
+    const trace::CallSet::RangeList &rb = b.getRanges();
+    trace::CallSet::RangeList::const_iterator ia = ra.begin();
+    trace::CallSet::RangeList::const_iterator ib = rb.begin();
+
+    trace::CallSet result;
+    while (ia != ra.end() && ib != rb.end()) {
+        unsigned first = std::max(ia->first, ib->first);
+        unsigned last = std::min(ia->last, ib->last);
+        if (first <= last) {
+            result.addRange(first, last);
+        }
+        if (ia->last < ib->last) {
+            ++ia;
+        } else {
+            ++ib;
+        }
+    }
+    a = result;
+}
+
+
+static int
+command(int argc, char *argv[])
+{
+    bool rebuild = false;
+    bool caseSensitive = true;
+    std::vector<Query> queries;
+
+    int i;
+    for (i = 0; i < argc; ++i) {
+        const char *arg = argv[i];
+
+        if (arg[0] != '-') {
+            break;
+        }
+
+        Query query;
+        query.kinds = 0;
+
+        if (!strcmp(arg, "--")) {
+            ++i;
+            break;
+        } else if (!strcmp(arg, "--help")) {
+            usage();
+            return 0;
+        } else if (!strcmp(arg, "--rebuild")) {
+            rebuild = true;
+        } else if (!strcmp(arg, "-i") ||
+                   !strcmp(arg, "--ignore-case")) {
+            caseSensitive = false;
+        } else if (!strncmp(arg, "--function=", strlen("--function="))) {
+            query.kinds = 1 << trace::Index::KIND_FUNCTION;
+            query.text = arg + strlen("--function=");
+        } else if (!strncmp(arg, "--string=", strlen("--string="))) {
+            query.kinds = 1 << trace::Index::KIND_STRING;
+            query.text = arg + strlen("--string=");
+        } else if (!strncmp(arg, "--enum=", strlen("--enum="))) {
+            query.kinds = 1 << trace::Index::KIND_ENUM;
+            query.text = arg + strlen("--enum=");
+        } else if (!strncmp(arg, "--blob-size=", strlen("--blob-size="))) {
+            query.kinds = 1 << trace::Index::KIND_BLOB;
+            query.text = arg + strlen("--blob-size=");
+        } else if (!strncmp(arg, "--text=", strlen("--text="))) {
+            query.kinds = trace::Index::KINDS_TEXT;
+            query.text = arg + strlen("--text=");
+        } else {
+            std::cerr << "error: unknown option " << arg << "\n";
+            usage();
+            return 1;
+        }
+
+        if (query.kinds) {
+            queries.push_back(query);
+        }
+    }
+
+    if (i + 1 != argc) {
+        std::cerr << "error: expected one trace file\n";
+        usage();
+        return 1;
+    }
+
+    const char *traceFilename = argv[i];
+    std::string indexFilename = trace::Index::filename(traceFilename);
+
+    trace::Index index;
+    if (rebuild || !index.load(indexFilename.c_str(), traceFilename)) {
+        std::cerr << "info: indexing " << traceFilename << "\n";
+        if (!index.build(traceFilename)) {
+            std::cerr << "error: failed to open " << traceFilename << "\n";
+            return 1;
+        }
+        if (!index.save(indexFilename.c_str())) {
+            std::cerr << "warning: failed to write " << indexFilename << "\n";
+        }
+    }
+
+    if (queries.empty()) {
+        std::cout << index.getFrames().size() << " frames\n";
+        for (unsigned kind = 0; kind < trace::Index::NUM_KINDS; ++kind) {
+            if (kind == trace::Index::KIND_ARG) {
+                continue;
+            }
+            std::cout << index.getPostings((trace::Index::Kind)kind).size() << " "
+                      << trace::Index::kindName((trace::Index::Kind)kind) << " keys\n";
+        }
+        return 0;
+    }
+
+    trace::CallSet calls;
+    for (unsigned q = 0; q < queries.size(); ++q) {
+        const Query &query = queries[q];
+        trace::CallSet matches;
+        if (query.kinds == 1 << trace::Index::KIND_BLOB) {
+            // Sizes are matched exactly
+            const trace::Index::Postings &postings = index.getPostings(trace::Index::KIND_BLOB);
+            trace::Index::Postings::const_iterator it = postings.find(query.text);
+            if (it != postings.end()) {
+                matches = it->second;
+            }
+        } else {
+            index.find(query.text.c_str(), caseSensitive, query.kinds, matches);
+        }
+
+        if (q == 0) {
+            calls = matches;
+        } else {
+            intersect(calls, matches);
+        }
+    }
+
+    std::cout << calls << "\n";
+
+    return calls.empty() ? 1 : 0;
+}
+
+const Command index_command = {
+    "index",
+    synopsis,
+    usage,
+    command
+};
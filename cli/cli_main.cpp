@@ -70,8 +70,10 @@ static const Command * commands[] = {
     &diff_state_command,
     &diff_images_command,
     &dump_command,
+    &index_command,
     &repack_command,
     &trace_command,
+    &trim_command,
     &help_command
 };
 
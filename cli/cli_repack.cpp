@@ -23,61 +23,707 @@
  *
  **************************************************************************/
 
+/*
+ * Repacking is done in chunks, on a pool of threads: input chunks are
+ * decompressed, the data is cut into output chunks, and these are
+ * compressed, while the main thread reads and writes them in order.
+ *
+ * Traces compressed with a trace::Codec, such as snappy or deflate, are
+ * chunked already, and zlib output is written as one gzip member per chunk,
+ * which gzread reads back as a single stream.  Next to zlib output goes a
+ * seek index, OUTPUT.seek, a plain text file of the form
+ *
+ *   apitrace-seek VERSION
+ *   codec CODEC
+ *   chunk OFFSET POSITION
+ *   ...
+ *   end SIZE LENGTH
+ *
+ * giving the file offset and the position in the uncompressed data where
+ * each chunk starts, and the sizes of the file and of the data, so that
+ * chunks can be decompressed independently.  zlib traces with a seek index
+ * are decompressed in parallel too.  Chunked traces need no index, as the
+ * chunk headers give the same information.
+ *
+ * Codecs which take a dictionary can be given one made of slices of the
+ * first chunks, which are likely to have much in common with the rest.
+ */
+
 
+#include <stdio.h>
+#include <stdlib.h>
 #include <string.h>
+#include <zlib.h>
+
+#include <algorithm>
+#include <deque>
+#include <fstream>
 #include <iostream>
+#include <sstream>
+#include <string>
+#include <vector>
 
 #include "cli.hpp"
 
+#include "os_thread.hpp"
 #include "trace_file.hpp"
 
 
-static const char *synopsis = "Repack a trace file with Snappy compression.";
+#define SEEK_VERSION 1
+
+
+#define MAX_DICTIONARY_SIZE (32 * 1024)
+
+
+static const char *synopsis = "Repack a trace file with another compression.";
 
 static void
 usage(void)
 {
+    std::vector<std::string> codecs = trace::Codec::names();
+
     std::cout
-        << "usage: apitrace repack <in-trace-file> <out-trace-file>\n"
+        << "usage: apitrace repack [OPTIONS] <in-trace-file> <out-trace-file>\n"
         << synopsis << "\n"
         << "\n"
         << "Snappy compression allows for faster replay and smaller memory footprint,\n"
-        << "at the expense of a slightly smaller compression ratio than zlib\n"
+        << "at the expense of a slightly smaller compression ratio than zlib.\n"
+        << "Deflate compression, with a dictionary, gives the smallest traces, for\n"
+        << "archiving, and can still be read by glretrace.\n"
+        << "\n"
+        << "    -j, --jobs=N        Number of threads (default: number of processors)\n"
+        << "    --chunk-size=SIZE   Uncompressed size of the chunks, with an optional\n"
+        << "                        K or M suffix (default: 1M)\n"
+        << "    --codec=CODEC       ";
+    for (unsigned i = 0; i < codecs.size(); ++i) {
+        std::cout << codecs[i] << (i == 0 ? " (default), " : ", ");
+    }
+    std::cout
+        << "or zlib\n"
+        << "    --level=N           Compression level, from 1 (fastest) to 9\n"
+        << "                        (smallest), for codecs which have several\n"
+        << "    --dictionary-size=SIZE\n"
+        << "                        Size of the dictionary, up to 32K, for codecs which\n"
+        << "                        take one; it pays off with small chunks of traces\n"
+        << "                        with little blob data (default: 0, none)\n"
         << "\n";
 }
 
-static int
-repack(const char *inFileName, const char *outFileName)
+
+enum Format {
+    FORMAT_NONE,
+    FORMAT_CHUNKED,
+    FORMAT_ZLIB
+};
+
+
+static bool
+deflateChunk(const std::string &input, std::string &output)
 {
-    trace::File *inFile = trace::File::createForRead(inFileName);
-    if (!inFile) {
-        return 1;
+    z_stream stream;
+    memset(&stream, 0, sizeof stream);
+    // A gzip header and trailer make every chunk a complete gzip member
+    if (deflateInit2(&stream, Z_DEFAULT_COMPRESSION, Z_DEFLATED, 15 + 16, 8,
+                     Z_DEFAULT_STRATEGY) != Z_OK) {
+        return false;
     }
 
-    trace::File *outFile = trace::File::createForWrite(outFileName);
-    if (!outFile) {
-        delete inFile;
-        return 1;
+    output.resize(deflateBound(&stream, input.size()) + 32);
+    stream.next_in = (Bytef *)input.data();
+    stream.avail_in = input.size();
+    stream.next_out = (Bytef *)&output[0];
+    stream.avail_out = output.size();
+
+    int ret = deflate(&stream, Z_FINISH);
+    output.resize(stream.total_out);
+    deflateEnd(&stream);
+
+    return ret == Z_STREAM_END;
+}
+
+
+static bool
+inflateChunk(const std::string &input, std::string &output, size_t length)
+{
+    z_stream stream;
+    memset(&stream, 0, sizeof stream);
+    if (inflateInit2(&stream, 15 + 16) != Z_OK) {
+        return false;
+    }
+
+    output.resize(length);
+    stream.next_in = (Bytef *)input.data();
+    stream.avail_in = input.size();
+    stream.next_out = (Bytef *)&output[0];
+    stream.avail_out = output.size();
+
+    int ret = inflate(&stream, Z_FINISH);
+    bool complete = ret == Z_STREAM_END && stream.total_out == length;
+    inflateEnd(&stream);
+
+    return complete;
+}
+
+
+struct Job {
+    enum Kind {
+        DECOMPRESS,
+        COMPRESS
+    };
+
+    Kind kind;
+    Format format;
+    const trace::Codec *codec;
+    std::string input;
+    std::string output;
+
+    // Uncompressed length, when known
+    size_t length;
+
+    bool done;
+    bool failed;
+
+    Job(Kind _kind, Format _format, const trace::Codec *_codec) :
+        kind(_kind),
+        format(_format),
+        codec(_codec),
+        length(0),
+        done(false),
+        failed(false)
+    {}
+
+    void
+    run(void) {
+        switch (format) {
+        case FORMAT_CHUNKED:
+            if (kind == COMPRESS) {
+                output.resize(codec->maxCompressedLength(input.size()));
+                output.resize(codec->compress(input.data(), input.size(),
+                                              &output[0]));
+                failed = output.empty();
+            } else if (codec->uncompressedLength(input.data(), input.size(),
+                                                 length)) {
+                output.resize(length);
+                failed = !codec->uncompress(input.data(), input.size(),
+                                            &output[0]);
+            } else {
+                failed = true;
+            }
+            break;
+        case FORMAT_ZLIB:
+            if (kind == COMPRESS) {
+                failed = !deflateChunk(input, output);
+            } else {
+                failed = !inflateChunk(input, output, length);
+            }
+            break;
+        default:
+            output.swap(input);
+            break;
+        }
+        std::string().swap(input);
+    }
+};
+
+
+class WorkerPool
+{
+private:
+    std::vector<os::thread *> threads;
+    os::mutex mutex;
+    os::condition_variable jobQueued;
+    os::condition_variable jobDone;
+    std::deque<Job *> queue;
+    bool stopping;
+
+    static void
+    runThread(void *arg) {
+        static_cast<WorkerPool *>(arg)->run();
     }
 
-    size_t size = 8192;
-    char *buf = new char[size];
-    size_t read;
+    void
+    run(void) {
+        while (true) {
+            Job *job;
+            {
+                os::scoped_lock lock(mutex);
+                while (queue.empty() && !stopping) {
+                    jobQueued.wait(mutex);
+                }
+                if (queue.empty()) {
+                    return;
+                }
+                job = queue.front();
+                queue.pop_front();
+            }
+
+            job->run();
+
+            os::scoped_lock lock(mutex);
+            job->done = true;
+            jobDone.notify_all();
+        }
+    }
 
-    while ((read = inFile->read(buf, size)) != 0) {
-        outFile->write(buf, read);
+public:
+    WorkerPool(unsigned count) :
+        stopping(false)
+    {
+        for (unsigned i = 0; i < count; ++i) {
+            os::thread *thread = new os::thread;
+            thread->run(&runThread, this);
+            threads.push_back(thread);
+        }
     }
 
-    delete [] buf;
-    delete outFile;
-    delete inFile;
+    ~WorkerPool() {
+        {
+            os::scoped_lock lock(mutex);
+            stopping = true;
+            jobQueued.notify_all();
+        }
+        for (unsigned i = 0; i < threads.size(); ++i) {
+            delete threads[i];
+        }
+    }
+
+    void
+    submit(Job *job) {
+        os::scoped_lock lock(mutex);
+        queue.push_back(job);
+        jobQueued.notify_one();
+    }
+
+    void
+    wait(Job *job) {
+        os::scoped_lock lock(mutex);
+        while (!job->done) {
+            jobDone.wait(mutex);
+        }
+    }
+
+    bool
+    isDone(Job *job) {
+        os::scoped_lock lock(mutex);
+        return job->done;
+    }
+};
+
+
+struct SeekEntry {
+    unsigned long long offset;
+    unsigned long long position;
+};
 
-    return 0;
+
+static bool
+readSeekIndex(const std::string &filename, std::string &codec,
+              std::vector<SeekEntry> &entries)
+{
+    std::ifstream is(filename.c_str());
+    if (!is) {
+        return false;
+    }
+
+    std::string line;
+    unsigned version = 0;
+    if (!std::getline(is, line) ||
+        sscanf(line.c_str(), "apitrace-seek %u", &version) != 1 ||
+        version != SEEK_VERSION) {
+        return false;
+    }
+
+    codec.clear();
+    entries.clear();
+    bool complete = false;
+    while (std::getline(is, line)) {
+        std::istringstream fields(line);
+        std::string keyword;
+        fields >> keyword;
+        if (keyword == "codec") {
+            fields >> codec;
+        } else if (keyword == "chunk" || keyword == "end") {
+            SeekEntry entry;
+            if (!(fields >> entry.offset >> entry.position)) {
+                return false;
+            }
+            entries.push_back(entry);
+            complete = keyword == "end";
+        }
+    }
+
+    return complete;
+}
+
+
+static bool
+writeSeekIndex(const std::string &filename, const std::string &codec,
+               const std::vector<SeekEntry> &entries)
+{
+    std::ofstream os(filename.c_str());
+    if (!os) {
+        return false;
+    }
+
+    os << "apitrace-seek " << SEEK_VERSION << "\n";
+    os << "codec " << codec << "\n";
+    for (unsigned i = 0; i < entries.size(); ++i) {
+        os << (i + 1 < entries.size() ? "chunk " : "end ")
+           << entries[i].offset << " " << entries[i].position << "\n";
+    }
+
+    return os.good();
+}
+
+
+static unsigned long long
+fileSize(const char *filename)
+{
+    std::ifstream is(filename, std::ios::binary);
+    is.seekg(0, std::ios::end);
+    return is.tellg();
+}
+
+
+/**
+ * Reads the input in chunks, either still compressed, when they can be
+ * decompressed independently, or through trace::File otherwise.
+ */
+class Reader
+{
+private:
+    Format format;
+    trace::Codec *codec;
+    std::ifstream stream;
+    trace::File *file;
+    size_t chunkSize;
+
+    // Seek index of zlib input
+    std::vector<SeekEntry> entries;
+    unsigned entry;
+
+public:
+    Reader() :
+        format(FORMAT_NONE),
+        codec(NULL),
+        file(NULL),
+        chunkSize(0),
+        entry(0)
+    {}
+
+    ~Reader() {
+        delete codec;
+        delete file;
+    }
+
+    bool
+    open(const char *filename, size_t _chunkSize) {
+        chunkSize = _chunkSize;
+
+        codec = trace::Codec::createForFile(filename);
+        if (codec) {
+            format = FORMAT_CHUNKED;
+        } else {
+            std::string seekCodec;
+            if (readSeekIndex(std::string(filename) + ".seek", seekCodec, entries) &&
+                seekCodec == "zlib" &&
+                entries.back().offset == fileSize(filename)) {
+                format = FORMAT_ZLIB;
+            }
+        }
+
+        if (format == FORMAT_NONE) {
+            file = trace::File::createForRead(filename);
+            return file != NULL;
+        }
+
+        stream.open(filename, std::ios::binary);
+        if (format == FORMAT_CHUNKED) {
+            // Skip the identifier, and read the header
+            stream.seekg(2, std::ios::beg);
+            if (!codec->readHeader(stream)) {
+                std::cerr << "error: failed to read " << filename << "\n";
+                return false;
+            }
+        }
+        return stream.good();
+    }
+
+    Job *
+    read(void) {
+        Job *job = new Job(Job::DECOMPRESS, format, codec);
+
+        if (format == FORMAT_CHUNKED) {
+            unsigned char buf[4];
+            stream.read((char *)buf, sizeof buf);
+            size_t length = 0;
+            if (!stream.fail()) {
+                length  =  (size_t)buf[0];
+                length |= ((size_t)buf[1] <<  8);
+                length |= ((size_t)buf[2] << 16);
+                length |= ((size_t)buf[3] << 24);
+            }
+            job->input.resize(length);
+            if (length) {
+                stream.read(&job->input[0], length);
+            }
+        } else if (format == FORMAT_ZLIB) {
+            if (entry + 1 < entries.size()) {
+                const SeekEntry &begin = entries[entry];
+                const SeekEntry &end = entries[entry + 1];
+                job->input.resize(end.offset - begin.offset);
+                job->length = end.position - begin.position;
+                stream.seekg(begin.offset, std::ios::beg);
+                stream.read(&job->input[0], job->input.size());
+                ++entry;
+            }
+        } else {
+            job->input.resize(chunkSize);
+            job->input.resize(file->read(&job->input[0], chunkSize));
+        }
+
+        if (job->input.empty()) {
+            delete job;
+            return NULL;
+        }
+        return job;
+    }
+};
+
+
+class Repacker
+{
+private:
+    WorkerPool pool;
+    unsigned window;
+    size_t chunkSize;
+    Format format;
+    trace::Codec *codec;
+    size_t dictionarySize;
+
+    std::ofstream stream;
+    std::vector<SeekEntry> entries;
+    unsigned long long position;
+
+    std::deque<Job *> decompressing;
+    std::deque<Job *> compressing;
+    std::string pending;
+    bool started;
+    bool failed;
+
+    /**
+     * Make the dictionary out of evenly spaced slices of the pending data.
+     */
+    void
+    makeDictionary(void) {
+        const size_t sliceSize = 1024;
+        size_t size = std::min(dictionarySize, pending.size());
+        size_t slices = (size + sliceSize - 1) / sliceSize;
+        if (!slices) {
+            return;
+        }
+
+        std::string dictionary;
+        size_t stride = pending.size() / slices;
+        for (size_t i = 0; i < slices; ++i) {
+            size_t length = std::min(sliceSize, size - dictionary.size());
+            dictionary.append(pending, i * stride, length);
+        }
+        codec->setDictionary(dictionary);
+    }
+
+    /**
+     * Write the identifier and header, once the codec is set up.
+     */
+    void
+    start(void) {
+        if (format == FORMAT_CHUNKED) {
+            if (dictionarySize) {
+                makeDictionary();
+            }
+            stream.write(codec->magic(), 2);
+            codec->writeHeader(stream);
+        }
+        started = true;
+    }
+
+    void
+    compress(bool last) {
+        size_t offset = 0;
+        while (pending.size() - offset >= chunkSize ||
+               (last && offset < pending.size())) {
+            if (!started) {
+                start();
+            }
+            Job *job = new Job(Job::COMPRESS, format, codec);
+            job->length = std::min(chunkSize, pending.size() - offset);
+            job->input.assign(pending, offset, job->length);
+            offset += job->length;
+            compressing.push_back(job);
+            pool.submit(job);
+        }
+        pending.erase(0, offset);
+    }
+
+    void
+    write(Job *job) {
+        failed = failed || job->failed;
+
+        SeekEntry entry;
+        entry.offset = stream.tellp();
+        entry.position = position;
+        entries.push_back(entry);
+        position += job->length;
+
+        if (format == FORMAT_CHUNKED) {
+            size_t length = job->output.size();
+            unsigned char buf[4];
+            buf[0] = length & 0xff;
+            buf[1] = (length >> 8) & 0xff;
+            buf[2] = (length >> 16) & 0xff;
+            buf[3] = (length >> 24) & 0xff;
+            stream.write((const char *)buf, sizeof buf);
+        }
+        stream.write(job->output.data(), job->output.size());
+    }
+
+    /**
+     * Write the compressed chunks in order, waiting for them when there are
+     * too many in flight.
+     */
+    void
+    drain(bool all) {
+        while (!compressing.empty() &&
+               (all || compressing.size() > window ||
+                pool.isDone(compressing.front()))) {
+            Job *job = compressing.front();
+            pool.wait(job);
+            write(job);
+            compressing.pop_front();
+            delete job;
+        }
+    }
+
+public:
+    Repacker(unsigned jobs, size_t _chunkSize, trace::Codec *_codec,
+             size_t _dictionarySize) :
+        pool(jobs),
+        window(2 * jobs + 2),
+        chunkSize(_chunkSize),
+        format(_codec ? FORMAT_CHUNKED : FORMAT_ZLIB),
+        codec(_codec),
+        dictionarySize(_dictionarySize),
+        position(0),
+        started(false),
+        failed(false)
+    {}
+
+    ~Repacker() {
+        delete codec;
+    }
+
+    bool
+    repack(Reader &reader, const char *outFileName) {
+        stream.open(outFileName, std::ios::binary | std::ios::trunc);
+        if (!stream) {
+            std::cerr << "error: failed to create " << outFileName << "\n";
+            return false;
+        }
+        bool end = false;
+        while (!end || !decompressing.empty()) {
+            while (!end && decompressing.size() < window) {
+                Job *job = reader.read();
+                if (!job) {
+                    end = true;
+                    break;
+                }
+                decompressing.push_back(job);
+                pool.submit(job);
+            }
+
+            if (!decompressing.empty()) {
+                Job *job = decompressing.front();
+                pool.wait(job);
+                failed = failed || job->failed;
+                pending.append(job->output);
+                decompressing.pop_front();
+                delete job;
+            }
+
+            compress(false);
+            drain(false);
+        }
+
+        compress(true);
+        drain(true);
+        if (!started) {
+            start();
+        }
+
+        SeekEntry entry;
+        entry.offset = stream.tellp();
+        entry.position = position;
+        entries.push_back(entry);
+
+        stream.close();
+        if (failed || stream.fail()) {
+            std::cerr << "error: failed to repack into " << outFileName << "\n";
+            return false;
+        }
+
+        if (format == FORMAT_ZLIB) {
+            std::string seekFileName = std::string(outFileName) + ".seek";
+            if (!writeSeekIndex(seekFileName, "zlib", entries)) {
+                std::cerr << "warning: failed to write " << seekFileName << "\n";
+            }
+        }
+
+        return true;
+    }
+};
+
+
+static bool
+parseSize(const char *arg, size_t &size)
+{
+    char *end;
+    unsigned long value = strtoul(arg, &end, 0);
+    if (*end == 'k' || *end == 'K') {
+        value <<= 10;
+        ++end;
+    } else if (*end == 'm' || *end == 'M') {
+        value <<= 20;
+        ++end;
+    }
+    size = value;
+    return end != arg && *end == '\0';
+}
+
+
+static int
+repack(const char *inFileName, const char *outFileName,
+       unsigned jobs, size_t chunkSize, trace::Codec *codec,
+       size_t dictionarySize)
+{
+    Reader reader;
+    if (!reader.open(inFileName, chunkSize)) {
+        delete codec;
+        return 1;
+    }
+
+    Repacker repacker(jobs, chunkSize, codec, dictionarySize);
+    return repacker.repack(reader, outFileName) ? 0 : 1;
 }
 
 static int
 command(int argc, char *argv[])
 {
+    unsigned jobs = os::thread::hardware_concurrency();
+    size_t chunkSize = 1024 * 1024;
+    std::string codecName = "snappy";
+    int level = 0;
+    size_t dictionarySize = 0;
+
     int i;
 
     for (i = 0; i < argc; ++i) {
@@ -88,10 +734,31 @@ command(int argc, char *argv[])
         }
 
         if (!strcmp(arg, "--")) {
+            ++i;
             break;
         } else if (strcmp(arg, "--help") == 0) {
             usage();
             return 0;
+        } else if (!strcmp(arg, "-j") && i + 1 < argc) {
+            jobs = atoi(argv[++i]);
+        } else if (!strncmp(arg, "--jobs=", strlen("--jobs="))) {
+            jobs = atoi(arg + strlen("--jobs="));
+        } else if (!strncmp(arg, "--chunk-size=", strlen("--chunk-size="))) {
+            if (!parseSize(arg + strlen("--chunk-size="), chunkSize) ||
+                chunkSize < 4096 || chunkSize > 256 * 1024 * 1024) {
+                std::cerr << "error: chunk size must be between 4K and 256M\n";
+                return 1;
+            }
+        } else if (!strncmp(arg, "--codec=", strlen("--codec="))) {
+            codecName = arg + strlen("--codec=");
+        } else if (!strncmp(arg, "--level=", strlen("--level="))) {
+            level = atoi(arg + strlen("--level="));
+        } else if (!strncmp(arg, "--dictionary-size=", strlen("--dictionary-size="))) {
+            if (!parseSize(arg + strlen("--dictionary-size="), dictionarySize) ||
+                dictionarySize > MAX_DICTIONARY_SIZE) {
+                std::cerr << "error: dictionary size must be at most 32K\n";
+                return 1;
+            }
         } else {
             std::cerr << "error: unknown option " << arg << "\n";
             usage();
@@ -105,7 +772,32 @@ command(int argc, char *argv[])
         return 1;
     }
 
-    return repack(argv[i], argv[i + 1]);
+    if (jobs < 1) {
+        jobs = 1;
+    }
+
+    trace::Codec *codec = NULL;
+    if (codecName != "zlib") {
+        codec = trace::Codec::create(codecName);
+        if (!codec) {
+            std::cerr << "error: unknown codec " << codecName << "\n";
+            return 1;
+        }
+        if (level && !codec->setLevel(level)) {
+            std::cerr << "error: invalid level " << level << " for " << codecName << "\n";
+            delete codec;
+            return 1;
+        }
+        // Codecs without dictionaries are left alone
+        if (!codec->setDictionary(std::string())) {
+            dictionarySize = 0;
+        }
+    } else if (level) {
+        std::cerr << "error: zlib takes no level\n";
+        return 1;
+    }
+
+    return repack(argv[i], argv[i + 1], jobs, chunkSize, codec, dictionarySize);
 }
 
 const Command repack_command = {
@@ -0,0 +1,899 @@
+/**************************************************************************
+ *
+ * Copyright 2012 VMware, Inc.
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+/*
+ * Trim a trace down to some frames, plus the calls before them which set up
+ * the objects (textures, buffers, programs, framebuffers, etc) they depend
+ * on.
+ *
+ * Objects are recognized through the handle arguments and return values, as
+ * declared in the API specs, and through the targets they are bound to.  Any
+ * call which refers to several objects, such as attaching a texture to a
+ * framebuffer, or drawing into a framebuffer with a program, links them, and
+ * the calls before the frames are kept when they refer to an object linked
+ * to one the frames use.  Calls which refer to no objects, such as context
+ * creation or fixed function state, are kept, except for draws into the
+ * window, queries and frame markers.
+ */
+
+
+#include <string.h>
+#include <stdlib.h>
+
+#include <iostream>
+#include <map>
+#include <sstream>
+#include <string>
+#include <vector>
+
+#include "cli.hpp"
+#include "glhandles.hpp"
+
+#include "trace_callset.hpp"
+#include "trace_parser.hpp"
+#include "trace_writer.hpp"
+
+
+#define GL_TEXTURE0             0x84C0
+#define GL_ARRAY_BUFFER         0x8892
+#define GL_ELEMENT_ARRAY_BUFFER 0x8893
+#define GL_PIXEL_UNPACK_BUFFER  0x88EC
+#define GL_READ_FRAMEBUFFER     0x8CA8
+#define GL_DRAW_FRAMEBUFFER     0x8CA9
+#define GL_FRAMEBUFFER          0x8D40
+
+
+static const char *synopsis = "Trim a trace down to some frames and what they depend on.";
+
+static void
+usage(void)
+{
+    std::cout
+        << "usage: apitrace trim [OPTIONS] <trace-file>\n"
+        << synopsis << "\n"
+        "\n"
+        "The calls before the frames are only kept when they create or modify\n"
+        "objects (textures, buffers, programs, framebuffers, etc) the frames\n"
+        "depend on, or set state which is not tied to any object.\n"
+        "\n"
+        "    --frames=SET        Frames to keep, e.g. 10-20 (the first frame is 0)\n"
+        "    -o, --output=FILE   Trimmed trace (default: TRACE-trim.trace)\n";
+}
+
+
+enum Role {
+    ROLE_DROP = 0,
+    ROLE_KEEP,      // kept, and the objects it refers to are needed
+    ROLE_DEPEND     // kept if any object it refers to is needed
+};
+
+
+enum {
+    FUNCTION_BIND = 1 << 0,
+    FUNCTION_DELETE = 1 << 1,
+    FUNCTION_DRAW = 1 << 2,
+    FUNCTION_BEGIN = 1 << 3,
+    FUNCTION_END = 1 << 4,
+    FUNCTION_QUERY = 1 << 5,
+    FUNCTION_POINTER = 1 << 6,
+    FUNCTION_ACTIVE_TEXTURE = 1 << 7,
+    FUNCTION_CALL_LISTS = 1 << 8,
+    FUNCTION_COPY = 1 << 9,
+    FUNCTION_FRAME = 1 << 10,
+    FUNCTION_VERTEX_ARRAY = 1 << 11,
+    FUNCTION_UNPACK = 1 << 12
+};
+
+
+struct FunctionInfo {
+    std::vector<const HandleArg *> handles;
+    int target;
+    unsigned flags;
+};
+
+
+static bool
+startsWith(const char *name, const char *prefix) {
+    return strncmp(name, prefix, strlen(prefix)) == 0;
+}
+
+
+static unsigned
+functionFlags(const char *name) {
+    if (strstr(name, "SwapBuffers") ||
+        strcmp(name, "glFrameTerminatorGREMEDY") == 0) {
+        return FUNCTION_FRAME;
+    }
+
+    if (strcmp(name, "glBegin") == 0) {
+        return FUNCTION_BEGIN | FUNCTION_DRAW;
+    }
+    if (strcmp(name, "glNewList") == 0) {
+        return FUNCTION_BEGIN;
+    }
+    if (strcmp(name, "glEnd") == 0 ||
+        strcmp(name, "glEndList") == 0) {
+        return FUNCTION_END;
+    }
+
+    if (startsWith(name, "glGet") ||
+        startsWith(name, "glIs") ||
+        startsWith(name, "glReadPixels") ||
+        strcmp(name, "glFinish") == 0 ||
+        strcmp(name, "glFlush") == 0) {
+        return FUNCTION_QUERY;
+    }
+
+    if ((startsWith(name, "glDraw") && !startsWith(name, "glDrawBuffer")) ||
+        startsWith(name, "glMultiDraw") ||
+        startsWith(name, "glBlitFramebuffer") ||
+        startsWith(name, "glClearBuffer") ||
+        startsWith(name, "glRect") ||
+        strcmp(name, "glClear") == 0) {
+        return FUNCTION_DRAW;
+    }
+
+    if ((startsWith(name, "glBind") && !strstr(name, "Location")) ||
+        startsWith(name, "glUseProgram")) {
+        return FUNCTION_BIND;
+    }
+    if (startsWith(name, "glDelete")) {
+        return FUNCTION_DELETE;
+    }
+    if (startsWith(name, "glActiveTexture")) {
+        return FUNCTION_ACTIVE_TEXTURE;
+    }
+    if (startsWith(name, "glCallList")) {
+        return FUNCTION_CALL_LISTS;
+    }
+    if (startsWith(name, "glCopyTex")) {
+        return FUNCTION_COPY;
+    }
+    if (strstr(name, "Pointer")) {
+        return FUNCTION_POINTER;
+    }
+    if (startsWith(name, "glEnableVertexAttribArray") ||
+        startsWith(name, "glDisableVertexAttribArray") ||
+        startsWith(name, "glVertexAttribDivisor") ||
+        startsWith(name, "glEnableClientState") ||
+        startsWith(name, "glDisableClientState")) {
+        return FUNCTION_VERTEX_ARRAY;
+    }
+    if (startsWith(name, "glTexImage") ||
+        startsWith(name, "glTexSubImage") ||
+        startsWith(name, "glTextureImage") ||
+        startsWith(name, "glTextureSubImage") ||
+        startsWith(name, "glMultiTexImage") ||
+        startsWith(name, "glMultiTexSubImage") ||
+        startsWith(name, "glCompressedTex") ||
+        startsWith(name, "glCompressedMultiTex")) {
+        return FUNCTION_UNPACK;
+    }
+
+    return 0;
+}
+
+
+static bool
+toNumber(const trace::Value *value, unsigned long long &number) {
+    if (const trace::SInt *sint = dynamic_cast<const trace::SInt *>(value)) {
+        number = sint->value;
+    } else if (const trace::UInt *uint = dynamic_cast<const trace::UInt *>(value)) {
+        number = uint->value;
+    } else if (const trace::Enum *e = dynamic_cast<const trace::Enum *>(value)) {
+        number = e->sig->value;
+    } else {
+        return false;
+    }
+    return true;
+}
+
+
+class Analyzer
+{
+private:
+    std::map<std::string, std::vector<const HandleArg *> > handlesByName;
+    std::vector<FunctionInfo *> functions;
+
+    // Current object of each kind and name, as names are reused once deleted
+    typedef std::pair<std::string, unsigned long long> Name;
+    std::map<Name, unsigned> objects;
+    std::vector<Name> objectNames;
+    std::vector<unsigned> parents;
+
+    // The binds which are replaced before anything uses them can be left out
+    struct Binding {
+        unsigned object;
+        unsigned callNo;
+        bool used;
+    };
+    typedef std::map<std::string, Binding> BindingMap;
+    BindingMap bindings;
+    std::vector<unsigned> unusedBinds;
+    unsigned activeTexture;
+
+    // Vertex arrays hold the pointers, enables and element array set while
+    // they are bound, so binding them is always needed
+    unsigned long long vertexArray;
+
+    // glBegin/glEnd and glNewList/glEndList blocks share the fate of the
+    // call that started them
+    struct Block {
+        Role role;
+        std::vector<unsigned> objects;
+    };
+    std::vector<Block> blocks;
+
+    bool callsLists;
+
+public:
+    Analyzer() :
+        activeTexture(0),
+        vertexArray(0),
+        callsLists(false)
+    {
+        for (const HandleArg *handle = handleArgs; handle->function; ++handle) {
+            handlesByName[handle->function].push_back(handle);
+        }
+    }
+
+    ~Analyzer() {
+        for (unsigned i = 0; i < functions.size(); ++i) {
+            delete functions[i];
+        }
+    }
+
+    /**
+     * Find the role of a call, and the objects it refers to, while
+     * following the bindings.  Calls in the frames being kept are always
+     * kept.
+     */
+    Role
+    analyze(trace::Call *call, bool inFrames, std::vector<unsigned> &callObjects);
+
+    void
+    getBoundObjects(std::vector<unsigned> &boundObjects);
+
+    /**
+     * Numbers of the binds replaced before any call used them.
+     */
+    const std::vector<unsigned> &
+    getUnusedBinds(void) const {
+        return unusedBinds;
+    }
+
+    /**
+     * Find the objects linked to any of the given ones.
+     */
+    void
+    markNeeded(const std::vector<unsigned> &roots, std::vector<bool> &needed);
+
+private:
+    const FunctionInfo &
+    getFunctionInfo(const trace::FunctionSig *sig);
+
+    unsigned
+    lookupObject(const char *kind, unsigned long long name);
+
+    unsigned
+    find(unsigned object);
+
+    void
+    link(unsigned one, unsigned two);
+
+    bool
+    lookupBinding(const std::string &key, unsigned &object);
+
+    bool
+    lookupBinding(unsigned long long target, unsigned &object);
+
+    void
+    setBinding(const std::string &key, unsigned object, unsigned callNo, bool used);
+
+    void
+    bind(trace::Call *call, const FunctionInfo &info,
+         const char *kind, unsigned long long name);
+
+    void
+    addHandles(trace::Call *call, const FunctionInfo &info,
+               std::vector<unsigned> &linked, std::vector<unsigned> &listed);
+};
+
+
+const FunctionInfo &
+Analyzer::getFunctionInfo(const trace::FunctionSig *sig) {
+    if (sig->id >= functions.size()) {
+        functions.resize(sig->id + 1);
+    }
+
+    FunctionInfo *info = functions[sig->id];
+    if (!info) {
+        info = new FunctionInfo;
+        info->handles = handlesByName[sig->name];
+        info->target = -1;
+        for (unsigned i = 0; i < sig->num_args; ++i) {
+            if (strcmp(sig->arg_names[i], "target") == 0) {
+                info->target = i;
+            }
+        }
+        info->flags = functionFlags(sig->name);
+        functions[sig->id] = info;
+    }
+    return *info;
+}
+
+
+unsigned
+Analyzer::lookupObject(const char *kind, unsigned long long name) {
+    Name key(kind, name);
+    std::map<Name, unsigned>::iterator it = objects.find(key);
+    if (it != objects.end()) {
+        return it->second;
+    }
+
+    unsigned object = parents.size();
+    parents.push_back(object);
+    objectNames.push_back(key);
+    objects[key] = object;
+    return object;
+}
+
+
+unsigned
+Analyzer::find(unsigned object) {
+    while (parents[object] != object) {
+        parents[object] = parents[parents[object]];
+        object = parents[object];
+    }
+    return object;
+}
+
+
+void
+Analyzer::link(unsigned one, unsigned two) {
+    one = find(one);
+    two = find(two);
+    if (one != two) {
+        parents[two] = one;
+    }
+}
+
+
+bool
+Analyzer::lookupBinding(const std::string &key, unsigned &object) {
+    BindingMap::iterator it = bindings.find(key);
+    if (it == bindings.end()) {
+        return false;
+    }
+    it->second.used = true;
+    object = it->second.object;
+    return true;
+}
+
+
+bool
+Analyzer::lookupBinding(unsigned long long target, unsigned &object) {
+    std::ostringstream key;
+    key << target << "@" << activeTexture;
+    std::ostringstream unitless;
+    unitless << target;
+    if (target == GL_ELEMENT_ARRAY_BUFFER) {
+        unitless << "#" << vertexArray;
+    }
+    return lookupBinding(key.str(), object) ||
+           lookupBinding(unitless.str(), object);
+}
+
+
+void
+Analyzer::setBinding(const std::string &key, unsigned object, unsigned callNo, bool used) {
+    BindingMap::iterator it = bindings.find(key);
+    if (it != bindings.end()) {
+        if (!it->second.used) {
+            unusedBinds.push_back(it->second.callNo);
+        }
+        if (object == ~0U) {
+            bindings.erase(it);
+            return;
+        }
+    } else if (object == ~0U) {
+        return;
+    }
+
+    Binding &binding = bindings[key];
+    binding.object = object;
+    binding.callNo = callNo;
+    binding.used = used;
+}
+
+
+/*
+ * Bindings are keyed by the target, or by the kind of object when there is
+ * none, followed by any other numeric argument such as an index, and by the
+ * active unit for textures, or the bound vertex array for element arrays.
+ */
+void
+Analyzer::bind(trace::Call *call, const FunctionInfo &info,
+               const char *kind, unsigned long long name) {
+    unsigned long long target = 0;
+    std::ostringstream key;
+    if (info.target >= 0 && toNumber(call->args[info.target], target)) {
+        key << target;
+    } else {
+        key << kind;
+    }
+
+    for (unsigned i = 0; i < call->args.size(); ++i) {
+        bool isHandle = false;
+        for (unsigned j = 0; j < info.handles.size(); ++j) {
+            isHandle = isHandle || info.handles[j]->arg == (int)i;
+        }
+        unsigned long long number;
+        if ((int)i != info.target && !isHandle &&
+            toNumber(call->args[i], number)) {
+            key << ":" << number;
+        }
+    }
+
+    if (strcmp(kind, "texture") == 0 && info.target >= 0) {
+        key << "@" << activeTexture;
+    }
+    if (target == GL_ELEMENT_ARRAY_BUFFER) {
+        key << "#" << vertexArray;
+    }
+
+    std::vector<std::string> keys;
+    keys.push_back(key.str());
+    if (target == GL_FRAMEBUFFER || target == GL_DRAW_FRAMEBUFFER) {
+        // Framebuffer calls with the generic target refer to the draw one
+        std::ostringstream draw, generic;
+        draw << GL_DRAW_FRAMEBUFFER;
+        generic << GL_FRAMEBUFFER;
+        keys.push_back(draw.str());
+        keys.push_back(generic.str());
+    }
+    if (target == GL_FRAMEBUFFER) {
+        std::ostringstream read;
+        read << GL_READ_FRAMEBUFFER;
+        keys.push_back(read.str());
+    }
+
+    // Binds into several targets, or within display lists, are always kept
+    bool used = keys.size() > 1 || !blocks.empty();
+    unsigned object = name ? lookupObject(kind, name) : ~0U;
+
+    // Containers are bound to be used later, and so is what is bound into
+    // them
+    unsigned container;
+    if (strcmp(kind, "array") == 0) {
+        used = true;
+    } else if (target == GL_ELEMENT_ARRAY_BUFFER &&
+               lookupBinding(std::string("array"), container)) {
+        used = true;
+        if (object != ~0U) {
+            link(container, object);
+        }
+    }
+
+    for (unsigned i = 0; i < keys.size(); ++i) {
+        setBinding(keys[i], object, call->no, used);
+    }
+
+    if (strcmp(kind, "array") == 0) {
+        vertexArray = name;
+    }
+}
+
+
+/*
+ * Objects given as single handles are linked together, while those in
+ * arrays, as generated or deleted together, are merely listed.
+ */
+void
+Analyzer::addHandles(trace::Call *call, const FunctionInfo &info,
+                     std::vector<unsigned> &linked, std::vector<unsigned> &listed) {
+    bool hasProgram = false;
+    for (unsigned i = 0; i < info.handles.size(); ++i) {
+        const char *kind = info.handles[i]->kind;
+        hasProgram = hasProgram ||
+                     strcmp(kind, "program") == 0 ||
+                     strcmp(kind, "handleARB") == 0;
+    }
+
+    for (unsigned i = 0; i < info.handles.size(); ++i) {
+        const HandleArg *handle = info.handles[i];
+
+        if (strcmp(handle->kind, "location") == 0) {
+            // Locations belong to the program given, or the current one
+            unsigned program;
+            if (!hasProgram &&
+                (lookupBinding(std::string("program"), program) ||
+                 lookupBinding(std::string("handleARB"), program))) {
+                linked.push_back(program);
+            }
+            continue;
+        }
+
+        trace::Value *value;
+        if (handle->arg < 0) {
+            value = call->ret;
+        } else if ((unsigned)handle->arg < call->args.size()) {
+            value = call->args[handle->arg];
+        } else {
+            value = NULL;
+        }
+        if (!value) {
+            continue;
+        }
+
+        unsigned long long name;
+        if (trace::Array *array = dynamic_cast<trace::Array *>(value)) {
+            for (unsigned j = 0; j < array->values.size(); ++j) {
+                if (toNumber(array->values[j], name) && name) {
+                    listed.push_back(lookupObject(handle->kind, name));
+                }
+            }
+        } else if (toNumber(value, name) && name) {
+            unsigned long long count = 1;
+            if (handle->range >= 0 &&
+                (unsigned)handle->range < call->args.size()) {
+                toNumber(call->args[handle->range], count);
+            }
+            if (count == 1) {
+                linked.push_back(lookupObject(handle->kind, name));
+            } else {
+                for (unsigned long long j = 0; j < count; ++j) {
+                    listed.push_back(lookupObject(handle->kind, name + j));
+                }
+            }
+        }
+    }
+}
+
+
+Role
+Analyzer::analyze(trace::Call *call, bool inFrames, std::vector<unsigned> &callObjects) {
+    const FunctionInfo &info = getFunctionInfo(call->sig);
+
+    std::vector<unsigned> linked;
+    std::vector<unsigned> listed;
+    addHandles(call, info, linked, listed);
+
+    unsigned long long target;
+    unsigned object;
+    if (!(info.flags & FUNCTION_BIND) &&
+        info.target >= 0 &&
+        toNumber(call->args[info.target], target) &&
+        lookupBinding(target, object)) {
+        linked.push_back(object);
+    }
+
+    if (info.flags & FUNCTION_COPY &&
+        lookupBinding(GL_READ_FRAMEBUFFER, object)) {
+        linked.push_back(object);
+    }
+
+    if (info.flags & FUNCTION_POINTER &&
+        lookupBinding(GL_ARRAY_BUFFER, object)) {
+        linked.push_back(object);
+    }
+
+    // Uploads may read from a pixel buffer instead of memory
+    if (info.flags & FUNCTION_UNPACK &&
+        lookupBinding(GL_PIXEL_UNPACK_BUFFER, object)) {
+        linked.push_back(object);
+    }
+
+    if (info.flags & (FUNCTION_POINTER | FUNCTION_VERTEX_ARRAY) &&
+        lookupBinding(std::string("array"), object)) {
+        linked.push_back(object);
+    }
+
+    if (info.flags & FUNCTION_CALL_LISTS) {
+        // glCallLists gives the lists in a blob
+        callsLists = true;
+    }
+
+    Role role;
+    if (!blocks.empty()) {
+        role = blocks.back().role;
+        linked.insert(linked.end(),
+                      blocks.back().objects.begin(),
+                      blocks.back().objects.end());
+    } else if (inFrames) {
+        role = ROLE_KEEP;
+    } else if (info.flags & (FUNCTION_FRAME | FUNCTION_QUERY)) {
+        role = linked.empty() && listed.empty() ? ROLE_DROP : ROLE_DEPEND;
+    } else if (info.flags & FUNCTION_DRAW) {
+        // Draws before the frames only matter when they render into
+        // objects, and then depend on everything bound
+        if (lookupBinding(GL_DRAW_FRAMEBUFFER, object)) {
+            role = ROLE_DEPEND;
+            getBoundObjects(linked);
+        } else {
+            role = ROLE_DROP;
+        }
+    } else if (info.flags & (FUNCTION_POINTER | FUNCTION_CALL_LISTS)) {
+        role = ROLE_KEEP;
+    } else {
+        role = linked.empty() && listed.empty() ? ROLE_KEEP : ROLE_DEPEND;
+    }
+
+    for (unsigned i = 1; i < linked.size(); ++i) {
+        link(linked[0], linked[i]);
+    }
+    if (!linked.empty()) {
+        for (unsigned i = 0; i < listed.size(); ++i) {
+            link(linked[0], listed[i]);
+        }
+    }
+
+    callObjects.clear();
+    callObjects.insert(callObjects.end(), linked.begin(), linked.end());
+    callObjects.insert(callObjects.end(), listed.begin(), listed.end());
+
+    if (info.flags & FUNCTION_BEGIN) {
+        Block block;
+        block.role = role;
+        block.objects = linked;
+        blocks.push_back(block);
+    } else if (info.flags & FUNCTION_END && !blocks.empty()) {
+        blocks.pop_back();
+    }
+
+    if (info.flags & FUNCTION_BIND && info.handles.size() == 1) {
+        const HandleArg *handle = info.handles[0];
+        unsigned long long name;
+        if (handle->arg >= 0 &&
+            (unsigned)handle->arg < call->args.size() &&
+            toNumber(call->args[handle->arg], name)) {
+            bind(call, info, handle->kind, name);
+        }
+    }
+
+    if (info.flags & FUNCTION_ACTIVE_TEXTURE) {
+        unsigned long long unit;
+        if (!call->args.empty() && toNumber(call->args[0], unit)) {
+            activeTexture = unit - GL_TEXTURE0;
+        }
+    }
+
+    if (info.flags & FUNCTION_DELETE) {
+        // Later objects with the same names are new ones
+        for (unsigned i = 0; i < callObjects.size(); ++i) {
+            objects.erase(objectNames[callObjects[i]]);
+        }
+    }
+
+    return role;
+}
+
+
+void
+Analyzer::getBoundObjects(std::vector<unsigned> &boundObjects) {
+    BindingMap::iterator it;
+    for (it = bindings.begin(); it != bindings.end(); ++it) {
+        it->second.used = true;
+        boundObjects.push_back(it->second.object);
+    }
+}
+
+
+void
+Analyzer::markNeeded(const std::vector<unsigned> &roots, std::vector<bool> &needed) {
+    std::vector<bool> neededRoots(parents.size());
+    for (unsigned i = 0; i < roots.size(); ++i) {
+        neededRoots[find(roots[i])] = true;
+    }
+
+    needed.resize(parents.size());
+    for (unsigned object = 0; object < parents.size(); ++object) {
+        needed[object] = neededRoots[find(object)] ||
+                         (callsLists && objectNames[object].first == "list");
+    }
+}
+
+
+static bool
+isFrameMarker(const trace::Call *call) {
+    return functionFlags(call->name()) == FUNCTION_FRAME;
+}
+
+
+static int
+trim(const char *inFileName, const char *outFileName, const trace::CallSet &frames)
+{
+    trace::Parser parser;
+    if (!parser.open(inFileName)) {
+        std::cerr << "error: failed to open " << inFileName << "\n";
+        return 1;
+    }
+
+    Analyzer analyzer;
+
+    // Roles by call number, and the objects the calls which depend on them
+    // refer to, as pairs of call numbers and objects
+    std::vector<unsigned char> roles;
+    std::vector<std::pair<unsigned, unsigned> > dependencies;
+    std::vector<unsigned> callObjects;
+    std::vector<unsigned> roots;
+
+    unsigned lastFrame = frames.getLast();
+    unsigned frame = 0;
+    bool frameStart = true;
+    trace::Call *call;
+    while (frame <= lastFrame && (call = parser.parse_call())) {
+        bool inFrames = frames.contains(frame);
+        if (frameStart && inFrames) {
+            // Whatever is bound when a frame starts is used by it
+            analyzer.getBoundObjects(roots);
+        }
+        frameStart = false;
+
+        Role role = analyzer.analyze(call, inFrames, callObjects);
+
+        if (call->no >= roles.size()) {
+            roles.resize(call->no + 1, ROLE_DROP);
+        }
+        roles[call->no] = role;
+        if (role == ROLE_KEEP) {
+            roots.insert(roots.end(), callObjects.begin(), callObjects.end());
+        } else if (role == ROLE_DEPEND) {
+            for (unsigned i = 0; i < callObjects.size(); ++i) {
+                dependencies.push_back(std::make_pair(call->no, callObjects[i]));
+            }
+        }
+
+        if (isFrameMarker(call)) {
+            ++frame;
+            frameStart = true;
+        }
+
+        delete call;
+    }
+
+    if (frames.getFirst() >= frame) {
+        std::cerr << "error: " << inFileName << " has only " << frame << " frames\n";
+        return 1;
+    }
+
+    std::vector<bool> needed;
+    analyzer.markNeeded(roots, needed);
+
+    std::vector<bool> keep(roles.size());
+    for (unsigned no = 0; no < roles.size(); ++no) {
+        keep[no] = roles[no] == ROLE_KEEP;
+    }
+    for (unsigned i = 0; i < dependencies.size(); ++i) {
+        if (needed[dependencies[i].second]) {
+            keep[dependencies[i].first] = true;
+        }
+    }
+    const std::vector<unsigned> &unusedBinds = analyzer.getUnusedBinds();
+    for (unsigned i = 0; i < unusedBinds.size(); ++i) {
+        if (roles[unusedBinds[i]] == ROLE_DEPEND) {
+            keep[unusedBinds[i]] = false;
+        }
+    }
+
+    trace::Writer writer;
+    if (!writer.open(outFileName)) {
+        std::cerr << "error: failed to create " << outFileName << "\n";
+        return 1;
+    }
+
+    parser.close();
+    parser.open(inFileName);
+    unsigned kept = 0;
+    while ((call = parser.parse_call())) {
+        if (call->no >= keep.size()) {
+            delete call;
+            break;
+        }
+        if (keep[call->no]) {
+            writer.writeCall(call);
+            ++kept;
+        }
+        delete call;
+    }
+    writer.close();
+
+    std::cerr << "info: kept " << kept << " of " << roles.size() << " calls\n";
+
+    return 0;
+}
+
+
+static int
+command(int argc, char *argv[])
+{
+    trace::CallSet frames;
+    std::string outFileName;
+
+    int i;
+    for (i = 0; i < argc; ++i) {
+        const char *arg = argv[i];
+
+        if (arg[0] != '-') {
+            break;
+        }
+
+        if (!strcmp(arg, "--")) {
+            ++i;
+            break;
+        } else if (!strcmp(arg, "--help")) {
+            usage();
+            return 0;
+        } else if (!strncmp(arg, "--frames=", strlen("--frames="))) {
+            if (!frames.parse(arg + strlen("--frames="))) {
+                std::cerr << "error: invalid frames " << arg + strlen("--frames=") << "\n";
+                return 1;
+            }
+        } else if (!strcmp(arg, "-o")) {
+            if (i + 1 >= argc) {
+                std::cerr << "error: -o requires a file name\n";
+                return 1;
+            }
+            outFileName = argv[++i];
+        } else if (!strncmp(arg, "--output=", strlen("--output="))) {
+            outFileName = arg + strlen("--output=");
+        } else {
+            std::cerr << "error: unknown option " << arg << "\n";
+            usage();
+            return 1;
+        }
+    }
+
+    if (i + 1 != argc) {
+        std::cerr << "error: expected one trace file\n";
+        usage();
+        return 1;
+    }
+
+    if (frames.empty()) {
+        std::cerr << "error: no frames given\n";
+        usage();
+        return 1;
+    }
+
+    const char *inFileName = argv[i];
+    if (outFileName.empty()) {
+        outFileName = inFileName;
+        size_t dot = outFileName.rfind(".trace");
+        if (dot != std::string::npos && dot + strlen(".trace") == outFileName.size()) {
+            outFileName.erase(dot);
+        }
+        outFileName += "-trim.trace";
+    }
+
+    return trim(inFileName, outFileName.c_str(), frames);
+}
+
+const Command trim_command = {
+    "trim",
+    synopsis,
+    usage,
+    command
+};
@@ -0,0 +1,53 @@
+/**************************************************************************
+ *
+ * Copyright 2012 VMware, Inc.
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+/*
+ * Table of the GL function arguments and return values which are object
+ * handles, generated from the API specs by glhandles.py.
+ */
+
+#ifndef _GLHANDLES_HPP_
+#define _GLHANDLES_HPP_
+
+
+struct HandleArg {
+    const char *function;
+
+    // Index of the argument, or -1 for the return value
+    int arg;
+
+    // Kind of object, as named in the specs, e.g. "texture"
+    const char *kind;
+
+    // Index of the argument with the number of consecutive handles, or -1
+    int range;
+};
+
+
+// Terminated by an entry with a NULL function
+extern const HandleArg handleArgs[];
+
+
+#endif /* _GLHANDLES_HPP_ */
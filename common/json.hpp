@@ -25,6 +25,23 @@
 
 /*
  * Trace writing functions.
+ *
+ * Besides JSON text, the same tree can be written in a compact binary
+ * encoding, which is much faster to write and to parse when there is a lot
+ * of image data.  Each document starts with the 4 bytes "\x89JSB", followed
+ * by the root object, where every value starts with a tag byte:
+ *
+ *   '{' member* '}'      object
+ *   ':' len name         member name, followed by its value
+ *   '[' value* ']'       array
+ *   'n' 't' 'f'          null, true, false
+ *   'i' varint           integer, zig-zag encoded
+ *   'd' double           64-bit little-endian IEEE double
+ *   's' len bytes        string
+ *   'b' len bytes        blob; blobs are implicitly numbered from zero
+ *   'r' varint           reference to a previous identical blob
+ *
+ * where lengths are unsigned LEB128 varints.
  */
 
 #ifndef _JSON_HPP_
@@ -32,15 +49,28 @@
 
 #include <assert.h>
 #include <stddef.h>
+#include <string.h>
 #include <wchar.h>
 
 #include <iomanip>
+#include <limits>
+#include <map>
 #include <ostream>
+#include <set>
+#include <sstream>
 #include <string>
 
 
 class JSONWriter
 {
+public:
+    /**
+     * Text of the members previously written, per top-level member, used to
+     * write only what changed since (see setDelta).
+     */
+    typedef std::map<std::string, std::string> MemberMap;
+    typedef std::map<std::string, MemberMap> DeltaCache;
+
 private:
     std::ostream &os;
 
@@ -48,6 +78,129 @@ private:
     bool value;
     char space;
 
+    bool binary;
+
+    /*
+     * In binary mode, identical blobs are written only once.  Blobs are
+     * looked up by their size and a 64-bit FNV-1a hash of their contents,
+     * and a copy of each is kept to rule out collisions.
+     */
+    typedef std::multimap<std::pair<size_t, unsigned long long>,
+                          std::pair<unsigned, std::string> > BlobMap;
+    BlobMap blobs;
+    unsigned numBlobs;
+
+    DeltaCache *delta;
+    std::string section;
+    std::string member;
+    std::set<std::string> written;
+    std::ostringstream buffer;
+    std::streambuf *outbuf;
+    size_t bodyStart;
+    bool savedValue;
+    char savedSpace;
+
+    /*
+     * In delta mode, second level members are written into a buffer, and
+     * only copied to the output if their text differs from the previous one.
+     */
+
+    void beginDeltaMember(const char *name) {
+        savedValue = value;
+        savedSpace = space;
+        member = name;
+        buffer.str("");
+        outbuf = os.rdbuf(buffer.rdbuf());
+    }
+
+    void endDeltaMember(void) {
+        if (!outbuf) {
+            return;
+        }
+
+        os.rdbuf(outbuf);
+        outbuf = NULL;
+
+        std::string text = buffer.str();
+        std::string body = text.substr(bodyStart);
+
+        written.insert(member);
+
+        MemberMap &members = (*delta)[section];
+        MemberMap::iterator it = members.find(member);
+        if (it != members.end() && it->second == body) {
+            // Unchanged -- pretend it was never written
+            value = savedValue;
+            space = savedSpace;
+        } else {
+            os << text;
+            members[member] = body;
+        }
+    }
+
+    /*
+     * Write members which were present in the previous dump but not anymore
+     * as null.
+     */
+    void endDeltaSection(void) {
+        endDeltaMember();
+
+        MemberMap &members = (*delta)[section];
+        MemberMap::iterator it = members.begin();
+        while (it != members.end()) {
+            if (written.find(it->first) == written.end()) {
+                if (binary) {
+                    writeTag(':');
+                    writeBytes(it->first.data(), it->first.size());
+                    writeTag('n');
+                    members.erase(it++);
+                    continue;
+                }
+                space = 0;
+                separator();
+                newline();
+                escapeAsciiString(it->first.c_str());
+                os << ": null";
+                value = true;
+                space = 0;
+                members.erase(it++);
+            } else {
+                ++it;
+            }
+        }
+
+        written.clear();
+    }
+
+    inline void writeTag(char tag) {
+        os.put(tag);
+    }
+
+    void writeVarUInt(unsigned long long n) {
+        do {
+            unsigned char byte = n & 0x7f;
+            n >>= 7;
+            if (n) {
+                byte |= 0x80;
+            }
+            os.put(byte);
+        } while (n);
+    }
+
+    void writeBytes(const void *bytes, size_t size) {
+        writeVarUInt(size);
+        os.write((const char *)bytes, size);
+    }
+
+    void writeDouble(double d) {
+        unsigned long long bits;
+        memcpy(&bits, &d, sizeof bits);
+        for (unsigned i = 0; i < 8; ++i) {
+            os.put((char)(bits & 0xff));
+            bits >>= 8;
+        }
+    }
+
     void newline(void) {
         os << "\n";
         for (int i = 0; i < level; ++i) 
@@ -202,21 +355,51 @@ private:
     }
 
 public:
-    JSONWriter(std::ostream &_os) : 
+    JSONWriter(std::ostream &_os, bool _binary = false) : 
         os(_os), 
         level(0),
         value(false),
-        space(0)
+        space(0),
+        binary(_binary),
+        numBlobs(0),
+        delta(NULL),
+        outbuf(NULL),
+        bodyStart(0),
+        savedValue(false),
+        savedSpace(0)
     {
+        if (binary) {
+            os.write("\x89JSB", 4);
+        }
         beginObject();
     }
 
+    /**
+     * Only write the second level members whose value changed since they
+     * were last written with the same cache; members which disappeared are
+     * written as null.
+     */
+    void setDelta(DeltaCache *cache) {
+        delta = cache;
+    }
+
     ~JSONWriter() {
         endObject();
-        newline();
+        if (!binary) {
+            newline();
+        }
+    }
+
+    inline bool isBinary(void) const {
+        return binary;
     }
 
     inline void beginObject() {
+        if (binary) {
+            writeTag('{');
+            ++level;
+            return;
+        }
         separator();
         os << "{";
         ++level;
@@ -224,7 +407,14 @@ public:
     }
 
     inline void endObject() {
+        if (delta && level == 2) {
+            endDeltaSection();
+        }
         --level;
+        if (binary) {
+            writeTag('}');
+            return;
+        }
         if (value)
             newline();
         os << "}";
@@ -233,9 +423,28 @@ public:
     }
 
     inline void beginMember(const char * name) {
+        if (delta) {
+            if (level == 1) {
+                section = name;
+            } else if (level == 2) {
+                endDeltaMember();
+                beginDeltaMember(name);
+            }
+        }
+        if (binary) {
+            if (outbuf && level == 2) {
+                bodyStart = buffer.str().size();
+            }
+            writeTag(':');
+            writeBytes(name, strlen(name));
+            return;
+        }
         space = 0;
         separator();
         newline();
+        if (outbuf && level == 2) {
+            bodyStart = buffer.str().size();
+        }
         escapeAsciiString(name);
         os << ": ";
         value = false;
@@ -246,12 +455,20 @@ public:
     }
 
     inline void endMember(void) {
+        if (binary) {
+            return;
+        }
         assert(value);
         value = true;
         space = 0;
     }
 
     inline void beginArray() {
+        if (binary) {
+            writeTag('[');
+            ++level;
+            return;
+        }
         separator();
         os << "[";
         ++level;
@@ -261,6 +478,10 @@ public:
 
     inline void endArray(void) {
         --level;
+        if (binary) {
+            writeTag(']');
+            return;
+        }
         if (space == '\n') {
             newline();
         }
@@ -275,6 +496,12 @@ public:
             return;
         }
 
+        if (binary) {
+            writeTag('s');
+            writeBytes(s, strlen(s));
+            return;
+        }
+
         separator();
         escapeUnicodeString(s);
         value = true;
@@ -286,13 +513,61 @@ public:
     }
 
     inline void writeBase64(const void *bytes, size_t size) {
+        if (binary) {
+            writeBlob(bytes, size);
+            return;
+        }
         separator();
         encodeBase64String((const unsigned char *)bytes, size);
         value = true;
         space = ' ';
     }
 
+    /**
+     * Write opaque data: a blob in binary mode, or a base64 string otherwise.
+     */
+    void writeBlob(const void *bytes, size_t size) {
+        if (!binary) {
+            writeBase64(bytes, size);
+            return;
+        }
+
+        // Blobs written inside delta members may never reach the output, so
+        // they can't be referred to.
+        if (delta) {
+            writeTag('b');
+            writeBytes(bytes, size);
+            return;
+        }
+
+        unsigned long long hash = 14695981039346656037ULL;
+        const unsigned char *p = (const unsigned char *)bytes;
+        for (size_t i = 0; i < size; ++i) {
+            hash = (hash ^ p[i]) * 1099511628211ULL;
+        }
+
+        BlobMap::key_type key(size, hash);
+        std::pair<BlobMap::iterator, BlobMap::iterator> range = blobs.equal_range(key);
+        for (BlobMap::iterator it = range.first; it != range.second; ++it) {
+            const std::string &stored = it->second.second;
+            if (size == 0 || memcmp(stored.data(), bytes, size) == 0) {
+                writeTag('r');
+                writeVarUInt(it->second.first);
+                return;
+            }
+        }
+
+        blobs.insert(BlobMap::value_type(key,
+            BlobMap::mapped_type(numBlobs++, std::string((const char *)bytes, size))));
+        writeTag('b');
+        writeBytes(bytes, size);
+    }
+
     inline void writeNull(void) {
+        if (binary) {
+            writeTag('n');
+            return;
+        }
         separator();
         os << "null";
         value = true;
@@ -300,6 +575,10 @@ public:
     }
 
     inline void writeBool(bool b) {
+        if (binary) {
+            writeTag(b ? 't' : 'f');
+            return;
+        }
         separator();
         os << (b ? "true" : "false");
         value = true;
@@ -311,6 +590,15 @@ public:
         if (n != n) {
             // NaN
             writeNull();
+        } else if (binary) {
+            if (std::numeric_limits<T>::is_integer) {
+                long long i = (long long)n;
+                writeTag('i');
+                writeVarUInt(((unsigned long long)i << 1) ^ (unsigned long long)(i >> 63));
+            } else {
+                writeTag('d');
+                writeDouble((double)n);
+            }
         } else {
             separator();
             os << std::dec << std::setprecision(9) << n;
@@ -0,0 +1,329 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+/*
+ * Simple threading abstraction, loosely modeled after C++11's <thread>,
+ * <mutex>, and <condition_variable>.
+ */
+
+#ifndef _OS_THREAD_HPP_
+#define _OS_THREAD_HPP_
+
+
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <pthread.h>
+#include <unistd.h>
+#endif
+
+
+namespace os {
+
+
+class mutex
+{
+private:
+#ifdef _WIN32
+    CRITICAL_SECTION native;
+#else
+    pthread_mutex_t native;
+#endif
+
+    // Not copyable
+    mutex(const mutex &);
+    mutex & operator = (const mutex &);
+
+    friend class condition_variable;
+
+public:
+    mutex() {
+#ifdef _WIN32
+        InitializeCriticalSection(&native);
+#else
+        pthread_mutex_init(&native, NULL);
+#endif
+    }
+
+    ~mutex() {
+#ifdef _WIN32
+        DeleteCriticalSection(&native);
+#else
+        pthread_mutex_destroy(&native);
+#endif
+    }
+
+    inline void
+    lock(void) {
+#ifdef _WIN32
+        EnterCriticalSection(&native);
+#else
+        pthread_mutex_lock(&native);
+#endif
+    }
+
+    inline void
+    unlock(void) {
+#ifdef _WIN32
+        LeaveCriticalSection(&native);
+#else
+        pthread_mutex_unlock(&native);
+#endif
+    }
+};
+
+
+/**
+ * Locks a mutex for the duration of a scope.
+ */
+class scoped_lock
+{
+private:
+    mutex &m;
+
+    scoped_lock(const scoped_lock &);
+    scoped_lock & operator = (const scoped_lock &);
+
+public:
+    scoped_lock(mutex &_m) : m(_m) {
+        m.lock();
+    }
+
+    ~scoped_lock() {
+        m.unlock();
+    }
+};
+
+
+/**
+ * Condition variable.
+ *
+ * Windows only has native condition variables since Vista, so there they are
+ * made of semaphores: waiters are woken through one, and acknowledge being
+ * woken through another, so that a wake up can't be taken by a thread which
+ * started waiting after it.
+ */
+class condition_variable
+{
+private:
+#ifdef _WIN32
+    CRITICAL_SECTION lock;
+    HANDLE waitSemaphore;
+    HANDLE doneSemaphore;
+    long waiting;
+    long signals;
+#else
+    pthread_cond_t native;
+#endif
+
+    condition_variable(const condition_variable &);
+    condition_variable & operator = (const condition_variable &);
+
+public:
+    condition_variable() {
+#ifdef _WIN32
+        InitializeCriticalSection(&lock);
+        waitSemaphore = CreateSemaphore(NULL, 0, 0x7fffffff, NULL);
+        doneSemaphore = CreateSemaphore(NULL, 0, 0x7fffffff, NULL);
+        waiting = 0;
+        signals = 0;
+#else
+        pthread_cond_init(&native, NULL);
+#endif
+    }
+
+    ~condition_variable() {
+#ifdef _WIN32
+        CloseHandle(waitSemaphore);
+        CloseHandle(doneSemaphore);
+        DeleteCriticalSection(&lock);
+#else
+        pthread_cond_destroy(&native);
+#endif
+    }
+
+    /**
+     * Atomically unlock the mutex and wait; the mutex is locked again on
+     * return.
+     */
+    inline void
+    wait(mutex &m) {
+#ifdef _WIN32
+        EnterCriticalSection(&lock);
+        ++waiting;
+        LeaveCriticalSection(&lock);
+
+        m.unlock();
+        WaitForSingleObject(waitSemaphore, INFINITE);
+
+        EnterCriticalSection(&lock);
+        if (signals > 0) {
+            ReleaseSemaphore(doneSemaphore, 1, NULL);
+            --signals;
+        }
+        --waiting;
+        LeaveCriticalSection(&lock);
+
+        m.lock();
+#else
+        pthread_cond_wait(&native, &m.native);
+#endif
+    }
+
+    inline void
+    notify_one(void) {
+#ifdef _WIN32
+        EnterCriticalSection(&lock);
+        if (waiting > signals) {
+            ++signals;
+            ReleaseSemaphore(waitSemaphore, 1, NULL);
+            LeaveCriticalSection(&lock);
+            WaitForSingleObject(doneSemaphore, INFINITE);
+        } else {
+            LeaveCriticalSection(&lock);
+        }
+#else
+        pthread_cond_signal(&native);
+#endif
+    }
+
+    inline void
+    notify_all(void) {
+#ifdef _WIN32
+        EnterCriticalSection(&lock);
+        if (waiting > signals) {
+            long count = waiting - signals;
+            signals = waiting;
+            ReleaseSemaphore(waitSemaphore, count, NULL);
+            LeaveCriticalSection(&lock);
+            for (long i = 0; i < count; ++i) {
+                WaitForSingleObject(doneSemaphore, INFINITE);
+            }
+        } else {
+            LeaveCriticalSection(&lock);
+        }
+#else
+        pthread_cond_broadcast(&native);
+#endif
+    }
+};
+
+
+class thread
+{
+public:
+    typedef void (*Function)(void *arg);
+
+private:
+    Function function;
+    void *arg;
+    bool started;
+
+#ifdef _WIN32
+    HANDLE native;
+
+    static DWORD WINAPI
+    start(LPVOID param) {
+        thread *t = static_cast<thread *>(param);
+        t->function(t->arg);
+        return 0;
+    }
+#else
+    pthread_t native;
+
+    static void *
+    start(void *param) {
+        thread *t = static_cast<thread *>(param);
+        t->function(t->arg);
+        return NULL;
+    }
+#endif
+
+    thread(const thread &);
+    thread & operator = (const thread &);
+
+public:
+    thread() :
+        function(NULL),
+        arg(NULL),
+        started(false)
+    {}
+
+    ~thread() {
+        join();
+    }
+
+    bool
+    run(Function _function, void *_arg) {
+        function = _function;
+        arg = _arg;
+#ifdef _WIN32
+        native = CreateThread(NULL, 0, &start, this, 0, NULL);
+        started = native != NULL;
+#else
+        started = pthread_create(&native, NULL, &start, this) == 0;
+#endif
+        return started;
+    }
+
+    bool
+    joinable(void) const {
+        return started;
+    }
+
+    void
+    join(void) {
+        if (!started) {
+            return;
+        }
+#ifdef _WIN32
+        WaitForSingleObject(native, INFINITE);
+        CloseHandle(native);
+#else
+        pthread_join(native, NULL);
+#endif
+        started = false;
+    }
+
+    /**
+     * Number of processors available, or 1 if unknown.
+     */
+    static unsigned
+    hardware_concurrency(void) {
+#ifdef _WIN32
+        SYSTEM_INFO info;
+        GetSystemInfo(&info);
+        return info.dwNumberOfProcessors > 0 ? info.dwNumberOfProcessors : 1;
+#else
+        long count = sysconf(_SC_NPROCESSORS_ONLN);
+        return count > 0 ? count : 1;
+#endif
+    }
+};
+
+
+} /* namespace os */
+
+#endif /* _OS_THREAD_HPP_ */
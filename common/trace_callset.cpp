@@ -0,0 +1,168 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+
+#include <stdlib.h>
+
+#include "trace_callset.hpp"
+
+
+namespace trace {
+
+
+static bool
+parseNumber(const char * &p, unsigned &number) {
+    if (*p < '0' || *p > '9') {
+        return false;
+    }
+    char *end;
+    number = strtoul(p, &end, 10);
+    p = end;
+    return true;
+}
+
+
+bool
+CallSet::parse(const char *string) {
+    const char *p = string;
+
+    while (*p) {
+        unsigned first, last;
+
+        if (!parseNumber(p, first)) {
+            return false;
+        }
+
+        if (*p == '-') {
+            ++p;
+            if (!parseNumber(p, last) || last < first) {
+                return false;
+            }
+        } else {
+            last = first;
+        }
+
+        addRange(first, last);
+
+        if (*p == ',') {
+            ++p;
+        } else if (*p) {
+            return false;
+        }
+    }
+
+    return true;
+}
+
+
+void
+CallSet::addRange(unsigned first, unsigned last) {
+    // Fast path for numbers added in increasing order
+    if (ranges.empty() || (ranges.back().last != ~0U && ranges.back().last + 1 < first)) {
+        ranges.push_back(Range(first, last));
+        return;
+    }
+    if (ranges.back().first <= first) {
+        if (ranges.back().last < last) {
+            ranges.back().last = last;
+        }
+        return;
+    }
+
+    RangeList::iterator it = ranges.begin();
+
+    // Skip ranges entirely before, and not adjacent to, the new one
+    while (it != ranges.end() && it->last != ~0U && it->last + 1 < first) {
+        ++it;
+    }
+
+    // Merge with any overlapping or adjacent ranges
+    while (it != ranges.end() && (last == ~0U || it->first <= last + 1)) {
+        if (it->first < first) {
+            first = it->first;
+        }
+        if (it->last > last) {
+            last = it->last;
+        }
+        it = ranges.erase(it);
+    }
+
+    ranges.insert(it, Range(first, last));
+}
+
+
+bool
+CallSet::contains(unsigned no) const {
+    for (RangeList::const_iterator it = ranges.begin(); it != ranges.end(); ++it) {
+        if (no < it->first) {
+            return false;
+        }
+        if (no <= it->last) {
+            return true;
+        }
+    }
+    return false;
+}
+
+
+unsigned
+CallSet::next(unsigned no) const {
+    for (RangeList::const_iterator it = ranges.begin(); it != ranges.end(); ++it) {
+        if (no <= it->last) {
+            return no < it->first ? it->first : no;
+        }
+    }
+    return ~0U;
+}
+
+
+unsigned
+CallSet::prev(unsigned no) const {
+    for (RangeList::const_reverse_iterator it = ranges.rbegin(); it != ranges.rend(); ++it) {
+        if (no >= it->first) {
+            return no > it->last ? it->last : no;
+        }
+    }
+    return ~0U;
+}
+
+
+std::ostream &
+operator << (std::ostream &os, const CallSet &calls) {
+    const CallSet::RangeList &ranges = calls.getRanges();
+    for (CallSet::RangeList::const_iterator it = ranges.begin(); it != ranges.end(); ++it) {
+        if (it != ranges.begin()) {
+            os << ",";
+        }
+        os << it->first;
+        if (it->last != it->first) {
+            os << "-" << it->last;
+        }
+    }
+    return os;
+}
+
+
+} /* namespace trace */
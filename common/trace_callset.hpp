@@ -0,0 +1,134 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+/*
+ * Sets of call (or frame) numbers, as specified on the command line, e.g.:
+ *
+ *   100,250-300,9000
+ */
+
+#ifndef _TRACE_CALLSET_HPP_
+#define _TRACE_CALLSET_HPP_
+
+
+#include <ostream>
+#include <vector>
+
+
+namespace trace {
+
+
+class CallSet
+{
+public:
+    struct Range {
+        unsigned first;
+        unsigned last;
+
+        Range(unsigned _first, unsigned _last) :
+            first(_first),
+            last(_last)
+        {}
+    };
+
+    typedef std::vector<Range> RangeList;
+
+private:
+    // Sorted and disjoint
+    RangeList ranges;
+
+public:
+    CallSet() {}
+
+    /**
+     * Parse a comma separated list of numbers and inclusive ranges.  Returns
+     * false on syntax errors.
+     */
+    bool
+    parse(const char *string);
+
+    void
+    addRange(unsigned first, unsigned last);
+
+    inline bool
+    empty(void) const {
+        return ranges.empty();
+    }
+
+    inline void
+    clear(void) {
+        ranges.clear();
+    }
+
+    inline const RangeList &
+    getRanges(void) const {
+        return ranges;
+    }
+
+    /**
+     * Smallest number in the set, or ~0 if empty.
+     */
+    inline unsigned
+    getFirst(void) const {
+        return ranges.empty() ? ~0U : ranges.front().first;
+    }
+
+    /**
+     * Largest number in the set, or ~0 if empty.
+     */
+    inline unsigned
+    getLast(void) const {
+        return ranges.empty() ? ~0U : ranges.back().last;
+    }
+
+    bool
+    contains(unsigned no) const;
+
+    /**
+     * Smallest number in the set not less than the given one, or ~0 if
+     * there is none.
+     */
+    unsigned
+    next(unsigned no) const;
+
+    /**
+     * Largest number in the set not greater than the given one, or ~0 if
+     * there is none.
+     */
+    unsigned
+    prev(unsigned no) const;
+};
+
+
+/**
+ * Write the set in the same syntax that CallSet::parse accepts.
+ */
+std::ostream &
+operator << (std::ostream &os, const CallSet &calls);
+
+
+} /* namespace trace */
+
+#endif /* _TRACE_CALLSET_HPP_ */
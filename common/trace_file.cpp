@@ -54,3 +54,9 @@ void File::setCurrentOffset(const File::Offset &offset)
     assert(0);
 }
 
+bool File::rawCopy(File *dest, const File::Offset &end)
+{
+    // Only files which support offsets can tell where to stop
+    return false;
+}
+
@@ -29,10 +29,62 @@
 
 #include <string>
 #include <fstream>
+#include <vector>
 #include <stdint.h>
 
 namespace trace {
 
+/**
+ * Compression of the chunks that chunked trace files are made of.
+ *
+ * Files start with the two magic bytes of their codec, followed by the
+ * header of the codec, which may hold parameters such as a dictionary.
+ * Chunks are compressed independently, so they can be decompressed in
+ * parallel.  Compressing and decompressing must be reentrant.
+ */
+class Codec {
+public:
+    typedef Codec *(*Factory)(void);
+
+    virtual ~Codec() {}
+
+    virtual const char *name() const = 0;
+    virtual const char *magic() const = 0;
+
+    virtual void writeHeader(std::ostream &os) const {}
+    virtual bool readHeader(std::istream &is) { return true; }
+
+    /**
+     * Compression level, from 1 (fastest) to 9 (smallest), for codecs which
+     * have several.
+     */
+    virtual bool setLevel(int level) { return false; }
+
+    /**
+     * Data which chunks are likely to share, for codecs which take a
+     * dictionary.
+     */
+    virtual bool setDictionary(const std::string &dictionary) { return false; }
+
+    virtual size_t maxCompressedLength(size_t length) const = 0;
+    virtual size_t compress(const char *input, size_t length,
+                            char *output) const = 0;
+    virtual bool uncompressedLength(const char *input, size_t length,
+                                    size_t &result) const = 0;
+    virtual bool uncompress(const char *input, size_t length,
+                            char *output) const = 0;
+
+public:
+    /**
+     * Make a codec available by name and magic bytes.  The snappy and
+     * deflate codecs are always available.
+     */
+    static void add(Factory factory);
+    static Codec *create(const std::string &name);
+    static Codec *createForFile(const std::string &filename);
+    static std::vector<std::string> names();
+};
+
 class File {
 public:
     enum Mode {
@@ -53,6 +105,7 @@ public:
     static bool isSnappyCompressed(const std::string &filename);
     static File *createZLib(void);
     static File *createSnappy(void);
+    static File *createChunked(Codec *codec);
     static File *createForRead(const char *filename);
     static File *createForWrite(const char *filename);
 public:
@@ -72,6 +125,12 @@ public:
     bool skip(size_t length);
     int percentRead();
 
+    /**
+     * Copy the data from the current offset up to the given one, or to the
+     * end of the file, into a file being written.
+     */
+    bool copy(File *dest, const File::Offset &end);
+
     virtual bool supportsOffsets() const = 0;
     virtual File::Offset currentOffset() = 0;
     virtual void setCurrentOffset(const File::Offset &offset);
@@ -84,6 +143,7 @@ protected:
     virtual void rawFlush() = 0;
     virtual bool rawSkip(size_t length) = 0;
     virtual int rawPercentRead() = 0;
+    virtual bool rawCopy(File *dest, const File::Offset &end);
 
 protected:
     File::Mode m_mode;
@@ -166,6 +226,15 @@ inline bool File::skip(size_t length)
     return rawSkip(length);
 }
 
+inline bool File::copy(File *dest, const File::Offset &end)
+{
+    if (!m_isOpened || m_mode != File::Read ||
+        !dest->isOpened() || dest->mode() != File::Write) {
+        return false;
+    }
+    return rawCopy(dest, end);
+}
+
 
 inline bool
 operator<(const File::Offset &one, const File::Offset &two)
@@ -25,21 +25,24 @@
 
 
 /*
- * Snappy file format.
- * -------------------
+ * Chunked file format.
+ * --------------------
  *
  * Snappy at its core is just a compressoin algorithm so we're
  * creating a new file format which uses snappy compression
- * to hold the trace data.
+ * to hold the trace data.  Other codecs can be used in the same
+ * format, see trace::Codec.
  *
- * The file is composed of a number of chunks, they are:
+ * The file starts with the two magic bytes of the codec, and its
+ * header, which is empty for snappy.  It is followed by a number of
+ * chunks, they are:
  * chunk {
  *     uint32 - specifying the length of the compressed data
  *     compressed data, in little endian
  * }
  * File can contain any number of such chunks.
  * The default size of an uncompressed chunk is specified in
- * SNAPPY_CHUNK_SIZE.
+ * CHUNK_SIZE.
  *
  * Note:
  * Currently the default size for a a to-be-compressed data is
@@ -51,9 +54,8 @@
  */
 
 
-#include <snappy.h>
-
 #include <iostream>
+#include <sstream>
 
 #include <assert.h>
 #include <string.h>
@@ -61,20 +63,16 @@
 #include "trace_file.hpp"
 
 
-#define SNAPPY_CHUNK_SIZE (1 * 1024 * 1024)
-
-#define SNAPPY_BYTE1 'a'
-#define SNAPPY_BYTE2 't'
+#define CHUNK_SIZE (1 * 1024 * 1024)
 
 
 using namespace trace;
 
 
-class SnappyFile : public File {
+class ChunkedFile : public File {
 public:
-    SnappyFile(const std::string &filename = std::string(),
-               File::Mode mode = File::Read);
-    virtual ~SnappyFile();
+    ChunkedFile(Codec *codec);
+    virtual ~ChunkedFile();
 
     virtual bool supportsOffsets() const;
     virtual File::Offset currentOffset();
@@ -88,6 +86,7 @@ protected:
     virtual void rawFlush();
     virtual bool rawSkip(size_t length);
     virtual int rawPercentRead();
+    virtual bool rawCopy(File *dest, const File::Offset &end);
 
 private:
     inline size_t usedCacheSize() const
@@ -113,7 +112,10 @@ private:
     void createCache(size_t size);
     void writeCompressedLength(size_t length);
     size_t readCompressedLength();
+    void writeCompressedChunk(const char *data, size_t length);
+    bool sameCodec(const ChunkedFile *other) const;
 private:
+    Codec *m_codec;
     std::fstream m_stream;
     size_t m_cacheMaxSize;
     size_t m_cacheSize;
@@ -121,37 +123,40 @@ private:
     char *m_cachePtr;
 
     char *m_compressedCache;
+    size_t m_compressedCacheSize;
+    size_t m_compressedLength;
 
     File::Offset m_currentOffset;
     std::streampos m_endPos;
 };
 
-SnappyFile::SnappyFile(const std::string &filename,
-                              File::Mode mode)
+ChunkedFile::ChunkedFile(Codec *codec)
     : File(),
-      m_cacheMaxSize(SNAPPY_CHUNK_SIZE),
+      m_codec(codec),
+      m_cacheMaxSize(CHUNK_SIZE),
       m_cacheSize(m_cacheMaxSize),
       m_cache(new char [m_cacheMaxSize]),
       m_cachePtr(m_cache)
 {
-    size_t maxCompressedLength =
-        snappy::MaxCompressedLength(SNAPPY_CHUNK_SIZE);
-    m_compressedCache = new char[maxCompressedLength];
+    m_compressedCacheSize = m_codec->maxCompressedLength(CHUNK_SIZE);
+    m_compressedCache = new char[m_compressedCacheSize];
+    m_compressedLength = 0;
 }
 
-SnappyFile::~SnappyFile()
+ChunkedFile::~ChunkedFile()
 {
     close();
     delete [] m_compressedCache;
     delete [] m_cache;
+    delete m_codec;
 }
 
-bool SnappyFile::rawOpen(const std::string &filename, File::Mode mode)
+bool ChunkedFile::rawOpen(const std::string &filename, File::Mode mode)
 {
     std::ios_base::openmode fmode = std::fstream::binary;
     if (mode == File::Write) {
         fmode |= (std::fstream::out | std::fstream::trunc);
-        createCache(SNAPPY_CHUNK_SIZE);
+        createCache(CHUNK_SIZE);
     } else if (mode == File::Read) {
         fmode |= std::fstream::in;
     }
@@ -164,22 +169,26 @@ bool SnappyFile::rawOpen(const std::string &filename, File::Mode mode)
         m_endPos = m_stream.tellg();
         m_stream.seekg(0, std::ios::beg);
 
-        // read the snappy file identifier
-        unsigned char byte1, byte2;
-        m_stream >> byte1;
-        m_stream >> byte2;
-        assert(byte1 == SNAPPY_BYTE1 && byte2 == SNAPPY_BYTE2);
+        // read the codec identifier and header
+        char magic[2];
+        m_stream.read(magic, sizeof magic);
+        if (m_stream.fail() ||
+            memcmp(magic, m_codec->magic(), sizeof magic) != 0 ||
+            !m_codec->readHeader(m_stream)) {
+            m_stream.close();
+            return false;
+        }
 
         flushReadCache();
     } else if (m_stream.is_open() && mode == File::Write) {
-        // write the snappy file identifier
-        m_stream << SNAPPY_BYTE1;
-        m_stream << SNAPPY_BYTE2;
+        // write the codec identifier and header
+        m_stream.write(m_codec->magic(), 2);
+        m_codec->writeHeader(m_stream);
     }
     return m_stream.is_open();
 }
 
-bool SnappyFile::rawWrite(const void *buffer, size_t length)
+bool ChunkedFile::rawWrite(const void *buffer, size_t length)
 {
     if (freeCacheSize() > length) {
         memcpy(m_cachePtr, buffer, length);
@@ -209,7 +218,7 @@ bool SnappyFile::rawWrite(const void *buffer, size_t length)
     return true;
 }
 
-size_t SnappyFile::rawRead(void *buffer, size_t length)
+size_t ChunkedFile::rawRead(void *buffer, size_t length)
 {
     if (endOfData()) {
         return 0;
@@ -239,7 +248,7 @@ size_t SnappyFile::rawRead(void *buffer, size_t length)
     return length;
 }
 
-int SnappyFile::rawGetc()
+int ChunkedFile::rawGetc()
 {
     int c = 0;
     if (rawRead(&c, 1) != 1)
@@ -247,7 +256,7 @@ int SnappyFile::rawGetc()
     return c;
 }
 
-void SnappyFile::rawClose()
+void ChunkedFile::rawClose()
 {
     if (m_mode == File::Write) {
         flushWriteCache();
@@ -258,22 +267,22 @@ void SnappyFile::rawClose()
     m_cachePtr = NULL;
 }
 
-void SnappyFile::rawFlush()
+void ChunkedFile::rawFlush()
 {
     assert(m_mode == File::Write);
     flushWriteCache();
     m_stream.flush();
 }
 
-void SnappyFile::flushWriteCache()
+void ChunkedFile::flushWriteCache()
 {
     size_t inputLength = usedCacheSize();
 
     if (inputLength) {
         size_t compressedLength;
 
-        ::snappy::RawCompress(m_cache, inputLength,
-                              m_compressedCache, &compressedLength);
+        compressedLength = m_codec->compress(m_cache, inputLength,
+                                             m_compressedCache);
 
         writeCompressedLength(compressedLength);
         m_stream.write(m_compressedCache, compressedLength);
@@ -282,28 +291,38 @@ void SnappyFile::flushWriteCache()
     assert(m_cachePtr == m_cache);
 }
 
-void SnappyFile::flushReadCache(size_t skipLength)
+void ChunkedFile::flushReadCache(size_t skipLength)
 {
     //assert(m_cachePtr == m_cache + m_cacheSize);
     m_currentOffset.chunk = m_stream.tellg();
     size_t compressedLength;
     compressedLength = readCompressedLength();
+    m_compressedLength = compressedLength;
 
     if (compressedLength) {
+        // Chunks written with other chunk sizes may be bigger
+        if (compressedLength > m_compressedCacheSize) {
+            delete [] m_compressedCache;
+            m_compressedCache = new char[compressedLength];
+            m_compressedCacheSize = compressedLength;
+        }
         m_stream.read((char*)m_compressedCache, compressedLength);
-        ::snappy::GetUncompressedLength(m_compressedCache, compressedLength,
-                                        &m_cacheSize);
-        createCache(m_cacheSize);
+        size_t length;
+        if (!m_codec->uncompressedLength(m_compressedCache, compressedLength,
+                                         length)) {
+            length = 0;
+        }
+        createCache(length);
         if (skipLength < m_cacheSize) {
-            ::snappy::RawUncompress(m_compressedCache, compressedLength,
-                                    m_cache);
+            m_codec->uncompress(m_compressedCache, compressedLength,
+                                m_cache);
         }
     } else {
         createCache(0);
     }
 }
 
-void SnappyFile::createCache(size_t size)
+void ChunkedFile::createCache(size_t size)
 {
     if (size > m_cacheMaxSize) {
         do {
@@ -319,7 +338,7 @@ void SnappyFile::createCache(size_t size)
     m_cacheSize = size;
 }
 
-void SnappyFile::writeCompressedLength(size_t length)
+void ChunkedFile::writeCompressedLength(size_t length)
 {
     unsigned char buf[4];
     buf[0] = length & 0xff; length >>= 8;
@@ -330,7 +349,26 @@ void SnappyFile::writeCompressedLength(size_t length)
     m_stream.write((const char *)buf, sizeof buf);
 }
 
-size_t SnappyFile::readCompressedLength()
+bool ChunkedFile::sameCodec(const ChunkedFile *other) const
+{
+    if (strcmp(m_codec->name(), other->m_codec->name()) != 0) {
+        return false;
+    }
+
+    std::ostringstream header, otherHeader;
+    m_codec->writeHeader(header);
+    other->m_codec->writeHeader(otherHeader);
+    return header.str() == otherHeader.str();
+}
+
+void ChunkedFile::writeCompressedChunk(const char *data, size_t length)
+{
+    flushWriteCache();
+    writeCompressedLength(length);
+    m_stream.write(data, length);
+}
+
+size_t ChunkedFile::readCompressedLength()
 {
     unsigned char buf[4];
     size_t length;
@@ -346,18 +384,18 @@ size_t SnappyFile::readCompressedLength()
     return length;
 }
 
-bool SnappyFile::supportsOffsets() const
+bool ChunkedFile::supportsOffsets() const
 {
     return true;
 }
 
-File::Offset SnappyFile::currentOffset()
+File::Offset ChunkedFile::currentOffset()
 {
     m_currentOffset.offsetInChunk = m_cachePtr - m_cache;
     return m_currentOffset;
 }
 
-void SnappyFile::setCurrentOffset(const File::Offset &offset)
+void ChunkedFile::setCurrentOffset(const File::Offset &offset)
 {
     // to remove eof bit
     m_stream.clear();
@@ -371,7 +409,7 @@ void SnappyFile::setCurrentOffset(const File::Offset &offset)
 
 }
 
-bool SnappyFile::rawSkip(size_t length)
+bool ChunkedFile::rawSkip(size_t length)
 {
     if (endOfData()) {
         return false;
@@ -397,27 +435,68 @@ bool SnappyFile::rawSkip(size_t length)
     return true;
 }
 
-int SnappyFile::rawPercentRead()
+/*
+ * Chunks which are copied whole into another file with the same codec are
+ * written as they are, without being decompressed or compressed again.
+ */
+bool ChunkedFile::rawCopy(File *dest, const File::Offset &end)
+{
+    ChunkedFile *chunkedDest = dynamic_cast<ChunkedFile *>(dest);
+    if (chunkedDest && !sameCodec(chunkedDest)) {
+        chunkedDest = NULL;
+    }
+
+    while (m_currentOffset.chunk < end.chunk) {
+        if (!m_cacheSize) {
+            return true;
+        }
+
+        if (chunkedDest && m_cachePtr == m_cache) {
+            chunkedDest->writeCompressedChunk(m_compressedCache,
+                                             m_compressedLength);
+        } else {
+            dest->write(m_cachePtr, freeCacheSize());
+        }
+
+        // The next chunk needs no decompression if it will be copied whole
+        uint64_t nextChunk = m_stream.tellg();
+        if (chunkedDest && nextChunk < end.chunk) {
+            flushReadCache(~(size_t)0);
+        } else {
+            flushReadCache();
+        }
+    }
+
+    if (m_currentOffset.chunk == end.chunk) {
+        size_t endInChunk = std::min(size_t(end.offsetInChunk), m_cacheSize);
+        if (endInChunk > usedCacheSize()) {
+            size_t length = endInChunk - usedCacheSize();
+            dest->write(m_cachePtr, length);
+            m_cachePtr += length;
+        }
+    }
+
+    return true;
+}
+
+int ChunkedFile::rawPercentRead()
 {
     return 100 * (double(m_stream.tellg()) / double(m_endPos));
 }
 
 
 File* File::createSnappy(void) {
-    return new SnappyFile;
+    return new ChunkedFile(Codec::create("snappy"));
+}
+
+File* File::createChunked(Codec *codec) {
+    return new ChunkedFile(codec);
 }
 
 bool File::isSnappyCompressed(const std::string &filename)
 {
-    std::fstream stream(filename.c_str(),
-                        std::fstream::binary | std::fstream::in);
-    if (!stream.is_open())
-        return false;
-
-    unsigned char byte1, byte2;
-    stream >> byte1;
-    stream >> byte2;
-    stream.close();
-
-    return (byte1 == SNAPPY_BYTE1 && byte2 == SNAPPY_BYTE2);
+    Codec *codec = Codec::createForFile(filename);
+    bool isSnappy = codec && strcmp(codec->name(), "snappy") == 0;
+    delete codec;
+    return isSnappy;
 }
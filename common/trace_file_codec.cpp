@@ -0,0 +1,329 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+
+/*
+ * Codecs of chunked trace files.
+ *
+ * The snappy codec is the default one, fast enough to be used while
+ * tracing.  The deflate codec is slower but compresses much better, and is
+ * meant for archiving traces (see apitrace repack).  Its header holds the
+ * compression level and a preset dictionary, which is shared by all chunks
+ * so that they can still be decompressed independently:
+ *
+ * header {
+ *     uint8 - compression level
+ *     uint32 - length of the dictionary, in little endian
+ *     dictionary
+ * }
+ *
+ * chunk {
+ *     uint32 - uncompressed length, in little endian
+ *     raw deflate stream
+ * }
+ */
+
+
+#include <assert.h>
+#include <string.h>
+
+#include <algorithm>
+#include <iostream>
+
+#include <snappy.h>
+#include <zlib.h>
+
+#include "trace_file.hpp"
+
+
+using namespace trace;
+
+
+static void
+writeUInt32(char *buf, size_t value)
+{
+    buf[0] = (char)(value & 0xff);
+    buf[1] = (char)((value >> 8) & 0xff);
+    buf[2] = (char)((value >> 16) & 0xff);
+    buf[3] = (char)((value >> 24) & 0xff);
+}
+
+static size_t
+readUInt32(const char *buf)
+{
+    const unsigned char *ubuf = (const unsigned char *)buf;
+    return (size_t)ubuf[0] |
+           ((size_t)ubuf[1] << 8) |
+           ((size_t)ubuf[2] << 16) |
+           ((size_t)ubuf[3] << 24);
+}
+
+
+class SnappyCodec : public Codec {
+public:
+    const char *name() const {
+        return "snappy";
+    }
+
+    const char *magic() const {
+        return "at";
+    }
+
+    size_t maxCompressedLength(size_t length) const {
+        return ::snappy::MaxCompressedLength(length);
+    }
+
+    size_t compress(const char *input, size_t length, char *output) const {
+        size_t compressedLength;
+        ::snappy::RawCompress(input, length, output, &compressedLength);
+        return compressedLength;
+    }
+
+    bool uncompressedLength(const char *input, size_t length,
+                            size_t &result) const {
+        return ::snappy::GetUncompressedLength(input, length, &result);
+    }
+
+    bool uncompress(const char *input, size_t length, char *output) const {
+        return ::snappy::RawUncompress(input, length, output);
+    }
+
+    static Codec *create(void) {
+        return new SnappyCodec;
+    }
+};
+
+
+class DeflateCodec : public Codec {
+private:
+    enum {
+        // The window of deflate, beyond which a dictionary is of no use
+        MAX_DICTIONARY = 32 * 1024
+    };
+
+    int m_level;
+    std::string m_dictionary;
+
+public:
+    DeflateCodec() :
+        m_level(Z_BEST_COMPRESSION)
+    {}
+
+    const char *name() const {
+        return "deflate";
+    }
+
+    const char *magic() const {
+        return "ad";
+    }
+
+    void writeHeader(std::ostream &os) const {
+        char buf[5];
+        buf[0] = (char)m_level;
+        writeUInt32(buf + 1, m_dictionary.size());
+        os.write(buf, sizeof buf);
+        os.write(m_dictionary.data(), m_dictionary.size());
+    }
+
+    bool readHeader(std::istream &is) {
+        char buf[5];
+        is.read(buf, sizeof buf);
+        if (is.fail()) {
+            return false;
+        }
+        m_level = (unsigned char)buf[0];
+        size_t length = readUInt32(buf + 1);
+        if (length > MAX_DICTIONARY) {
+            return false;
+        }
+        m_dictionary.resize(length);
+        if (length) {
+            is.read(&m_dictionary[0], length);
+        }
+        return !is.fail();
+    }
+
+    bool setLevel(int level) {
+        if (level < Z_BEST_SPEED || level > Z_BEST_COMPRESSION) {
+            return false;
+        }
+        m_level = level;
+        return true;
+    }
+
+    bool setDictionary(const std::string &dictionary) {
+        // Only the end of the dictionary would be within reach
+        size_t length = std::min(dictionary.size(), (size_t)MAX_DICTIONARY);
+        m_dictionary.assign(dictionary, dictionary.size() - length, length);
+        return true;
+    }
+
+    size_t maxCompressedLength(size_t length) const {
+        return 4 + compressBound(length) + 16;
+    }
+
+    size_t compress(const char *input, size_t length, char *output) const {
+        z_stream stream;
+        memset(&stream, 0, sizeof stream);
+        if (deflateInit2(&stream, m_level, Z_DEFLATED, -MAX_WBITS, 8,
+                         Z_DEFAULT_STRATEGY) != Z_OK) {
+            return 0;
+        }
+        if (!m_dictionary.empty()) {
+            deflateSetDictionary(&stream,
+                                 (const Bytef *)m_dictionary.data(),
+                                 m_dictionary.size());
+        }
+
+        writeUInt32(output, length);
+
+        stream.next_in = (Bytef *)input;
+        stream.avail_in = length;
+        stream.next_out = (Bytef *)output + 4;
+        stream.avail_out = maxCompressedLength(length) - 4;
+        int ret = deflate(&stream, Z_FINISH);
+        size_t compressedLength = 4 + stream.total_out;
+        deflateEnd(&stream);
+
+        assert(ret == Z_STREAM_END);
+        return ret == Z_STREAM_END ? compressedLength : 0;
+    }
+
+    bool uncompressedLength(const char *input, size_t length,
+                            size_t &result) const {
+        if (length < 4) {
+            return false;
+        }
+        result = readUInt32(input);
+        return true;
+    }
+
+    bool uncompress(const char *input, size_t length, char *output) const {
+        size_t outputLength;
+        if (!uncompressedLength(input, length, outputLength)) {
+            return false;
+        }
+
+        z_stream stream;
+        memset(&stream, 0, sizeof stream);
+        if (inflateInit2(&stream, -MAX_WBITS) != Z_OK) {
+            return false;
+        }
+        if (!m_dictionary.empty()) {
+            inflateSetDictionary(&stream,
+                                 (const Bytef *)m_dictionary.data(),
+                                 m_dictionary.size());
+        }
+
+        stream.next_in = (Bytef *)input + 4;
+        stream.avail_in = length - 4;
+        stream.next_out = (Bytef *)output;
+        stream.avail_out = outputLength;
+        int ret = inflate(&stream, Z_FINISH);
+        bool complete = ret == Z_STREAM_END && stream.total_out == outputLength;
+        inflateEnd(&stream);
+
+        return complete;
+    }
+
+    static Codec *create(void) {
+        return new DeflateCodec;
+    }
+};
+
+
+static std::vector<Codec::Factory> &
+factories(void)
+{
+    static std::vector<Codec::Factory> list;
+    if (list.empty()) {
+        list.push_back(SnappyCodec::create);
+        list.push_back(DeflateCodec::create);
+    }
+    return list;
+}
+
+
+void
+Codec::add(Factory factory)
+{
+    factories().push_back(factory);
+}
+
+
+Codec *
+Codec::create(const std::string &name)
+{
+    const std::vector<Factory> &list = factories();
+    for (unsigned i = 0; i < list.size(); ++i) {
+        Codec *codec = list[i]();
+        if (name == codec->name()) {
+            return codec;
+        }
+        delete codec;
+    }
+    return NULL;
+}
+
+
+Codec *
+Codec::createForFile(const std::string &filename)
+{
+    std::fstream stream(filename.c_str(),
+                        std::fstream::binary | std::fstream::in);
+    if (!stream.is_open()) {
+        return NULL;
+    }
+
+    char magic[2];
+    stream.read(magic, sizeof magic);
+    if (stream.fail()) {
+        return NULL;
+    }
+
+    const std::vector<Factory> &list = factories();
+    for (unsigned i = 0; i < list.size(); ++i) {
+        Codec *codec = list[i]();
+        if (memcmp(magic, codec->magic(), sizeof magic) == 0) {
+            return codec;
+        }
+        delete codec;
+    }
+    return NULL;
+}
+
+
+std::vector<std::string>
+Codec::names(void)
+{
+    std::vector<std::string> result;
+    const std::vector<Factory> &list = factories();
+    for (unsigned i = 0; i < list.size(); ++i) {
+        Codec *codec = list[i]();
+        result.push_back(codec->name());
+        delete codec;
+    }
+    return result;
+}
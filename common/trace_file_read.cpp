@@ -35,9 +35,10 @@ File *
 File::createForRead(const char *filename)
 {
     File *file;
+    Codec *codec;
 
-    if (File::isSnappyCompressed(filename)) {
-        file = File::createSnappy();
+    if ((codec = Codec::createForFile(filename)) != NULL) {
+        file = File::createChunked(codec);
     } else if (File::isZLibCompressed(filename)) {
         file = File::createZLib();
     } else  {
@@ -37,6 +37,7 @@
  *
  *   call_detail = ARG index value
  *               | RET value
+ *               | DELTA mask
  *               | END
  *
  *   value = NULL
@@ -65,6 +66,16 @@
  *
  *   string = length (BYTE)*
  *
+ * Delta encoding:
+ *
+ *   In traces of version 3 or later, the arguments of an enter event which
+ *   are the same as in the previous call to the same function may be left
+ *   out.  The mask of the DELTA detail has bit N set when argument N is
+ *   left out.  Only arguments given in enter events count as previous ones.
+ *   Calls whose number is a multiple of TRACE_DELTA_INTERVAL are keyframes,
+ *   which never refer to calls before them, so that parsing can resume from
+ *   there.
+ *
  */
 
 #ifndef _TRACE_FORMAT_HPP_
@@ -100,8 +111,23 @@ namespace trace {
  *   as opposed to blobs
  *   - glFlushMappedBufferRange will emit a memcpy only for the flushed range
  *   (whereas previously it would emit a memcpy for the whole mapped range)
+ *
+ * - version 3:
+ *   - delta encoding of calls against the previous call to the same function
+ *   (traces without delta encoded calls are still written as version 2, so
+ *   that older versions can read them)
+ */
+#define TRACE_VERSION 3
+
+/*
+ * Version of traces without delta encoded calls.
+ */
+#define TRACE_VERSION_PLAIN 2
+
+/*
+ * Number of calls between keyframes of delta encoded traces.
  */
-#define TRACE_VERSION 2
+#define TRACE_DELTA_INTERVAL 4096
 
 enum Event {
     EVENT_ENTER = 0,
@@ -113,6 +139,7 @@ enum CallDetail {
     CALL_ARG,
     CALL_RET,
     CALL_THREAD,
+    CALL_DELTA,
 };
 
 enum Type {
@@ -0,0 +1,485 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+/*
+ * The index file is a plain text file, of the form
+ *
+ *   apitrace-index VERSION
+ *   trace SIZE MTIME
+ *   frames CALLNO...
+ *   args FUNCTION ARG...
+ *   KIND CALLSET KEY
+ *   ...
+ *
+ * where KIND is one of the kind names below, CALLSET is in the syntax
+ * accepted by CallSet::parse, and KEY takes the rest of the line, with
+ * backslashes and line breaks escaped.
+ */
+
+
+#include <assert.h>
+#include <ctype.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+
+#include <algorithm>
+#include <fstream>
+#include <iostream>
+#include <sstream>
+
+#include "trace_parser.hpp"
+#include "trace_index.hpp"
+
+
+#define INDEX_VERSION 2
+
+
+namespace trace {
+
+
+static const char *
+kindNames[Index::NUM_KINDS] = {
+    "function",
+    "arg",
+    "member",
+    "enum",
+    "flag",
+    "string",
+    "blob",
+    "bool",
+};
+
+
+const char *
+Index::kindName(Kind kind) {
+    assert(kind < NUM_KINDS);
+    return kindNames[kind];
+}
+
+
+static bool
+statTrace(const char *filename, unsigned long long &size, long long &time) {
+    struct stat st;
+    if (stat(filename, &st) != 0) {
+        return false;
+    }
+    size = st.st_size;
+    time = st.st_mtime;
+    return true;
+}
+
+
+static inline bool
+isFrameMarker(const Call *call) {
+    const char *name = call->name();
+    return strstr(name, "SwapBuffers") != NULL ||
+           strcmp(name, "CGLFlushDrawable") == 0 ||
+           strcmp(name, "glFrameTerminatorGREMEDY") == 0;
+}
+
+
+/**
+ * Adds the keys of the values to the postings of a call.
+ */
+class Indexer : public Visitor
+{
+protected:
+    Index::Postings *postings;
+    Index::Signatures &signatures;
+    unsigned call_no;
+
+    inline void
+    add(Index::Kind kind, const std::string &key) {
+        postings[kind][key].addRange(call_no, call_no);
+    }
+
+public:
+    Indexer(Index::Postings *_postings, Index::Signatures &_signatures) :
+        postings(_postings),
+        signatures(_signatures),
+        call_no(0)
+    {}
+
+    void
+    index(Call *call) {
+        call_no = call->no;
+
+        const FunctionSig *sig = call->sig;
+        add(Index::KIND_FUNCTION, sig->name);
+        if (signatures.find(sig->name) == signatures.end()) {
+            std::vector<std::string> &args = signatures[sig->name];
+            args.assign(sig->arg_names, sig->arg_names + sig->num_args);
+        }
+
+        for (unsigned i = 0; i < call->args.size(); ++i) {
+            _visit(call->args[i]);
+        }
+        _visit(call->ret);
+    }
+
+    void visit(Null *) {}
+    void visit(Bool *node) {
+        // As spelled when searching
+        add(Index::KIND_BOOL, node->value ? "true" : "false");
+    }
+    void visit(SInt *) {}
+    void visit(UInt *) {}
+    void visit(Float *) {}
+    void visit(Double *) {}
+    void visit(Pointer *) {}
+
+    void visit(String *node) {
+        add(Index::KIND_STRING, node->value);
+    }
+
+    void visit(Enum *node) {
+        add(Index::KIND_ENUM, node->sig->name);
+    }
+
+    void visit(Bitmask *node) {
+        const BitmaskSig *sig = node->sig;
+        for (unsigned i = 0; i < sig->num_flags; ++i) {
+            unsigned long long value = sig->flags[i].value;
+            if (value && (node->value & value) == value) {
+                add(Index::KIND_FLAG, sig->flags[i].name);
+            }
+        }
+    }
+
+    void visit(Struct *node) {
+        const StructSig *sig = node->sig;
+        for (unsigned i = 0; i < sig->num_members; ++i) {
+            add(Index::KIND_MEMBER, sig->member_names[i]);
+            _visit(node->members[i]);
+        }
+    }
+
+    void visit(Array *node) {
+        for (unsigned i = 0; i < node->values.size(); ++i) {
+            _visit(node->values[i]);
+        }
+    }
+
+    void visit(Blob *node) {
+        char buf[32];
+        snprintf(buf, sizeof buf, "%lu", (unsigned long)node->size);
+        add(Index::KIND_BLOB, buf);
+    }
+};
+
+
+void
+Index::clear(void) {
+    for (unsigned kind = 0; kind < NUM_KINDS; ++kind) {
+        postings[kind].clear();
+    }
+    signatures.clear();
+    frames.clear();
+    traceSize = 0;
+    traceTime = 0;
+}
+
+
+bool
+Index::build(const char *traceFilename) {
+    clear();
+
+    if (!statTrace(traceFilename, traceSize, traceTime)) {
+        return false;
+    }
+
+    Parser parser;
+    if (!parser.open(traceFilename)) {
+        return false;
+    }
+
+    // Values are needed, so calls are parsed rather than scanned.
+    Indexer indexer(postings, signatures);
+    bool frameStart = true;
+    Call *call;
+    while ((call = parser.parse_call())) {
+        if (frameStart) {
+            frames.push_back(call->no);
+            frameStart = false;
+        }
+        indexer.index(call);
+        if (isFrameMarker(call)) {
+            frameStart = true;
+        }
+        delete call;
+    }
+
+    return true;
+}
+
+
+static void
+writeKey(std::ostream &os, const std::string &key) {
+    for (std::string::const_iterator it = key.begin(); it != key.end(); ++it) {
+        switch (*it) {
+        case '\\':
+            os << "\\\\";
+            break;
+        case '\n':
+            os << "\\n";
+            break;
+        case '\r':
+            os << "\\r";
+            break;
+        default:
+            os << *it;
+        }
+    }
+}
+
+
+static std::string
+readKey(const std::string &line, size_t pos) {
+    std::string key;
+    key.reserve(line.size() - pos);
+    for (; pos < line.size(); ++pos) {
+        char c = line[pos];
+        if (c == '\\' && pos + 1 < line.size()) {
+            c = line[++pos];
+            if (c == 'n') {
+                c = '\n';
+            } else if (c == 'r') {
+                c = '\r';
+            }
+        }
+        key += c;
+    }
+    return key;
+}
+
+
+bool
+Index::save(const char *filename) const {
+    // Write to a temporary file first, so that a partially written index is
+    // never loaded.
+    std::string tmpFilename = std::string(filename) + ".tmp";
+    std::ofstream os(tmpFilename.c_str(), std::ios::binary);
+    if (!os) {
+        return false;
+    }
+
+    os << "apitrace-index " << INDEX_VERSION << "\n";
+    os << "trace " << traceSize << " " << traceTime << "\n";
+
+    os << "frames";
+    for (std::vector<unsigned>::const_iterator it = frames.begin(); it != frames.end(); ++it) {
+        os << " " << *it;
+    }
+    os << "\n";
+
+    for (Signatures::const_iterator it = signatures.begin(); it != signatures.end(); ++it) {
+        os << "args " << it->first;
+        for (std::vector<std::string>::const_iterator arg = it->second.begin(); arg != it->second.end(); ++arg) {
+            os << " " << *arg;
+        }
+        os << "\n";
+    }
+
+    for (unsigned kind = 0; kind < NUM_KINDS; ++kind) {
+        const Postings &p = postings[kind];
+        for (Postings::const_iterator it = p.begin(); it != p.end(); ++it) {
+            os << kindNames[kind] << " " << it->second << " ";
+            writeKey(os, it->first);
+            os << "\n";
+        }
+    }
+
+    os.close();
+    if (!os) {
+        remove(tmpFilename.c_str());
+        return false;
+    }
+
+#ifdef _WIN32
+    remove(filename);
+#endif
+    return rename(tmpFilename.c_str(), filename) == 0;
+}
+
+
+bool
+Index::load(const char *filename, const char *traceFilename) {
+    clear();
+
+    unsigned long long size;
+    long long time;
+    if (!statTrace(traceFilename, size, time)) {
+        return false;
+    }
+
+    std::ifstream is(filename, std::ios::binary);
+    if (!is) {
+        return false;
+    }
+
+    std::string line;
+    unsigned version = 0;
+    if (!std::getline(is, line) ||
+        sscanf(line.c_str(), "apitrace-index %u", &version) != 1 ||
+        version != INDEX_VERSION) {
+        return false;
+    }
+
+    if (!std::getline(is, line) ||
+        sscanf(line.c_str(), "trace %llu %lli", &traceSize, &traceTime) != 2 ||
+        traceSize != size ||
+        traceTime != time) {
+        clear();
+        return false;
+    }
+
+    while (std::getline(is, line)) {
+        size_t space = line.find(' ');
+        std::string kindName = line.substr(0, space);
+
+        if (kindName == "frames") {
+            std::istringstream ls(line.substr(space + 1));
+            unsigned call_no;
+            while (ls >> call_no) {
+                frames.push_back(call_no);
+            }
+            continue;
+        }
+
+        if (kindName == "args") {
+            std::istringstream ls(line.substr(space + 1));
+            std::string name, arg;
+            if (ls >> name) {
+                std::vector<std::string> &args = signatures[name];
+                while (ls >> arg) {
+                    args.push_back(arg);
+                }
+            }
+            continue;
+        }
+
+        unsigned kind;
+        for (kind = 0; kind < NUM_KINDS; ++kind) {
+            if (kindName == kindNames[kind]) {
+                break;
+            }
+        }
+        if (kind == NUM_KINDS || space == std::string::npos) {
+            continue;
+        }
+
+        size_t keyStart = line.find(' ', space + 1);
+        if (keyStart == std::string::npos) {
+            continue;
+        }
+
+        CallSet calls;
+        if (!calls.parse(line.substr(space + 1, keyStart - space - 1).c_str())) {
+            continue;
+        }
+        postings[kind][readKey(line, keyStart + 1)] = calls;
+    }
+
+    return true;
+}
+
+
+static inline bool
+rangeLess(const CallSet::Range &a, const CallSet::Range &b) {
+    return a.first < b.first;
+}
+
+
+static std::string
+lower(const std::string &s) {
+    std::string l(s);
+    for (std::string::iterator it = l.begin(); it != l.end(); ++it) {
+        *it = tolower((unsigned char)*it);
+    }
+    return l;
+}
+
+
+void
+Index::find(const char *text, bool caseSensitive, unsigned kinds, CallSet &calls) const {
+    std::string needle = caseSensitive ? std::string(text) : lower(text);
+
+    CallSet::RangeList ranges = calls.getRanges();
+
+    if (kinds & (1 << KIND_ARG)) {
+        const Postings &functions = postings[KIND_FUNCTION];
+        for (Signatures::const_iterator it = signatures.begin(); it != signatures.end(); ++it) {
+            for (unsigned i = 0; i < it->second.size(); ++i) {
+                const std::string &arg = it->second[i];
+                bool match;
+                if (caseSensitive) {
+                    match = arg.find(needle) != std::string::npos;
+                } else {
+                    match = lower(arg).find(needle) != std::string::npos;
+                }
+                if (match) {
+                    Postings::const_iterator function = functions.find(it->first);
+                    if (function != functions.end()) {
+                        const CallSet::RangeList &r = function->second.getRanges();
+                        ranges.insert(ranges.end(), r.begin(), r.end());
+                    }
+                    break;
+                }
+            }
+        }
+    }
+
+    for (unsigned kind = 0; kind < NUM_KINDS; ++kind) {
+        if (!(kinds & (1 << kind))) {
+            continue;
+        }
+        const Postings &p = postings[kind];
+        for (Postings::const_iterator it = p.begin(); it != p.end(); ++it) {
+            const std::string &key = it->first;
+            bool match;
+            if (caseSensitive) {
+                match = key.find(needle) != std::string::npos;
+            } else {
+                match = lower(key).find(needle) != std::string::npos;
+            }
+            if (match) {
+                const CallSet::RangeList &r = it->second.getRanges();
+                ranges.insert(ranges.end(), r.begin(), r.end());
+            }
+        }
+    }
+
+    // Adding the ranges in order is linear
+    std::sort(ranges.begin(), ranges.end(), rangeLess);
+    calls.clear();
+    for (CallSet::RangeList::const_iterator it = ranges.begin(); it != ranges.end(); ++it) {
+        calls.addRange(it->first, it->last);
+    }
+}
+
+
+} /* namespace trace */
@@ -0,0 +1,150 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+/*
+ * Inverted index of a trace, mapping the names and values that appear in
+ * the calls to the numbers of the calls they appear in, so that calls can be
+ * looked up without parsing the whole trace.
+ *
+ * The index is built once, and stored next to the trace, as TRACE.index.
+ */
+
+#ifndef _TRACE_INDEX_HPP_
+#define _TRACE_INDEX_HPP_
+
+
+#include <map>
+#include <string>
+#include <vector>
+
+#include "trace_callset.hpp"
+
+
+namespace trace {
+
+
+class Index
+{
+public:
+    enum Kind {
+        KIND_FUNCTION = 0,
+        KIND_ARG,
+        KIND_MEMBER,
+        KIND_ENUM,
+        KIND_FLAG,
+        KIND_STRING,
+        KIND_BLOB,
+        KIND_BOOL,
+        NUM_KINDS
+    };
+
+    enum {
+        // Everything that is matched when searching text
+        KINDS_TEXT = (1 << KIND_FUNCTION) |
+                     (1 << KIND_ARG) |
+                     (1 << KIND_MEMBER) |
+                     (1 << KIND_ENUM) |
+                     (1 << KIND_FLAG) |
+                     (1 << KIND_STRING) |
+                     (1 << KIND_BOOL)
+    };
+
+    typedef std::map<std::string, CallSet> Postings;
+
+    // Argument names of every function
+    typedef std::map<std::string, std::vector<std::string> > Signatures;
+
+private:
+    // Calls are not posted under argument names, as these can be derived
+    // from the signatures and the function postings, and would be bulky
+    Postings postings[NUM_KINDS];
+    Signatures signatures;
+
+    // First call of every frame
+    std::vector<unsigned> frames;
+
+    unsigned long long traceSize;
+    long long traceTime;
+
+public:
+    Index() :
+        traceSize(0),
+        traceTime(0)
+    {}
+
+    static std::string
+    filename(const char *traceFilename) {
+        return std::string(traceFilename) + ".index";
+    }
+
+    void
+    clear(void);
+
+    /**
+     * Build the index by parsing the whole trace.
+     */
+    bool
+    build(const char *traceFilename);
+
+    bool
+    save(const char *filename) const;
+
+    /**
+     * Load the index of a trace, failing if it is missing or the trace was
+     * modified after the index was built.
+     */
+    bool
+    load(const char *filename, const char *traceFilename);
+
+    inline const Postings &
+    getPostings(Kind kind) const {
+        return postings[kind];
+    }
+
+    inline const Signatures &
+    getSignatures(void) const {
+        return signatures;
+    }
+
+    inline const std::vector<unsigned> &
+    getFrames(void) const {
+        return frames;
+    }
+
+    /**
+     * Add the calls whose keys of the given kinds (a bitmask) contain the
+     * text.
+     */
+    void
+    find(const char *text, bool caseSensitive, unsigned kinds, CallSet &calls) const;
+
+    static const char *
+    kindName(Kind kind);
+};
+
+
+} /* namespace trace */
+
+#endif /* _TRACE_INDEX_HPP_ */
@@ -27,6 +27,7 @@
 
 #include <assert.h>
 #include <stdlib.h>
+#include <string.h>
 
 #include "trace_file.hpp"
 #include "trace_parser.hpp"
@@ -41,6 +42,9 @@ namespace trace {
 Parser::Parser() {
     file = NULL;
     next_call_no = 0;
+    arg_begins = NULL;
+    arg_ends = NULL;
+    entering_args = NULL;
     version = 0;
 }
 
@@ -92,6 +96,8 @@ void Parser::close(void) {
     }
 
     deleteAll(calls);
+    clear_last_args();
+    keyframe = File::Offset();
 
     // Delete all signature data.  Signatures are mere structures which don't
     // own their own memory, so we need to destroy all data we created here.
@@ -147,18 +153,224 @@ void Parser::close(void) {
 }
 
 
+void Parser::clear_last_args(void) {
+    for (unsigned id = 0; id < last_args.size(); ++id) {
+        deleteAll(last_args[id]);
+    }
+    last_args.clear();
+}
+
+
 void Parser::getBookmark(ParseBookmark &bookmark) {
     bookmark.offset = file->currentOffset();
     bookmark.next_call_no = next_call_no;
+    bookmark.keyframe = keyframe;
 }
 
 
 void Parser::setBookmark(const ParseBookmark &bookmark) {
-    file->setCurrentOffset(bookmark.offset);
-    next_call_no = bookmark.next_call_no;
-    
     // Simply ignore all pending calls
     deleteAll(calls);
+
+    if (version > TRACE_VERSION_PLAIN &&
+        bookmark.next_call_no % TRACE_DELTA_INTERVAL != 0) {
+        // The arguments that delta encoded calls refer to are found by going
+        // through the calls since the keyframe, unless already there
+        if (keyframe == bookmark.keyframe &&
+            file->currentOffset() <= bookmark.offset) {
+            // Carry on from the current offset
+        } else {
+            file->setCurrentOffset(bookmark.keyframe);
+            next_call_no = bookmark.next_call_no - bookmark.next_call_no % TRACE_DELTA_INTERVAL;
+            parse_enter(SCAN);
+        }
+        while (file->currentOffset() < bookmark.offset) {
+            int c = read_byte();
+            if (c == trace::EVENT_ENTER) {
+                parse_enter(SCAN);
+            } else if (c == trace::EVENT_LEAVE) {
+                delete parse_leave(SCAN);
+            } else {
+                break;
+            }
+        }
+        deleteAll(calls);
+    }
+
+    file->setCurrentOffset(bookmark.offset);
+    next_call_no = bookmark.next_call_no;
+}
+
+
+static const char *
+copyString(const char *string) {
+    size_t len = strlen(string);
+    char *copy = new char[len + 1];
+    memcpy(copy, string, len + 1);
+    return copy;
+}
+
+
+/**
+ * Deep copy of a value.  Signatures are shared, as they belong to the parser.
+ */
+class Cloner : public Visitor
+{
+public:
+    Value *result;
+
+    void visit(Null *) {
+        result = new Null;
+    }
+
+    void visit(Bool *node) {
+        result = new Bool(node->value);
+    }
+
+    void visit(SInt *node) {
+        result = new SInt(node->value);
+    }
+
+    void visit(UInt *node) {
+        result = new UInt(node->value);
+    }
+
+    void visit(Float *node) {
+        result = new Float(node->value);
+    }
+
+    void visit(Double *node) {
+        result = new Double(node->value);
+    }
+
+    void visit(String *node) {
+        result = new String(copyString(node->value));
+    }
+
+    void visit(Enum *node) {
+        result = new Enum(node->sig);
+    }
+
+    void visit(Bitmask *node) {
+        result = new Bitmask(node->sig, node->value);
+    }
+
+    void visit(Struct *node) {
+        Struct *copy = new Struct(const_cast<StructSig *>(node->sig));
+        for (unsigned i = 0; i < node->members.size(); ++i) {
+            copy->members[i] = clone(node->members[i]);
+        }
+        result = copy;
+    }
+
+    void visit(Array *node) {
+        Array *copy = new Array(node->values.size());
+        for (unsigned i = 0; i < node->values.size(); ++i) {
+            copy->values[i] = clone(node->values[i]);
+        }
+        result = copy;
+    }
+
+    void visit(Blob *node) {
+        Blob *copy = new Blob(node->size);
+        memcpy(copy->buf, node->buf, node->size);
+        result = copy;
+    }
+
+    void visit(Pointer *node) {
+        result = new Pointer(node->value);
+    }
+
+    Value *clone(Value *value) {
+        result = NULL;
+        _visit(value);
+        return result;
+    }
+};
+
+
+static Value *
+cloneValue(Value *value) {
+    Cloner cloner;
+    return cloner.clone(value);
+}
+
+
+void Parser::copySignatures(const Parser &other) {
+    if (functions.size() < other.functions.size()) {
+        functions.resize(other.functions.size());
+    }
+    for (size_t id = 0; id < other.functions.size(); ++id) {
+        const FunctionSigState *src = other.functions[id];
+        if (src && !functions[id]) {
+            FunctionSigState *sig = new FunctionSigState;
+            sig->id = src->id;
+            sig->name = copyString(src->name);
+            sig->num_args = src->num_args;
+            const char **arg_names = new const char *[sig->num_args];
+            for (unsigned i = 0; i < sig->num_args; ++i) {
+                arg_names[i] = copyString(src->arg_names[i]);
+            }
+            sig->arg_names = arg_names;
+            sig->offset = src->offset;
+            functions[id] = sig;
+        }
+    }
+
+    if (structs.size() < other.structs.size()) {
+        structs.resize(other.structs.size());
+    }
+    for (size_t id = 0; id < other.structs.size(); ++id) {
+        const StructSigState *src = other.structs[id];
+        if (src && !structs[id]) {
+            StructSigState *sig = new StructSigState;
+            sig->id = src->id;
+            sig->name = copyString(src->name);
+            sig->num_members = src->num_members;
+            const char **member_names = new const char *[sig->num_members];
+            for (unsigned i = 0; i < sig->num_members; ++i) {
+                member_names[i] = copyString(src->member_names[i]);
+            }
+            sig->member_names = member_names;
+            sig->offset = src->offset;
+            structs[id] = sig;
+        }
+    }
+
+    if (enums.size() < other.enums.size()) {
+        enums.resize(other.enums.size());
+    }
+    for (size_t id = 0; id < other.enums.size(); ++id) {
+        const EnumSigState *src = other.enums[id];
+        if (src && !enums[id]) {
+            EnumSigState *sig = new EnumSigState;
+            sig->id = src->id;
+            sig->name = copyString(src->name);
+            sig->value = src->value;
+            sig->offset = src->offset;
+            enums[id] = sig;
+        }
+    }
+
+    if (bitmasks.size() < other.bitmasks.size()) {
+        bitmasks.resize(other.bitmasks.size());
+    }
+    for (size_t id = 0; id < other.bitmasks.size(); ++id) {
+        const BitmaskSigState *src = other.bitmasks[id];
+        if (src && !bitmasks[id]) {
+            BitmaskSigState *sig = new BitmaskSigState;
+            sig->id = src->id;
+            sig->num_flags = src->num_flags;
+            BitmaskFlag *flags = new BitmaskFlag[sig->num_flags];
+            for (unsigned i = 0; i < sig->num_flags; ++i) {
+                flags[i].name = copyString(src->flags[i].name);
+                flags[i].value = src->flags[i].value;
+            }
+            sig->flags = flags;
+            sig->offset = src->offset;
+            bitmasks[id] = sig;
+        }
+    }
 }
 
 
@@ -187,6 +399,33 @@ Call *Parser::parse_call(Mode mode) {
 }
 
 
+Call *Parser::parse_enter_event(const ParseBookmark &bookmark,
+                                std::vector<File::Offset> &begins,
+                                std::vector<File::Offset> &ends) {
+    setBookmark(bookmark);
+
+    if (read_byte() != trace::EVENT_ENTER) {
+        return NULL;
+    }
+
+    begins.clear();
+    ends.clear();
+    arg_begins = &begins;
+    arg_ends = &ends;
+    parse_enter(FULL);
+    arg_begins = NULL;
+    arg_ends = NULL;
+
+    if (calls.empty()) {
+        return NULL;
+    }
+
+    Call *call = calls.back();
+    calls.pop_back();
+    return call;
+}
+
+
 /**
  * Helper function to lookup an ID in a vector, resizing the vector if it doesn't fit.
  */
@@ -327,13 +566,29 @@ BitmaskSig *Parser::parse_bitmask_sig() {
 
 
 void Parser::parse_enter(Mode mode) {
+    bool deltas = version > TRACE_VERSION_PLAIN;
+    if (deltas && next_call_no % TRACE_DELTA_INTERVAL == 0) {
+        keyframe = file->currentOffset();
+        clear_last_args();
+    }
+
     FunctionSig *sig = parse_function_sig();
 
     Call *call = new Call(sig);
 
     call->no = next_call_no++;
 
-    if (parse_call_details(call, mode)) {
+    if (deltas) {
+        if (sig->id >= last_args.size()) {
+            last_args.resize(sig->id + 1);
+        }
+        entering_args = &last_args[sig->id];
+    }
+
+    bool complete = parse_call_details(call, mode);
+    entering_args = NULL;
+
+    if (complete) {
         calls.push_back(call);
     } else {
         delete call;
@@ -376,6 +631,9 @@ bool Parser::parse_call_details(Call *call, Mode mode) {
         case trace::CALL_RET:
             call->ret = parse_value(mode);
             break;
+        case trace::CALL_DELTA:
+            parse_delta(call, mode);
+            break;
         default:
             std::cerr << "error: ("<<call->name()<< ") unknown call detail "
                       << c << "\n";
@@ -389,12 +647,57 @@ bool Parser::parse_call_details(Call *call, Mode mode) {
 
 void Parser::parse_arg(Call *call, Mode mode) {
     unsigned index = read_uint();
-    Value *value = parse_value(mode);
+    File::Offset begin;
+    if (arg_begins) {
+        begin = file->currentOffset();
+    }
+    Value *value;
+    if (entering_args) {
+        // Later calls may refer to this value, so it is always parsed
+        Value *last = parse_value();
+        if (last) {
+            if (index >= entering_args->size()) {
+                entering_args->resize(index + 1);
+            }
+            delete (*entering_args)[index];
+            (*entering_args)[index] = last;
+        }
+        value = last && mode == FULL ? cloneValue(last) : NULL;
+    } else {
+        value = parse_value(mode);
+    }
     if (value) {
         if (index >= call->args.size()) {
             call->args.resize(index + 1);
         }
         call->args[index] = value;
+        if (arg_begins) {
+            if (index >= arg_begins->size()) {
+                arg_begins->resize(index + 1);
+                arg_ends->resize(index + 1);
+            }
+            (*arg_begins)[index] = begin;
+            (*arg_ends)[index] = file->currentOffset();
+        }
+    }
+}
+
+
+void Parser::parse_delta(Call *call, Mode mode) {
+    unsigned long long same = read_uint();
+    if (mode != FULL || !entering_args) {
+        return;
+    }
+
+    for (unsigned index = 0; same; ++index, same >>= 1) {
+        if ((same & 1) &&
+            index < entering_args->size() &&
+            (*entering_args)[index]) {
+            if (index >= call->args.size()) {
+                call->args.resize(index + 1);
+            }
+            call->args[index] = cloneValue((*entering_args)[index]);
+        }
     }
 }
 
@@ -29,6 +29,7 @@
 
 #include <iostream>
 #include <list>
+#include <vector>
 
 #include "trace_file.hpp"
 #include "trace_format.hpp"
@@ -42,6 +43,9 @@ struct ParseBookmark
 {
     File::Offset offset;
     unsigned next_call_no;
+
+    // Where the last keyframe of delta encoded traces starts
+    File::Offset keyframe;
 };
 
 
@@ -86,6 +90,17 @@ protected:
 
     unsigned next_call_no;
 
+    // Where argument values begin and end, when requested
+    std::vector<File::Offset> *arg_begins;
+    std::vector<File::Offset> *arg_ends;
+
+    // Arguments of the last enter event of every function, which delta
+    // encoded calls refer to, since the last keyframe
+    typedef std::vector<Value *> ValueList;
+    std::vector<ValueList> last_args;
+    ValueList *entering_args;
+    File::Offset keyframe;
+
 public:
     unsigned long long version;
 
@@ -110,6 +125,12 @@ public:
 
     void setBookmark(const ParseBookmark &bookmark);
 
+    /**
+     * Copy the signatures parsed so far by another parser of the same file,
+     * so that this one can be set to any bookmark taken by the other.
+     */
+    void copySignatures(const Parser &other);
+
     int percentRead()
     {
         return file->percentRead();
@@ -119,6 +140,16 @@ public:
         return parse_call(SCAN);
     }
 
+    /**
+     * Parse the enter event of the call started at the bookmark, noting
+     * where the value of each argument begins and ends, so that the
+     * arguments can be rewritten in place.  The call is returned before it
+     * leaves, so it has no return value.
+     */
+    Call *parse_enter_event(const ParseBookmark &bookmark,
+                            std::vector<File::Offset> &begins,
+                            std::vector<File::Offset> &ends);
+
 protected:
     Call *parse_call(Mode mode);
 
@@ -137,6 +168,10 @@ protected:
 
     void parse_arg(Call *call, Mode mode);
 
+    void parse_delta(Call *call, Mode mode);
+
+    void clear_last_args(void);
+
     Value *parse_value(void);
     void scan_value(void);
     inline Value *parse_value(Mode mode) {
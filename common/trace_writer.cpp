@@ -40,7 +40,10 @@ namespace trace {
 
 
 Writer::Writer() :
-    call_no(0)
+    call_no(0),
+    deltas(false),
+    buffering(false),
+    sig_id(0)
 {
     m_file = File::createSnappy();
     close();
@@ -59,7 +62,7 @@ Writer::close(void) {
 }
 
 bool
-Writer::open(const char *filename) {
+Writer::open(const char *filename, bool _deltas) {
     close();
 
     if (!m_file->open(filename, File::Write)) {
@@ -72,14 +75,27 @@ Writer::open(const char *filename) {
     enums.clear();
     bitmasks.clear();
 
-    _writeUInt(TRACE_VERSION);
+    deltas = _deltas;
+    buffering = false;
+    last_args.clear();
+
+    _writeUInt(deltas ? TRACE_VERSION : TRACE_VERSION_PLAIN);
 
     return true;
 }
 
+bool
+Writer::copy(File *file, const File::Offset &end) {
+    return file->copy(m_file, end);
+}
+
 void inline
 Writer::_write(const void *sBuffer, size_t dwBytesToWrite) {
-    m_file->write(sBuffer, dwBytesToWrite);
+    if (buffering) {
+        buffer.append((const char *)sBuffer, dwBytesToWrite);
+    } else {
+        m_file->write(sBuffer, dwBytesToWrite);
+    }
 }
 
 void inline
@@ -146,13 +162,73 @@ unsigned Writer::beginEnter(const FunctionSig *sig) {
         functions[sig->id] = true;
     }
 
+    if (deltas) {
+        if (call_no % TRACE_DELTA_INTERVAL == 0) {
+            last_args.clear();
+        }
+        buffering = true;
+        sig_id = sig->id;
+        buffer.clear();
+        args.clear();
+    }
+
     return call_no++;
 }
 
 void Writer::endEnter(void) {
+    if (buffering) {
+        buffering = false;
+        _writeDeltas();
+    }
     _writeByte(trace::CALL_END);
 }
 
+/**
+ * Write the buffered arguments of the enter event, leaving out the ones
+ * identical to the last ones written for the same function.
+ */
+void Writer::_writeDeltas(void) {
+    if (sig_id >= last_args.size()) {
+        last_args.resize(sig_id + 1);
+    }
+    std::vector<std::string> &last = last_args[sig_id];
+
+    // Values are never empty, so empty strings stand for unknown ones
+    unsigned long long same = 0;
+    for (unsigned i = 0; i < args.size(); ++i) {
+        const ArgSpan &arg = args[i];
+        size_t length = arg.end - arg.begin;
+        if (arg.index < 64 &&
+            arg.index < last.size() &&
+            last[arg.index].size() == length &&
+            last[arg.index].compare(0, length, buffer, arg.begin, length) == 0) {
+            same |= 1ULL << arg.index;
+        }
+    }
+
+    if (same) {
+        _writeByte(trace::CALL_DELTA);
+        _writeUInt(same);
+    }
+
+    for (unsigned i = 0; i < args.size(); ++i) {
+        const ArgSpan &arg = args[i];
+        if (arg.index < 64 && (same & (1ULL << arg.index))) {
+            continue;
+        }
+
+        size_t length = arg.end - arg.begin;
+        _writeByte(trace::CALL_ARG);
+        _writeUInt(arg.index);
+        _write(buffer.data() + arg.begin, length);
+
+        if (arg.index >= last.size()) {
+            last.resize(arg.index + 1);
+        }
+        last[arg.index].assign(buffer, arg.begin, length);
+    }
+}
+
 void Writer::beginLeave(unsigned call) {
     _writeByte(trace::EVENT_LEAVE);
     _writeUInt(call);
@@ -163,6 +239,14 @@ void Writer::endLeave(void) {
 }
 
 void Writer::beginArg(unsigned index) {
+    if (buffering) {
+        ArgSpan arg;
+        arg.index = index;
+        arg.begin = buffer.size();
+        arg.end = arg.begin;
+        args.push_back(arg);
+        return;
+    }
     _writeByte(trace::CALL_ARG);
     _writeUInt(index);
 }
@@ -33,13 +33,14 @@
 
 #include <stddef.h>
 
+#include <string>
 #include <vector>
 
+#include "trace_file.hpp"
 #include "trace_model.hpp"
 
 
 namespace trace {
-    class File;
 
     class Writer {
     protected:
@@ -51,11 +52,31 @@ namespace trace {
         std::vector<bool> enums;
         std::vector<bool> bitmasks;
 
+        // Delta encoding state: the arguments of the enter event being
+        // written are buffered, and compared with the last ones written for
+        // the same function
+        struct ArgSpan {
+            unsigned index;
+            size_t begin;
+            size_t end;
+        };
+
+        bool deltas;
+        bool buffering;
+        unsigned sig_id;
+        std::string buffer;
+        std::vector<ArgSpan> args;
+        std::vector< std::vector<std::string> > last_args;
+
     public:
         Writer();
         ~Writer();
 
-        bool open(const char *filename);
+        /**
+         * Open a trace for writing, with calls delta encoded against the
+         * previous call to the same function when deltas is true.
+         */
+        bool open(const char *filename, bool deltas = false);
         void close(void);
 
         unsigned beginEnter(const FunctionSig *sig);
@@ -65,7 +86,11 @@ namespace trace {
         void endLeave(void);
 
         void beginArg(unsigned index);
-        inline void endArg(void) {}
+        inline void endArg(void) {
+            if (buffering) {
+                args.back().end = buffer.size();
+            }
+        }
 
         void beginReturn(void);
         inline void endReturn(void) {}
@@ -94,8 +119,18 @@ namespace trace {
         void writeOpaque(const void *ptr);
 
         void writeCall(Call *call);
+        void writeValue(Value *value);
+
+        /**
+         * Copy the events of a trace being read as they are, from its current
+         * offset up to the given one.  Signatures defined in the copied
+         * events are not known to the writer.
+         */
+        bool copy(File *file, const File::Offset &end);
 
     protected:
+        void _writeDeltas(void);
+
         void inline _write(const void *sBuffer, size_t dwBytesToWrite);
         void inline _writeByte(char c);
         void inline _writeUInt(unsigned long long value);
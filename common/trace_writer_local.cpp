@@ -112,7 +112,11 @@ LocalWriter::open(void) {
 
     os::log("apitrace: tracing to %s\n", lpFileName);
 
-    if (!Writer::open(lpFileName)) {
+    // Delta encoded traces are smaller, but can't be read by older versions
+    const char *delta = getenv("TRACE_DELTA");
+    bool deltas = delta && strcmp(delta, "0") != 0;
+
+    if (!Writer::open(lpFileName, deltas)) {
         os::log("apitrace: error: failed to open %s\n", lpFileName);
         os::abort();
     }
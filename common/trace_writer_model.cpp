@@ -127,5 +127,11 @@ void Writer::writeCall(Call *call) {
 }
 
 
+void Writer::writeValue(Value *value) {
+    ModelWriter visitor(*this);
+    value->visit(visitor);
+}
+
+
 } /* namespace trace */
 
@@ -0,0 +1,121 @@
+##########################################################################
+#
+# Copyright 2012 VMware, Inc.
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+
+"""Generate glhandles.cpp, the table of the GL function arguments and return
+values which are object handles, used by apitrace trim.
+"""
+
+
+import specs.stdapi as stdapi
+from specs.glapi import glapi
+from specs.glesapi import glesapi
+
+
+class HandleFinder(stdapi.Visitor):
+    '''Find the handle in a type, looking through arrays.'''
+
+    def visit_void(self, void):
+        return None
+
+    def visit_literal(self, literal):
+        return None
+
+    def visit_string(self, string):
+        return None
+
+    def visit_const(self, const):
+        return self.visit(const.type)
+
+    def visit_struct(self, struct):
+        return None
+
+    def visit_array(self, array):
+        return self.visit(array.type)
+
+    def visit_blob(self, blob):
+        return None
+
+    def visit_enum(self, enum):
+        return None
+
+    def visit_bitmask(self, bitmask):
+        return None
+
+    def visit_pointer(self, pointer):
+        return self.visit(pointer.type)
+
+    def visit_handle(self, handle):
+        return handle
+
+    def visit_alias(self, alias):
+        return self.visit(alias.type)
+
+    def visit_opaque(self, opaque):
+        return None
+
+    def visit_interface(self, interface):
+        return None
+
+    def visit_polymorphic(self, polymorphic):
+        return None
+
+
+def rangeIndex(function, handle):
+    if handle.range is not None:
+        for arg in function.args:
+            if arg.name == handle.range:
+                return arg.index
+    return -1
+
+
+def main():
+    print '/* This file is automatically generated by glhandles.py, do not edit. */'
+    print
+    print '#include "glhandles.hpp"'
+    print
+    print
+    print 'const HandleArg handleArgs[] = {'
+
+    seen = set()
+    for function in glapi.functions + glesapi.functions:
+        if function.name in seen:
+            continue
+        seen.add(function.name)
+
+        handle = HandleFinder().visit(function.type)
+        if handle is not None:
+            print '    {"%s", -1, "%s", %i},' % (function.name, handle.name, rangeIndex(function, handle))
+        for arg in function.args:
+            handle = HandleFinder().visit(arg.type)
+            if handle is not None:
+                print '    {"%s", %u, "%s", %i},' % (function.name, arg.index, handle.name, rangeIndex(function, handle))
+
+    print '    {0, 0, 0, 0}'
+    print '};'
+
+
+if __name__ == '__main__':
+    main()
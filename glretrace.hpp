@@ -58,6 +58,9 @@ extern const char *snapshot_prefix;
 extern enum frequency snapshot_frequency;
 
 extern unsigned dump_state;
+extern enum frequency dump_frequency;
+
+extern bool profiling;
 
 void
 checkGlError(trace::Call &call);
@@ -69,10 +72,20 @@ extern const retrace::Entry wgl_callbacks[];
 extern const retrace::Entry egl_callbacks[];
 
 void snapshot(unsigned call_no);
+void dumpState(unsigned call_no);
 void frame_complete(trace::Call &call);
 
 void updateDrawable(int width, int height);
 
+bool beginProfiling(const char *filename);
+void beginCallProfile(trace::Call &call);
+void endCallProfile(trace::Call &call);
+void beginDrawProfile(void);
+void endDrawProfile(void);
+void flushContextProfiles(void);
+void destroyContextProfiles(glws::Context *ctx);
+void endProfiling(void);
+
 } /* namespace glretrace */
 
 
@@ -224,6 +224,9 @@ class GlRetracer(Retracer):
             print '    if (glretrace::snapshot_frequency == glretrace::FREQUENCY_DRAW) {'
             print '        glretrace::snapshot(call.no);'
             print '    }'
+            print '    if (glretrace::dump_frequency == glretrace::FREQUENCY_DRAW) {'
+            print '        glretrace::dumpState(call.no);'
+            print '    }'
 
 
     def call_function(self, function):
@@ -240,9 +243,23 @@ class GlRetracer(Retracer):
 
         if function.name == 'memcpy':
             print '    if (!dest || !src || !n) return;'
-        
+
+        # Measure the GPU time of draw calls
+        profile_draw = (function.name in self.draw_array_function_names or
+                        function.name in self.draw_elements_function_names or
+                        function.name in self.misc_draw_function_names and function.name != 'glEnd')
+        if profile_draw:
+            print '    if (glretrace::profiling) {'
+            print '        glretrace::beginDrawProfile();'
+            print '    }'
+
         Retracer.call_function(self, function)
 
+        if profile_draw:
+            print '    if (glretrace::profiling) {'
+            print '        glretrace::endDrawProfile();'
+            print '    }'
+
         # Error checking
         if function.name == "glBegin":
             print '    glretrace::insideGlBeginEnd = true;'
@@ -87,6 +87,8 @@ static void retrace_CGLSetCurrentContext(trace::Call &call) {
     glws::Drawable *new_drawable = getDrawable(ctx);
     glws::Context *new_context = getContext(ctx);
 
+    flushContextProfiles();
+
     bool result = glws::makeCurrent(new_drawable, new_context);
 
     if (new_drawable && new_context && result) {
@@ -158,6 +158,7 @@ static void retrace_eglDestroyContext(trace::Call &call) {
     it = context_map.find(orig_context);
 
     if (it != context_map.end()) {
+        destroyContextProfiles(it->second);
         delete it->second;
         context_map.erase(it);
     }
@@ -178,6 +179,8 @@ static void retrace_eglMakeCurrent(trace::Call &call) {
         }
     }
 
+    flushContextProfiles();
+
     bool result = glws::makeCurrent(new_drawable, new_context);
 
     if (new_drawable && new_context && result) {
@@ -99,6 +99,8 @@ static void retrace_glXMakeCurrent(trace::Call &call) {
         }
     }
 
+    flushContextProfiles();
+
     bool result = glws::makeCurrent(new_drawable, new_context);
 
     if (new_drawable && new_context && result) {
@@ -118,6 +120,7 @@ static void retrace_glXDestroyContext(trace::Call &call) {
         return;
     }
 
+    destroyContextProfiles(context);
     delete context;
 }
 
@@ -153,6 +156,8 @@ static void retrace_glXMakeContextCurrent(trace::Call &call) {
         }
     }
 
+    flushContextProfiles();
+
     bool result = glws::makeCurrent(new_drawable, new_context);
 
     if (new_drawable && new_context && result) {
@@ -26,9 +26,16 @@
 
 #include <string.h>
 
+#include <algorithm>
+#include <deque>
+#include <sstream>
+#include <vector>
+
 #include "os_string.hpp"
+#include "os_thread.hpp"
 #include "image.hpp"
 #include "retrace.hpp"
+#include "trace_callset.hpp"
 #include "glproc.hpp"
 #include "glstate.hpp"
 #include "glretrace.hpp"
@@ -53,6 +60,17 @@ const char *snapshot_prefix = NULL;
 enum frequency snapshot_frequency = FREQUENCY_NEVER;
 
 unsigned dump_state = ~0;
+enum frequency dump_frequency = FREQUENCY_NEVER;
+static trace::CallSet dump_calls;
+static unsigned dump_flags = glstate::DUMP_ALL;
+
+static const char *profile_filename = NULL;
+
+static bool parse_thread = false;
+
+static unsigned loop_count = 0;
+static unsigned loop_first_frame = 0;
+static unsigned loop_last_frame = ~0;
 
 void
 checkGlError(trace::Call &call) {
@@ -177,6 +195,22 @@ void snapshot(unsigned call_no) {
 }
 
 
+/**
+ * Dump the state at a call, as requested by the dump frequency.
+ */
+void dumpState(unsigned call_no) {
+    if (insideGlBeginEnd || !drawable || !context) {
+        return;
+    }
+
+    if (!dump_calls.empty() && !dump_calls.contains(call_no)) {
+        return;
+    }
+
+    glstate::dumpCurrentContext(std::cout, dump_flags, call_no);
+}
+
+
 void frame_complete(trace::Call &call) {
     ++frame;
 
@@ -192,9 +226,223 @@ void frame_complete(trace::Call &call) {
         snapshot_frequency == FREQUENCY_FRAMEBUFFER) {
         snapshot(call.no);
     }
+
+    if (dump_frequency == FREQUENCY_FRAME) {
+        dumpState(call.no);
+    }
+}
+
+
+typedef std::vector<trace::Call *> CallList;
+
+
+static void
+deleteCalls(CallList &calls) {
+    for (CallList::iterator it = calls.begin(); it != calls.end(); ++it) {
+        delete *it;
+    }
+    calls.clear();
 }
 
 
+/**
+ * Print the minimum, median, and 99th percentile of the given times (in
+ * microseconds).
+ */
+static void
+printTimes(const char *label, std::vector<long long> times) {
+    if (times.empty()) {
+        return;
+    }
+
+    std::sort(times.begin(), times.end());
+
+    size_t n = times.size();
+    size_t median = (n - 1) / 2;
+    size_t p99 = (n * 99 + 99) / 100 - 1;
+
+    std::cout <<
+        label <<
+        " min " << times[0] * 1.0E-3 << " ms,"
+        " median " << times[median] * 1.0E-3 << " ms,"
+        " p99 " << times[p99] * 1.0E-3 << " ms\n";
+}
+
+
+/**
+ * Replay the preloaded calls of a frame range several times, timing every
+ * iteration and every frame.
+ */
+static void
+loopFrames(retrace::Retracer &retracer, CallList &calls) {
+    if (calls.empty()) {
+        std::cerr << "warning: no frames to loop over\n";
+        return;
+    }
+
+    // Snapshots would only get in the way of the timings
+    snapshot_frequency = FREQUENCY_NEVER;
+
+    std::vector<long long> iterationTimes;
+    std::vector<long long> frameTimes;
+    std::vector< std::vector<long long> > framesTimes;
+
+    glFinish();
+
+    for (unsigned iteration = 0; iteration < loop_count; ++iteration) {
+        long long iterationStart = os::getTime();
+        long long frameStart = iterationStart;
+        unsigned frameIndex = 0;
+
+        for (CallList::const_iterator it = calls.begin(); it != calls.end(); ++it) {
+            unsigned callFrame = frame;
+
+            retracer.retrace(**it);
+
+            if (frame != callFrame) {
+                long long frameEnd = os::getTime();
+                frameTimes.push_back(frameEnd - frameStart);
+                if (frameIndex >= framesTimes.size()) {
+                    framesTimes.resize(frameIndex + 1);
+                }
+                framesTimes[frameIndex].push_back(frameEnd - frameStart);
+                ++frameIndex;
+                frameStart = frameEnd;
+            }
+        }
+
+        glFinish();
+
+        long long iterationEnd = os::getTime();
+        iterationTimes.push_back(iterationEnd - iterationStart);
+    }
+
+    if (retrace::verbosity >= -1) {
+        std::cout << "Looped " << framesTimes.size() << " frames " << loop_count << " times\n";
+        printTimes("Iteration:", iterationTimes);
+        printTimes("Frame:", frameTimes);
+        if (retrace::verbosity >= 0) {
+            for (unsigned i = 0; i < framesTimes.size(); ++i) {
+                std::ostringstream label;
+                label << "Frame " << i << ":";
+                printTimes(label.str().c_str(), framesTimes[i]);
+            }
+        }
+    }
+}
+
+
+/**
+ * Parses calls on a separate thread, feeding them through a bounded queue,
+ * so that the parsing overhead overlaps with the GL calls.
+ */
+class ParserThread
+{
+private:
+    static const size_t capacity = 256;
+
+    os::thread thread;
+    os::mutex mutex;
+    os::condition_variable notEmpty;
+    os::condition_variable notFull;
+
+    std::deque<trace::Call *> queue;
+    bool finished;
+    bool stopping;
+
+    static void
+    runThread(void *arg) {
+        static_cast<ParserThread *>(arg)->run();
+    }
+
+    void
+    run(void) {
+        while (true) {
+            trace::Call *call = parser.parse_call();
+
+            os::scoped_lock lock(mutex);
+
+            while (queue.size() >= capacity && !stopping) {
+                notFull.wait(mutex);
+            }
+
+            if (stopping) {
+                delete call;
+                break;
+            }
+
+            if (!call) {
+                finished = true;
+                notEmpty.notify_one();
+                break;
+            }
+
+            queue.push_back(call);
+            notEmpty.notify_one();
+        }
+    }
+
+public:
+    ParserThread() :
+        finished(false),
+        stopping(false)
+    {}
+
+    ~ParserThread() {
+        stop();
+    }
+
+    bool
+    isRunning(void) const {
+        return thread.joinable();
+    }
+
+    void
+    start(void) {
+        finished = false;
+        stopping = false;
+        thread.run(&runThread, this);
+    }
+
+    trace::Call *
+    get(void) {
+        os::scoped_lock lock(mutex);
+
+        while (queue.empty() && !finished) {
+            notEmpty.wait(mutex);
+        }
+
+        if (queue.empty()) {
+            return NULL;
+        }
+
+        trace::Call *call = queue.front();
+        queue.pop_front();
+        notFull.notify_one();
+        return call;
+    }
+
+    void
+    stop(void) {
+        if (!thread.joinable()) {
+            return;
+        }
+
+        mutex.lock();
+        stopping = true;
+        notFull.notify_one();
+        mutex.unlock();
+
+        thread.join();
+
+        while (!queue.empty()) {
+            delete queue.front();
+            queue.pop_front();
+        }
+    }
+};
+
+
 static void display(void) {
     retrace::Retracer retracer;
 
@@ -204,25 +452,96 @@ static void display(void) {
     retracer.addCallbacks(cgl_callbacks);
     retracer.addCallbacks(egl_callbacks);
 
+    if (profile_filename) {
+        if (!beginProfiling(profile_filename)) {
+            exit(1);
+        }
+    }
+
     startTime = os::getTime();
     trace::Call *call;
 
-    while ((call = parser.parse_call())) {
-        retracer.retrace(*call);
+    unsigned nextDump = dump_calls.getFirst();
+
+    ParserThread parserThread;
+
+    // Calls kept resident for looping
+    CallList loopCalls;
+    CallList frameCalls;
 
-        if (!insideGlBeginEnd &&
-            drawable && context &&
-            call->no >= dump_state) {
-            glstate::dumpCurrentContext(std::cout);
-            exit(0);
+    while (true) {
+        if (parse_thread) {
+            if (!parserThread.isRunning()) {
+                parserThread.start();
+            }
+            call = parserThread.get();
+        } else {
+            call = parser.parse_call();
+        }
+        if (!call) {
+            break;
+        }
+
+        unsigned callFrame = frame;
+
+        if (profiling) {
+            beginCallProfile(*call);
+            retracer.retrace(*call);
+            endCallProfile(*call);
+        } else {
+            retracer.retrace(*call);
+        }
+
+        if (call->no >= nextDump &&
+            !insideGlBeginEnd &&
+            drawable && context) {
+            // With a dump frequency the calls only bound where to dump
+            if (dump_frequency == FREQUENCY_NEVER) {
+                glstate::dumpCurrentContext(std::cout, dump_flags, call->no);
+            }
+            nextDump = dump_calls.next(call->no + 1);
+            if (nextDump == ~0U) {
+                std::cout.flush();
+                // The parser must not be in use while exiting destroys it
+                delete call;
+                parserThread.stop();
+                exit(0);
+            }
+        }
+
+        if (loop_count) {
+            if (loop_last_frame == ~0U) {
+                // Keep the last complete frame
+                frameCalls.push_back(call);
+                if (frame != callFrame) {
+                    deleteCalls(loopCalls);
+                    loopCalls.swap(frameCalls);
+                }
+                continue;
+            }
+
+            if (callFrame >= loop_first_frame &&
+                callFrame <= loop_last_frame) {
+                loopCalls.push_back(call);
+                if (frame > loop_last_frame) {
+                    break;
+                }
+                continue;
+            }
         }
 
         delete call;
     }
 
+    parserThread.stop();
+
+    deleteCalls(frameCalls);
+
     // Reached the end of trace
     glFlush();
 
+    endProfiling();
+
     long long endTime = os::getTime();
     float timeInterval = (endTime - startTime) * 1.0E-6;
 
@@ -233,6 +552,11 @@ static void display(void) {
             " average of " << (frame/timeInterval) << " fps\n";
     }
 
+    if (loop_count) {
+        loopFrames(retracer, loopCalls);
+        deleteCalls(loopCalls);
+    }
+
     if (wait) {
         while (glws::processEvents()) {}
     } else {
@@ -246,14 +570,27 @@ static void usage(void) {
         "Usage: glretrace [OPTION] TRACE\n"
         "Replay TRACE.\n"
         "\n"
-        "  -b           benchmark mode (no error checking or warning messages)\n"
+        "  -b           benchmark mode (no error checking or warning messages);\n"
+        "               implies --parse-thread\n"
         "  -c PREFIX    compare against snapshots\n"
         "  -db          use a double buffer visual (default)\n"
         "  -sb          use a single buffer visual\n"
         "  -s PREFIX    take snapshots; `-` for PNM stdout output\n"
         "  -S FREQUENCY snapshot frequency: frame (default), framebuffer, or draw\n"
         "  -v           verbose output\n"
-        "  -D CALLNO    dump state at specific call no\n"
+        "  -D CALLSET   dump state at specific calls, e.g. 100,250-300,9000\n"
+        "  --dump-state-every FREQUENCY  dump state at every frame or draw, within\n"
+        "                     the -D calls if given\n"
+        "  --dump-sections LIST  comma separated list of state sections to dump:\n"
+        "                     parameters, shaders, textures, framebuffer (default all);\n"
+        "                     textures:1d, 2d, 3d, rectangle or cube for one target\n"
+        "  --dump-delta       only dump the state which changed since the previous dump\n"
+        "  --dump-format FORMAT  state dump format: json (default) or binary\n"
+        "  --parse-thread     parse the trace on a separate thread\n"
+        "  --loop N           replay the loop frames N more times and report timings\n"
+        "  --loop-frames A-B  frames to loop over (default is the last frame)\n"
+        "  --profile FILE     write per-call CPU and GPU times as CSV into FILE;\n"
+        "                     `-` for stdout output\n"
         "  -w           wait on final frame\n";
 }
 
@@ -273,6 +610,7 @@ int main(int argc, char **argv)
             break;
         } else if (!strcmp(arg, "-b")) {
             benchmark = true;
+            parse_thread = true;
             retrace::verbosity = -1;
             glws::debug = false;
         } else if (!strcmp(arg, "-c")) {
@@ -281,8 +619,84 @@ int main(int argc, char **argv)
                 snapshot_frequency = FREQUENCY_FRAME;
             }
         } else if (!strcmp(arg, "-D")) {
-            dump_state = atoi(argv[++i]);
+            arg = argv[++i];
+            if (!dump_calls.parse(arg)) {
+                std::cerr << "error: invalid call set " << arg << "\n";
+                usage();
+                return 1;
+            }
+            dump_state = dump_calls.getFirst();
             retrace::verbosity = -2;
+        } else if (!strcmp(arg, "--dump-state-every")) {
+            arg = argv[++i];
+            if (!strcmp(arg, "frame")) {
+                dump_frequency = FREQUENCY_FRAME;
+            } else if (!strcmp(arg, "draw")) {
+                dump_frequency = FREQUENCY_DRAW;
+            } else {
+                std::cerr << "error: unknown frequency " << arg << "\n";
+                usage();
+                return 1;
+            }
+            retrace::verbosity = -2;
+        } else if (!strcmp(arg, "--dump-sections")) {
+            arg = argv[++i];
+            unsigned flags = dump_flags & ~glstate::DUMP_ALL;
+            std::istringstream list(arg);
+            std::string section;
+            while (std::getline(list, section, ',')) {
+                if (section == "parameters") {
+                    flags |= glstate::DUMP_PARAMETERS;
+                } else if (section == "shaders") {
+                    flags |= glstate::DUMP_SHADERS;
+                } else if (section == "textures") {
+                    flags |= glstate::DUMP_TEXTURES;
+                } else if (section == "textures:1d") {
+                    flags |= glstate::DUMP_TEXTURE_1D;
+                } else if (section == "textures:2d") {
+                    flags |= glstate::DUMP_TEXTURE_2D;
+                } else if (section == "textures:3d") {
+                    flags |= glstate::DUMP_TEXTURE_3D;
+                } else if (section == "textures:rectangle") {
+                    flags |= glstate::DUMP_TEXTURE_RECTANGLE;
+                } else if (section == "textures:cube") {
+                    flags |= glstate::DUMP_TEXTURE_CUBE_MAP;
+                } else if (section == "framebuffer") {
+                    flags |= glstate::DUMP_FRAMEBUFFER;
+                } else {
+                    std::cerr << "error: unknown state section " << section << "\n";
+                    usage();
+                    return 1;
+                }
+            }
+            dump_flags = flags;
+        } else if (!strcmp(arg, "--dump-delta")) {
+            dump_flags |= glstate::DUMP_DELTA;
+        } else if (!strcmp(arg, "--dump-format")) {
+            arg = argv[++i];
+            if (!strcmp(arg, "json")) {
+                dump_flags &= ~glstate::DUMP_BINARY;
+            } else if (!strcmp(arg, "binary")) {
+                dump_flags |= glstate::DUMP_BINARY;
+            } else {
+                std::cerr << "error: unknown dump format " << arg << "\n";
+                usage();
+                return 1;
+            }
+        } else if (!strcmp(arg, "--profile")) {
+            profile_filename = argv[++i];
+            if (profile_filename[0] == '-' && profile_filename[1] == 0) {
+                retrace::verbosity = -2;
+            }
+        } else if (!strcmp(arg, "--parse-thread")) {
+            parse_thread = true;
+        } else if (!strcmp(arg, "--loop")) {
+            loop_count = atoi(argv[++i]);
+        } else if (!strcmp(arg, "--loop-frames")) {
+            arg = argv[++i];
+            if (sscanf(arg, "%u-%u", &loop_first_frame, &loop_last_frame) == 1) {
+                loop_last_frame = loop_first_frame;
+            }
         } else if (!strcmp(arg, "-db")) {
             double_buffer = true;
         } else if (!strcmp(arg, "-sb")) {
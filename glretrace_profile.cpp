@@ -0,0 +1,314 @@
+/**************************************************************************
+ *
+ * Copyright 2012 Jose Fonseca
+ * All Rights Reserved.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in
+ * all copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+ * THE SOFTWARE.
+ *
+ **************************************************************************/
+
+
+/*
+ * Per-call profiling.
+ *
+ * The CPU time spent in every call is measured around the retrace callback.
+ * Draw calls are additionally bracketed with GL_TIMESTAMP queries (from
+ * ARB_timer_query) to measure the GPU time.  Query results are collected
+ * asynchronously, so records are held back until the results of all
+ * preceding draws are available, and then written out in call order as CSV:
+ *
+ *   call,frame,function,cpu_time,gpu_time
+ *
+ * where times are in nanoseconds, and gpu_time is empty for non-draw calls.
+ *
+ * Query names are not shared between contexts, so every context has its own
+ * pool of queries and its own pending records, which are all written out
+ * before another context is made current.
+ */
+
+
+#include <stdlib.h>
+#include <string.h>
+
+#include <deque>
+#include <fstream>
+#include <iostream>
+#include <map>
+#include <vector>
+
+#include "os.hpp"
+#include "glproc.hpp"
+#include "glretrace.hpp"
+
+
+namespace glretrace {
+
+
+bool profiling = false;
+
+
+struct CallProfile {
+    unsigned no;
+    unsigned frame;
+    const char *name;
+    long long cpuTime;
+    GLuint queries[2];
+};
+
+
+struct ContextProfile {
+    std::deque<CallProfile> profiles;
+    std::vector<GLuint> freeQueries;
+};
+
+
+static std::ostream *profileStream = NULL;
+
+// Calls made without a current context are kept under NULL
+typedef std::map<glws::Context *, ContextProfile> ContextProfileMap;
+static ContextProfileMap contextProfiles;
+
+static long long cpuStart = 0;
+static GLuint gpuQueries[2] = {0, 0};
+
+static bool checkedTimerQuery = false;
+static bool supportsTimerQuery = false;
+
+
+static bool
+checkTimerQuery(void) {
+    if (checkedTimerQuery) {
+        return supportsTimerQuery;
+    }
+
+    checkedTimerQuery = true;
+
+    const char *version = (const char *)glGetString(GL_VERSION);
+    if (version) {
+        int major = 0, minor = 0;
+        sscanf(version, "%d.%d", &major, &minor);
+        if (major > 3 || (major == 3 && minor >= 3)) {
+            supportsTimerQuery = true;
+        }
+    }
+
+    if (!supportsTimerQuery) {
+        const char *extensions = (const char *)glGetString(GL_EXTENSIONS);
+        if (extensions && strstr(extensions, "GL_ARB_timer_query")) {
+            supportsTimerQuery = true;
+        }
+    }
+
+    if (!supportsTimerQuery) {
+        std::cerr << "warning: ARB_timer_query not supported; GPU times will not be profiled\n";
+    }
+
+    return supportsTimerQuery;
+}
+
+
+static inline ContextProfile &
+currentProfile(void) {
+    return contextProfiles[context];
+}
+
+
+static inline GLuint
+allocQuery(void) {
+    std::vector<GLuint> &freeQueries = currentProfile().freeQueries;
+    GLuint query;
+    if (freeQueries.empty()) {
+        glGenQueries(1, &query);
+    } else {
+        query = freeQueries.back();
+        freeQueries.pop_back();
+    }
+    return query;
+}
+
+
+static void
+writeProfile(ContextProfile &contextProfile, const CallProfile &profile) {
+    *profileStream << profile.no << ","
+                   << profile.frame << ","
+                   << profile.name << ","
+                   << profile.cpuTime * 1000 << ",";
+
+    if (profile.queries[0]) {
+        GLuint64 begin = 0, end = 0;
+        glGetQueryObjectui64v(profile.queries[0], GL_QUERY_RESULT, &begin);
+        glGetQueryObjectui64v(profile.queries[1], GL_QUERY_RESULT, &end);
+        *profileStream << (end - begin);
+        contextProfile.freeQueries.push_back(profile.queries[0]);
+        contextProfile.freeQueries.push_back(profile.queries[1]);
+    }
+
+    *profileStream << "\n";
+}
+
+
+/**
+ * Write out the records of the current context whose results are already
+ * available, or all of them when blocking.
+ */
+static void
+flushProfiles(bool block) {
+    ContextProfile &contextProfile = currentProfile();
+    std::deque<CallProfile> &profiles = contextProfile.profiles;
+    while (!profiles.empty()) {
+        const CallProfile &profile = profiles.front();
+
+        if (!block && profile.queries[1]) {
+            GLint available = 0;
+            glGetQueryObjectiv(profile.queries[1], GL_QUERY_RESULT_AVAILABLE, &available);
+            if (!available) {
+                break;
+            }
+        }
+
+        writeProfile(contextProfile, profile);
+        profiles.pop_front();
+    }
+}
+
+
+bool
+beginProfiling(const char *filename) {
+    if (filename[0] == '-' && filename[1] == 0) {
+        profileStream = &std::cout;
+    } else {
+        std::ofstream *file = new std::ofstream(filename);
+        if (!*file) {
+            std::cerr << "error: failed to open " << filename << "\n";
+            delete file;
+            return false;
+        }
+        profileStream = file;
+    }
+
+    *profileStream << "# call,frame,function,cpu_time,gpu_time\n";
+
+    profiling = true;
+
+    return true;
+}
+
+
+void
+beginCallProfile(trace::Call &call) {
+    (void)call;
+    gpuQueries[0] = 0;
+    gpuQueries[1] = 0;
+    cpuStart = os::getTime();
+}
+
+
+void
+endCallProfile(trace::Call &call) {
+    long long cpuEnd = os::getTime();
+
+    CallProfile profile;
+    profile.no = call.no;
+    profile.frame = frame;
+    profile.name = call.name();
+    profile.cpuTime = cpuEnd - cpuStart;
+    profile.queries[0] = gpuQueries[0];
+    profile.queries[1] = gpuQueries[1];
+
+    currentProfile().profiles.push_back(profile);
+
+    if (!context) {
+        flushProfiles(true);
+    } else if (!insideGlBeginEnd) {
+        flushProfiles(false);
+    }
+}
+
+
+void
+beginDrawProfile(void) {
+    if (!context || !checkTimerQuery()) {
+        return;
+    }
+
+    gpuQueries[0] = allocQuery();
+    gpuQueries[1] = allocQuery();
+    glQueryCounter(gpuQueries[0], GL_TIMESTAMP);
+}
+
+
+void
+endDrawProfile(void) {
+    if (gpuQueries[1]) {
+        glQueryCounter(gpuQueries[1], GL_TIMESTAMP);
+    }
+}
+
+
+/**
+ * Write out all the records of the current context, before another one is
+ * made current.
+ */
+void
+flushContextProfiles(void) {
+    if (profiling && context) {
+        flushProfiles(true);
+    }
+}
+
+
+/**
+ * Forget the queries of a context which is being destroyed.
+ */
+void
+destroyContextProfiles(glws::Context *ctx) {
+    if (!profiling) {
+        return;
+    }
+
+    ContextProfileMap::iterator it = contextProfiles.find(ctx);
+    if (it != contextProfiles.end()) {
+        if (ctx == context) {
+            flushProfiles(true);
+        }
+        contextProfiles.erase(it);
+    }
+}
+
+
+void
+endProfiling(void) {
+    if (!profiling) {
+        return;
+    }
+
+    flushProfiles(true);
+    contextProfiles.clear();
+
+    profileStream->flush();
+    if (profileStream != &std::cout) {
+        delete profileStream;
+    }
+    profileStream = NULL;
+
+    profiling = false;
+}
+
+
+} /* namespace glretrace */
@@ -74,6 +74,8 @@ static void retrace_wglMakeCurrent(trace::Call &call) {
     glws::Drawable *new_drawable = getDrawable(call.arg(0).toUIntPtr());
     glws::Context *new_context = context_map[call.arg(1).toUIntPtr()];
 
+    flushContextProfiles();
+
     bool result = glws::makeCurrent(new_drawable, new_context);
 
     if (new_drawable && new_context && result) {
@@ -117,11 +119,13 @@ static void retrace_wglShareLists(trace::Call &call) {
         glws::createContext(old_context->visual, share_context);
     if (new_context) {
         if (context == old_context) {
+            flushContextProfiles();
             glws::makeCurrent(drawable, new_context);
         }
 
         context_map[hglrc2] = new_context;
         
+        destroyContextProfiles(old_context);
         delete old_context;
     }
 }
@@ -622,15 +622,21 @@ dumpTextureImage(JSONWriter &json, GLenum target, GLint level)
         restorePixelPackState();
 
         json.beginMember("__data__");
-        char *pngBuffer;
-        int pngBufferSize;
-        image::writePixelsToBuffer(pixels, width, height, 4, true, &pngBuffer, &pngBufferSize);
-        json.writeBase64(pngBuffer, pngBufferSize);
-        free(pngBuffer);
+        if (json.isBinary()) {
+            // Raw bottom-up pixels, as PNG encoding is expensive
+            json.writeBlob(pixels, depth*width*height*4);
+        } else {
+            char *pngBuffer;
+            int pngBufferSize;
+            image::writePixelsToBuffer(pixels, width, height, 4, true, &pngBuffer, &pngBufferSize);
+            json.writeBase64(pngBuffer, pngBufferSize);
+            free(pngBuffer);
+        }
         json.endMember(); // __data__
 
         delete [] pixels;
         json.endObject();
+        json.endMember(); // label
     }
 }
 
@@ -667,7 +673,7 @@ dumpTexture(JSONWriter &json, GLenum target, GLenum binding)
 
 
 static inline void
-dumpTextures(JSONWriter &json)
+dumpTextures(JSONWriter &json, unsigned flags)
 {
     json.beginMember("textures");
     json.beginObject();
@@ -681,11 +687,21 @@ dumpTextures(JSONWriter &json)
     for (GLint unit = 0; unit < max_units; ++unit) {
         GLenum texture = GL_TEXTURE0 + unit;
         glActiveTexture(texture);
-        dumpTexture(json, GL_TEXTURE_1D, GL_TEXTURE_BINDING_1D);
-        dumpTexture(json, GL_TEXTURE_2D, GL_TEXTURE_BINDING_2D);
-        dumpTexture(json, GL_TEXTURE_3D, GL_TEXTURE_BINDING_3D);
-        dumpTexture(json, GL_TEXTURE_RECTANGLE, GL_TEXTURE_BINDING_RECTANGLE);
-        dumpTexture(json, GL_TEXTURE_CUBE_MAP, GL_TEXTURE_BINDING_CUBE_MAP);
+        if (flags & DUMP_TEXTURE_1D) {
+            dumpTexture(json, GL_TEXTURE_1D, GL_TEXTURE_BINDING_1D);
+        }
+        if (flags & DUMP_TEXTURE_2D) {
+            dumpTexture(json, GL_TEXTURE_2D, GL_TEXTURE_BINDING_2D);
+        }
+        if (flags & DUMP_TEXTURE_3D) {
+            dumpTexture(json, GL_TEXTURE_3D, GL_TEXTURE_BINDING_3D);
+        }
+        if (flags & DUMP_TEXTURE_RECTANGLE) {
+            dumpTexture(json, GL_TEXTURE_RECTANGLE, GL_TEXTURE_BINDING_RECTANGLE);
+        }
+        if (flags & DUMP_TEXTURE_CUBE_MAP) {
+            dumpTexture(json, GL_TEXTURE_CUBE_MAP, GL_TEXTURE_BINDING_CUBE_MAP);
+        }
     }
     glActiveTexture(active_texture);
     json.endObject();
@@ -1054,13 +1070,18 @@ dumpReadBufferImage(JSONWriter &json, GLint width, GLint height, GLenum format,
     restorePixelPackState();
 
     json.beginMember("__data__");
-    char *pngBuffer;
-    int pngBufferSize;
-    image::writePixelsToBuffer(pixels, width, height, channels, true, &pngBuffer, &pngBufferSize);
-    //std::cerr <<" Before = "<<(width * height * channels * sizeof *pixels)
-    //          <<", after = "<<pngBufferSize << ", ratio = " << double(width * height * channels * sizeof *pixels)/pngBufferSize;
-    json.writeBase64(pngBuffer, pngBufferSize);
-    free(pngBuffer);
+    if (json.isBinary()) {
+        // Raw bottom-up pixels, as PNG encoding is expensive
+        json.writeBlob(pixels, width*height*channels);
+    } else {
+        char *pngBuffer;
+        int pngBufferSize;
+        image::writePixelsToBuffer(pixels, width, height, channels, true, &pngBuffer, &pngBufferSize);
+        //std::cerr <<" Before = "<<(width * height * channels * sizeof *pixels)
+        //          <<", after = "<<pngBufferSize << ", ratio = " << double(width * height * channels * sizeof *pixels)/pngBufferSize;
+        json.writeBase64(pngBuffer, pngBufferSize);
+        free(pngBuffer);
+    }
     json.endMember(); // __data__
 
     delete [] pixels;
@@ -1402,9 +1423,20 @@ static const GLenum bindings[] = {
 #define NUM_BINDINGS sizeof(bindings)/sizeof(bindings[0])
 
 
-void dumpCurrentContext(std::ostream &os)
+static JSONWriter::DeltaCache deltaCache;
+
+
+void dumpCurrentContext(std::ostream &os, unsigned flags, unsigned call_no)
 {
-    JSONWriter json(os);
+    JSONWriter json(os, (flags & DUMP_BINARY) != 0);
+
+    if (call_no != ~0U) {
+        json.writeNumberMember("__call__", call_no);
+    }
+
+    if (flags & DUMP_DELTA) {
+        json.setDelta(&deltaCache);
+    }
 
 #ifndef NDEBUG
     GLint old_bindings[NUM_BINDINGS];
@@ -1414,10 +1446,18 @@ void dumpCurrentContext(std::ostream &os)
     }
 #endif
 
-    dumpParameters(json);
-    dumpShadersUniforms(json);
-    dumpTextures(json);
-    dumpFramebuffer(json);
+    if (flags & DUMP_PARAMETERS) {
+        dumpParameters(json);
+    }
+    if (flags & DUMP_SHADERS) {
+        dumpShadersUniforms(json);
+    }
+    if (flags & DUMP_TEXTURES) {
+        dumpTextures(json, flags);
+    }
+    if (flags & DUMP_FRAMEBUFFER) {
+        dumpFramebuffer(json);
+    }
 
 #ifndef NDEBUG
     for (unsigned i = 0; i < NUM_BINDINGS; ++i) {
@@ -49,7 +49,39 @@ void dumpEnum(JSONWriter &json, GLenum pname);
 
 void dumpParameters(JSONWriter &json);
 
-void dumpCurrentContext(std::ostream &os);
+/**
+ * Parts of the state to dump.
+ */
+enum {
+    DUMP_PARAMETERS  = 1 << 0,
+    DUMP_SHADERS     = 1 << 1,
+    DUMP_FRAMEBUFFER = 1 << 2,
+
+    // Textures, by target
+    DUMP_TEXTURE_1D        = 1 << 3,
+    DUMP_TEXTURE_2D        = 1 << 4,
+    DUMP_TEXTURE_3D        = 1 << 5,
+    DUMP_TEXTURE_RECTANGLE = 1 << 6,
+    DUMP_TEXTURE_CUBE_MAP  = 1 << 7,
+
+    DUMP_TEXTURES = DUMP_TEXTURE_1D | DUMP_TEXTURE_2D | DUMP_TEXTURE_3D |
+                    DUMP_TEXTURE_RECTANGLE | DUMP_TEXTURE_CUBE_MAP,
+
+    DUMP_ALL = DUMP_PARAMETERS | DUMP_SHADERS | DUMP_TEXTURES | DUMP_FRAMEBUFFER,
+
+    // Only dump the values which changed since the previous dump
+    DUMP_DELTA = 1 << 8,
+
+    // Use the binary encoding (see json.hpp) instead of JSON text
+    DUMP_BINARY = 1 << 9
+};
+
+/**
+ * Dump the current context state as a JSON document.  When a call number is
+ * given, it is written in the document as the "__call__" member, so that
+ * several dumps can be told apart.
+ */
+void dumpCurrentContext(std::ostream &os, unsigned flags = DUMP_ALL, unsigned call_no = ~0U);
 
 image::Image *
 getDrawBufferImage(GLenum format);
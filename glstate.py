@@ -306,6 +306,7 @@ class StateDumper:
             print '    json.beginObject();'
             self.dump_atoms(glGetMaterial, face)
             print '    json.endObject();'
+            print '    json.endMember(); // %s' % face
         print
 
     def dump_light_params(self):
@@ -335,6 +336,7 @@ class StateDumper:
             print '        json.beginObject();'
             self.dump_atoms(glGetTexEnv, target)
             print '        json.endObject();'
+            print '        json.endMember(); // %s' % target
             print '    }'
 
     def dump_vertex_attribs(self):
@@ -363,6 +365,7 @@ class StateDumper:
             print '        json.beginObject();'
             self.dump_atoms(glGetProgramARB, target)
             print '        json.endObject();'
+            print '        json.endMember(); // %s' % target
             print '    }'
 
     def dump_texture_parameters(self):
@@ -6,10 +6,15 @@
 #include <QDebug>
 #include <QDir>
 #include <QThread>
+#include <QtAlgorithms>
+
+#define DEFAULT_FRAME_CACHE_SIZE (256 * 1024 * 1024)
 
 ApiTrace::ApiTrace()
     : m_frameMarker(ApiTrace::FrameMarker_SwapBuffers),
-      m_needsSaving(false)
+      m_needsSaving(false),
+      m_frameCacheSize(DEFAULT_FRAME_CACHE_SIZE),
+      m_frameUses(0)
 {
     m_loader = new TraceLoader();
 
@@ -28,21 +33,9 @@ ApiTrace::ApiTrace()
     connect(this, SIGNAL(loaderSearch(ApiTrace::SearchRequest)),
             m_loader, SLOT(search(ApiTrace::SearchRequest)));
     connect(m_loader,
-            SIGNAL(searchResult(ApiTrace::SearchRequest,ApiTrace::SearchResult,ApiTraceCall*)),
+            SIGNAL(searchResult(ApiTrace::SearchRequest,ApiTrace::SearchResult,int)),
             this,
-            SLOT(loaderSearchResult(ApiTrace::SearchRequest,ApiTrace::SearchResult,ApiTraceCall*)));
-    connect(this, SIGNAL(loaderFindFrameStart(ApiTraceFrame*)),
-            m_loader, SLOT(findFrameStart(ApiTraceFrame*)));
-    connect(this, SIGNAL(loaderFindFrameEnd(ApiTraceFrame*)),
-            m_loader, SLOT(findFrameEnd(ApiTraceFrame*)));
-    connect(m_loader, SIGNAL(foundFrameStart(ApiTraceFrame*)),
-            this, SIGNAL(foundFrameStart(ApiTraceFrame*)));
-    connect(m_loader, SIGNAL(foundFrameEnd(ApiTraceFrame*)),
-            this, SIGNAL(foundFrameEnd(ApiTraceFrame*)));
-    connect(this, SIGNAL(loaderFindCallIndex(int)),
-            m_loader, SLOT(findCallIndex(int)));
-    connect(m_loader, SIGNAL(foundCallIndex(ApiTraceCall*)),
-            this, SIGNAL(foundCallIndex(ApiTraceCall*)));
+            SLOT(loaderSearchResult(ApiTrace::SearchRequest,ApiTrace::SearchResult,int)));
 
 
     connect(m_loader, SIGNAL(startedParsing()),
@@ -53,7 +46,7 @@ ApiTrace::ApiTrace()
             this, SIGNAL(finishedLoadingTrace()));
 
 
-    m_saver = new SaverThread(this);
+    m_saver = new SaverThread(m_loader, this);
     connect(m_saver, SIGNAL(traceSaved()),
             this, SLOT(slotSaved()));
     connect(m_saver, SIGNAL(traceSaved()),
@@ -152,6 +145,8 @@ void ApiTrace::setFileName(const QString &name)
         m_errors.clear();
         m_editedCalls.clear();
         m_queuedErrors.clear();
+        m_pendingLookups.clear();
+        m_cachedFrames.clear();
         m_needsSaving = false;
         emit invalidated();
 
@@ -259,7 +254,25 @@ bool ApiTrace::isSaving() const
 
 bool ApiTrace::hasErrors() const
 {
-    return !m_errors.isEmpty();
+    return !m_errors.isEmpty() || !m_queuedErrors.isEmpty();
+}
+
+quint64 ApiTrace::frameCacheSize() const
+{
+    return m_frameCacheSize;
+}
+
+void ApiTrace::setFrameCacheSize(quint64 size)
+{
+    m_frameCacheSize = size;
+    unloadFrames();
+}
+
+void ApiTrace::touchFrame(ApiTraceFrame *frame)
+{
+    if (frame) {
+        frame->setLastUse(++m_frameUses);
+    }
 }
 
 void ApiTrace::loadFrame(ApiTraceFrame *frame)
@@ -290,32 +303,56 @@ void ApiTrace::loaderFrameLoaded(ApiTraceFrame *frame,
         frame->setCalls(calls, binaryDataSize);
         emit endLoadingFrame(frame);
         m_loadingFrames.remove(frame);
+
+        touchFrame(frame);
+        m_cachedFrames.append(frame);
+    } else {
+        qDeleteAll(calls);
     }
 
     if (!m_queuedErrors.isEmpty()) {
-        QList< QPair<ApiTraceFrame*, ApiTraceError> >::iterator itr;
-        for (itr = m_queuedErrors.begin(); itr != m_queuedErrors.end();
-             ++itr) {
+        QList< QPair<ApiTraceFrame*, ApiTraceError> >::iterator itr =
+            m_queuedErrors.begin();
+        while (itr != m_queuedErrors.end()) {
             const ApiTraceError &error = (*itr).second;
+            ApiTraceCall *call = 0;
             if ((*itr).first == frame) {
-                ApiTraceCall *call = frame->callWithIndex(error.callIndex);
+                call = frame->callWithIndex(error.callIndex);
+            }
 
-                if (!call) {
-                    continue;
-                }
+            if (!call) {
+                ++itr;
+                continue;
+            }
 
-                call->setError(error.message);
-                m_queuedErrors.erase(itr);
+            call->setError(error.message);
+            itr = m_queuedErrors.erase(itr);
 
-                if (call->hasError()) {
-                    m_errors.insert(call);
-                } else {
-                    m_errors.remove(call);
-                }
-                emit changed(call);
+            if (call->hasError()) {
+                m_errors.insert(call);
+            } else {
+                m_errors.remove(call);
             }
+            emit changed(call);
+        }
+    }
+
+    // Answering may start other lookups
+    QList<Lookup> lookups;
+    QList<Lookup>::iterator itr = m_pendingLookups.begin();
+    while (itr != m_pendingLookups.end()) {
+        if ((*itr).frame == frame) {
+            lookups.append(*itr);
+            itr = m_pendingLookups.erase(itr);
+        } else {
+            ++itr;
         }
     }
+    foreach (const Lookup &lookup, lookups) {
+        finishLookup(lookup);
+    }
+
+    unloadFrames();
 }
 
 void ApiTrace::findNext(ApiTraceFrame *frame,
@@ -399,52 +436,96 @@ void ApiTrace::findPrev(ApiTraceFrame *frame,
     emit findResult(request, SearchResult_Wrapped, 0);
 }
 
+/*
+ * The loader only finds the number of the call, as the frames it loaded may
+ * have been unloaded again by the time the result arrives.
+ */
 void ApiTrace::loaderSearchResult(const ApiTrace::SearchRequest &request,
                                   ApiTrace::SearchResult result,
-                                  ApiTraceCall *call)
+                                  int callIndex)
 {
-    //qDebug()<<"Search result = "<<result
-    //       <<", call is = "<<call;
-    emit findResult(request, result, call);
+    int frameIdx = callInFrame(callIndex);
+    if (result != SearchResult_Found || frameIdx < 0) {
+        emit findResult(request, result, 0);
+        return;
+    }
+
+    Lookup search;
+    search.type = Lookup::Search;
+    search.frame = m_frames[frameIdx];
+    search.callIndex = callIndex;
+    search.request = request;
+    lookup(search);
 }
 
 void ApiTrace::findFrameStart(ApiTraceFrame *frame)
 {
-    if (frame->isLoaded()) {
-        emit foundFrameStart(frame);
-    } else {
-        emit loaderFindFrameStart(frame);
-    }
+    Lookup start;
+    start.type = Lookup::FrameStart;
+    start.frame = frame;
+    start.callIndex = -1;
+    lookup(start);
 }
 
 void ApiTrace::findFrameEnd(ApiTraceFrame *frame)
 {
-    if (frame->isLoaded()) {
-        emit foundFrameEnd(frame);
-    } else {
-        emit loaderFindFrameEnd(frame);
-    }
+    Lookup end;
+    end.type = Lookup::FrameEnd;
+    end.frame = frame;
+    end.callIndex = -1;
+    lookup(end);
 }
 
 void ApiTrace::findCallIndex(int index)
 {
     int frameIdx = callInFrame(index);
-    ApiTraceFrame *frame = 0;
 
     if (frameIdx < 0) {
         emit foundCallIndex(0);
         return;
     }
 
-    frame = m_frames[frameIdx];
+    Lookup call;
+    call.type = Lookup::CallIndex;
+    call.frame = m_frames[frameIdx];
+    call.callIndex = index;
+    lookup(call);
+}
 
-    if (frame) {
-        if (frame->isLoaded()) {
-            ApiTraceCall *call = frame->callWithIndex(index);
-            emit foundCallIndex(call);
-        } else {
-            emit loaderFindCallIndex(index);
-        }
+/*
+ * Answer the lookup right away when its frame is loaded, or else once the
+ * frame is.  Calls are only ever resolved here, on the GUI thread, so that
+ * they can't be unloaded before they are handed out.
+ */
+void ApiTrace::lookup(const Lookup &lookup)
+{
+    if (lookup.frame->isLoaded()) {
+        finishLookup(lookup);
+    } else {
+        m_pendingLookups.append(lookup);
+        loadFrame(lookup.frame);
+    }
+}
+
+void ApiTrace::finishLookup(const Lookup &lookup)
+{
+    ApiTraceFrame *frame = lookup.frame;
+    touchFrame(frame);
+
+    switch (lookup.type) {
+    case Lookup::FrameStart:
+        emit foundFrameStart(frame);
+        break;
+    case Lookup::FrameEnd:
+        emit foundFrameEnd(frame);
+        break;
+    case Lookup::CallIndex:
+        emit foundCallIndex(frame->callWithIndex(lookup.callIndex));
+        break;
+    case Lookup::Search:
+        emit findResult(lookup.request, SearchResult_Found,
+                        frame->callWithIndex(lookup.callIndex));
+        break;
     }
 }
 
@@ -452,7 +533,7 @@ int ApiTrace::callInFrame(int callIdx) const
 {
     unsigned numCalls = 0;
 
-    for (int frameIdx = 0; frameIdx <= m_frames.size(); ++frameIdx) {
+    for (int frameIdx = 0; frameIdx < m_frames.size(); ++frameIdx) {
         const ApiTraceFrame *frame = m_frames[frameIdx];
         unsigned numCallsInFrame =  frame->isLoaded()
                 ? frame->numChildren()
@@ -498,4 +579,66 @@ bool ApiTrace::isFrameLoading(ApiTraceFrame *frame) const
     return m_loadingFrames.contains(frame);
 }
 
+bool ApiTrace::isFramePinned(ApiTraceFrame *frame) const
+{
+    // Edits only live in memory until the trace is saved
+    foreach (ApiTraceCall *call, m_editedCalls) {
+        if (call->parentFrame() == frame) {
+            return true;
+        }
+    }
+    return false;
+}
+
+static bool
+frameUsedBefore(const ApiTraceFrame *a, const ApiTraceFrame *b)
+{
+    return a->lastUse() < b->lastUse();
+}
+
+/*
+ * Unload the least recently used frames until the cached frames fit in the
+ * budget.  The most recently used frame is always kept.
+ */
+void ApiTrace::unloadFrames()
+{
+    // Frames grow as the values of their calls are converted
+    quint64 cachedFramesSize = 0;
+    foreach (ApiTraceFrame *frame, m_cachedFrames) {
+        cachedFramesSize += frame->memorySize();
+    }
+
+    if (cachedFramesSize <= m_frameCacheSize) {
+        return;
+    }
+
+    qSort(m_cachedFrames.begin(), m_cachedFrames.end(), frameUsedBefore);
+
+    int i = 0;
+    while (cachedFramesSize > m_frameCacheSize &&
+           i + 1 < m_cachedFrames.count()) {
+        ApiTraceFrame *frame = m_cachedFrames[i];
+        if (isFramePinned(frame)) {
+            ++i;
+            continue;
+        }
+
+        // Errors are applied again when the frame is reloaded
+        foreach (ApiTraceCall *call, frame->calls()) {
+            if (m_errors.remove(call)) {
+                ApiTraceError error;
+                error.callIndex = call->index();
+                error.message = call->error();
+                m_queuedErrors.append(qMakePair(frame, error));
+            }
+        }
+
+        cachedFramesSize -= frame->memorySize();
+        emit beginUnloadingFrame(frame, frame->numChildren());
+        frame->unload();
+        emit endUnloadingFrame(frame);
+        m_cachedFrames.removeAt(i);
+    }
+}
+
 #include "apitrace.moc"
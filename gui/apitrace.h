@@ -83,6 +83,10 @@ public:
 
     bool hasErrors() const;
 
+    quint64 frameCacheSize() const;
+    void setFrameCacheSize(quint64 size);
+    void touchFrame(ApiTraceFrame *frame);
+
 public slots:
     void setFileName(const QString &name);
     void save();
@@ -120,15 +124,14 @@ signals:
     void endAddingFrames();
     void beginLoadingFrame(ApiTraceFrame *frame, int numAdded);
     void endLoadingFrame(ApiTraceFrame *frame);
+    void beginUnloadingFrame(ApiTraceFrame *frame, int numRemoved);
+    void endUnloadingFrame(ApiTraceFrame *frame);
     void foundFrameStart(ApiTraceFrame *frame);
     void foundFrameEnd(ApiTraceFrame *frame);
     void foundCallIndex(ApiTraceCall *call);
 
 signals:
     void loaderSearch(const ApiTrace::SearchRequest &request);
-    void loaderFindFrameStart(ApiTraceFrame *frame);
-    void loaderFindFrameEnd(ApiTraceFrame *frame);
-    void loaderFindCallIndex(int index);
 
 private slots:
     void addFrames(const QList<ApiTraceFrame*> &frames);
@@ -139,11 +142,29 @@ private slots:
                            quint64 binaryDataSize);
     void loaderSearchResult(const ApiTrace::SearchRequest &request,
                             ApiTrace::SearchResult result,
-                            ApiTraceCall *call);
+                            int callIndex);
 
 private:
+    // A lookup which is answered once its frame is loaded
+    struct Lookup {
+        enum Type {
+            FrameStart,
+            FrameEnd,
+            CallIndex,
+            Search
+        };
+        Type type;
+        ApiTraceFrame *frame;
+        int callIndex;
+        SearchRequest request;
+    };
+
+    void lookup(const Lookup &lookup);
+    void finishLookup(const Lookup &lookup);
     int callInFrame(int callIdx) const;
     bool isFrameLoading(ApiTraceFrame *frame) const;
+    bool isFramePinned(ApiTraceFrame *frame) const;
+    void unloadFrames();
 private:
     QString m_fileName;
     QString m_tempFileName;
@@ -163,6 +184,12 @@ private:
     QSet<ApiTraceCall*> m_errors;
     QList< QPair<ApiTraceFrame*, ApiTraceError> > m_queuedErrors;
     QSet<ApiTraceFrame*> m_loadingFrames;
+    QList<Lookup> m_pendingLookups;
+
+    // Frames loaded on demand, which can be unloaded again
+    QList<ApiTraceFrame*> m_cachedFrames;
+    quint64 m_frameCacheSize;
+    quint64 m_frameUses;
 };
 
 #endif
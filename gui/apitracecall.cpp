@@ -230,6 +230,179 @@ void VariantVisitor::visit(trace::Pointer *ptr)
 }
 
 
+/*
+ * Writes a value as apiVariantToString() would write its QVariant, straight
+ * from the parsed call, so that the call summary doesn't need the values to
+ * be converted.
+ */
+class SummaryVisitor : public trace::Visitor
+{
+public:
+    QString text(const trace::Value *value)
+    {
+        m_text = QString();
+        if (value) {
+            _visit(const_cast<trace::Value *>(value));
+        } else {
+            m_text = QLatin1String("?");
+        }
+        return m_text;
+    }
+
+    void visit(trace::Null *)
+    {
+        m_text = QLatin1String("NULL");
+    }
+
+    void visit(trace::Bool *node)
+    {
+        m_text = node->value ? QLatin1String("true") : QLatin1String("false");
+    }
+
+    void visit(trace::SInt *node)
+    {
+        m_text = QString::number(node->value);
+    }
+
+    void visit(trace::UInt *node)
+    {
+        m_text = QString::number(node->value);
+    }
+
+    void visit(trace::Float *node)
+    {
+        m_text = QString::number(node->value);
+    }
+
+    void visit(trace::Double *node)
+    {
+        m_text = QString::number(node->value);
+    }
+
+    void visit(trace::String *node)
+    {
+        m_text = plainTextToHTML(QString::fromStdString(node->value), false);
+    }
+
+    void visit(trace::Enum *node)
+    {
+        m_text = QString::fromStdString(node->sig->name);
+    }
+
+    void visit(trace::Bitmask *node)
+    {
+        const trace::BitmaskSig *sig = node->sig;
+        unsigned long long value = node->value;
+        bool first = true;
+        for (unsigned i = 0; value != 0 && i < sig->num_flags; ++i) {
+            unsigned long long flag = sig->flags[i].value;
+            if ((value & flag) == flag) {
+                if (!first) {
+                    m_text += QLatin1String(" | ");
+                }
+                m_text += QString::fromStdString(sig->flags[i].name);
+                value &= ~flag;
+                first = false;
+            }
+        }
+        if (value || first) {
+            if (!first) {
+                m_text += QLatin1String(" | ");
+            }
+            m_text += QString::fromLatin1("0x%1").arg(value, 0, 16);
+        }
+    }
+
+    void visit(trace::Struct *node)
+    {
+        const trace::StructSig *sig = node->sig;
+        QString str = QLatin1String("{");
+        for (unsigned i = 0; i < sig->num_members; ++i) {
+            str += QString::fromStdString(sig->member_names[i]) %
+                   QLatin1Literal(" = ") %
+                   text(node->members[i]);
+            if (i < sig->num_members - 1)
+                str += QLatin1String(", ");
+        }
+        str += QLatin1String("}");
+        m_text = str;
+    }
+
+    void visit(trace::Array *node)
+    {
+        QString str = QLatin1String("[");
+        for (unsigned i = 0; i < node->values.size(); ++i) {
+            str += text(node->values[i]);
+            if (i < node->values.size() - 1)
+                str += QLatin1String(", ");
+        }
+        str += QLatin1String("]");
+        m_text = str;
+    }
+
+    void visit(trace::Blob *node)
+    {
+        if (node->size < 1024) {
+            m_text = QObject::tr("[binary data, size = %1 bytes]").arg(int(node->size));
+        } else {
+            float kb = node->size/1024.;
+            m_text = QObject::tr("[binary data, size = %1 kb]").arg(kb);
+        }
+    }
+
+    void visit(trace::Pointer *node)
+    {
+        m_text = ApiPointer(node->value).toString();
+    }
+
+private:
+    QString m_text;
+};
+
+
+/*
+ * The rich text of a call on one line, as shown in the call list, with long
+ * arguments elided.
+ */
+static QString
+summaryText(const QString &name, const QStringList &argTexts,
+            const QString &returnText)
+{
+    QString richText = QString::fromLatin1(
+        "<span style=\"font-weight:bold\">%1</span>(").arg(name);
+    for (int i = 0; i < argTexts.count(); ++i) {
+        richText += QLatin1String("<span style=\"color:#0000ff\">");
+        const QString &argText = argTexts[i];
+
+        //if arguments are really long (e.g. shader text), cut them
+        // and elide it
+        if (argText.length() > 40) {
+            QString shortened = argText.mid(0, 40);
+            shortened[argText.length() - 5] = '.';
+            shortened[argText.length() - 4] = '.';
+            shortened[argText.length() - 3] = '.';
+            shortened[argText.length() - 2] = argText.at(argText.length() - 2);
+            shortened[argText.length() - 1] = argText.at(argText.length() - 1);
+            richText += shortened;
+        } else {
+            richText += argText;
+        }
+        richText += QLatin1String("</span>");
+        if (i < argTexts.count() - 1)
+            richText += QLatin1String(", ");
+    }
+    richText += QLatin1String(")");
+    if (!returnText.isNull()) {
+        richText +=
+            QLatin1Literal(" = ") %
+            QLatin1Literal("<span style=\"color:#0000ff\">") %
+            returnText %
+            QLatin1Literal("</span>");
+    }
+    return richText;
+}
+
+
 ApiEnum::ApiEnum(ApiTraceEnumSignature *sig)
     : m_sig(sig)
 {
@@ -634,7 +807,30 @@ ApiTraceCall::ApiTraceCall(ApiTraceFrame *parentFrame,
                            TraceLoader *loader,
                            const trace::Call *call)
     : ApiTraceEvent(ApiTraceEvent::Call),
+      m_loader(loader),
+      m_hasBookmark(false),
+      m_materialized(true),
+      m_parentFrame(parentFrame)
+{
+    init(loader, call);
+    loadValues(call);
+}
+
+ApiTraceCall::ApiTraceCall(ApiTraceFrame *parentFrame,
+                           TraceLoader *loader,
+                           const trace::Call *call,
+                           const trace::ParseBookmark &bookmark)
+    : ApiTraceEvent(ApiTraceEvent::Call),
+      m_loader(loader),
+      m_bookmark(bookmark),
+      m_hasBookmark(true),
+      m_materialized(false),
       m_parentFrame(parentFrame)
+{
+    init(loader, call);
+}
+
+void ApiTraceCall::init(TraceLoader *loader, const trace::Call *call)
 {
     m_index = call->no;
 
@@ -650,21 +846,41 @@ ApiTraceCall::ApiTraceCall(ApiTraceFrame *parentFrame,
         m_signature = new ApiTraceCallSignature(name, argNames);
         loader->addSignature(call->sig->id, m_signature);
     }
+
+    for (int i = 0; i < call->args.size(); ++i) {
+        if (dynamic_cast<const trace::Blob *>(call->args[i])) {
+            m_hasBinaryData = true;
+            m_binaryDataIndex = i;
+        }
+    }
+
+    // Painting the call list must not need the values
+    SummaryVisitor visitor;
+    QStringList argTexts;
+    for (int i = 0; i < m_signature->argNames().count(); ++i) {
+        argTexts += visitor.text(i < call->args.size() ? call->args[i] : 0);
+    }
+    QString returnText;
     if (call->ret) {
-        VariantVisitor retVisitor(loader);
+        returnText = visitor.text(call->ret);
+    }
+    m_summary = summaryText(m_signature->name(), argTexts, returnText);
+    m_summary.squeeze();
+}
+
+void ApiTraceCall::loadValues(const trace::Call *call) const
+{
+    if (call->ret) {
+        VariantVisitor retVisitor(m_loader);
         call->ret->visit(retVisitor);
         m_returnValue = retVisitor.variant();
     }
     m_argValues.reserve(call->args.size());
     for (int i = 0; i < call->args.size(); ++i) {
         if (call->args[i]) {
-            VariantVisitor argVisitor(loader);
+            VariantVisitor argVisitor(m_loader);
             call->args[i]->visit(argVisitor);
             m_argValues.append(argVisitor.variant());
-            if (m_argValues[i].type() == QVariant::ByteArray) {
-                m_hasBinaryData = true;
-                m_binaryDataIndex = i;
-            }
         } else {
             m_argValues.append(QVariant());
         }
@@ -672,6 +888,29 @@ ApiTraceCall::ApiTraceCall(ApiTraceFrame *parentFrame,
     m_argValues.squeeze();
 }
 
+void ApiTraceCall::materialize() const
+{
+    if (m_materialized) {
+        return;
+    }
+    m_materialized = true;
+
+    quint64 size = memorySize();
+
+    trace::Call *call = m_loader->parseCall(m_bookmark, m_index);
+    if (call) {
+        loadValues(call);
+        delete call;
+    } else {
+        qDebug() << "failed to parse call" << m_index << "again";
+        m_argValues.fill(QVariant(), m_signature->argNames().count());
+    }
+
+    if (m_parentFrame) {
+        m_parentFrame->addMemorySize(memorySize() - size);
+    }
+}
+
 ApiTraceCall::~ApiTraceCall()
 {
 }
@@ -704,6 +943,7 @@ ApiTrace * ApiTraceCall::parentTrace() const
 
 QVector<QVariant> ApiTraceCall::originalValues() const
 {
+    materialize();
     return m_argValues;
 }
 
@@ -737,6 +977,16 @@ bool ApiTraceCall::edited() const
     return !m_editedValues.isEmpty();
 }
 
+bool ApiTraceCall::hasBookmark() const
+{
+    return m_hasBookmark;
+}
+
+trace::ParseBookmark ApiTraceCall::bookmark() const
+{
+    return m_bookmark;
+}
+
 void ApiTraceCall::revert()
 {
     setEditedValues(QVector<QVariant>());
@@ -774,6 +1024,7 @@ QStringList ApiTraceCall::argNames() const
 
 QVector<QVariant> ApiTraceCall::arguments() const
 {
+    materialize();
     if (m_editedValues.isEmpty())
         return m_argValues;
     else
@@ -782,6 +1033,7 @@ QVector<QVariant> ApiTraceCall::arguments() const
 
 QVariant ApiTraceCall::returnValue() const
 {
+    materialize();
     return m_returnValue;
 }
 
@@ -800,45 +1052,70 @@ int ApiTraceCall::binaryDataIndex() const
     return m_binaryDataIndex;
 }
 
+/*
+ * Approximate heap usage of a value, counting the blobs, strings and
+ * arrays it holds.
+ */
+static quint64
+variantMemorySize(const QVariant &var)
+{
+    quint64 size = sizeof(QVariant);
+
+    if (var.userType() == QVariant::ByteArray) {
+        size += var.toByteArray().size();
+    } else if (var.userType() == QVariant::String) {
+        size += var.toString().size() * sizeof(QChar);
+    } else if (var.canConvert<ApiArray>()) {
+        QVector<QVariant> values = var.value<ApiArray>().values();
+        for (int i = 0; i < values.count(); ++i) {
+            size += variantMemorySize(values[i]);
+        }
+    } else if (var.canConvert<ApiStruct>()) {
+        QList<QVariant> values = var.value<ApiStruct>().values();
+        for (int i = 0; i < values.count(); ++i) {
+            size += variantMemorySize(values[i]);
+        }
+    }
+
+    return size;
+}
+
+quint64 ApiTraceCall::memorySize() const
+{
+    quint64 size = sizeof *this;
+
+    for (int i = 0; i < m_argValues.count(); ++i) {
+        size += variantMemorySize(m_argValues[i]);
+    }
+    for (int i = 0; i < m_editedValues.count(); ++i) {
+        size += variantMemorySize(m_editedValues[i]);
+    }
+    size += variantMemorySize(m_returnValue);
+    size += m_summary.capacity() * sizeof(QChar);
+
+    return size;
+}
+
 QStaticText ApiTraceCall::staticText() const
 {
     if (m_staticText && !m_staticText->text().isEmpty())
         return *m_staticText;
 
-    QVector<QVariant> argValues = arguments();
-
-    QString richText = QString::fromLatin1(
-        "<span style=\"font-weight:bold\">%1</span>(").arg(
-            m_signature->name());
-    QStringList argNames = m_signature->argNames();
-    for (int i = 0; i < argNames.count(); ++i) {
-        richText += QLatin1String("<span style=\"color:#0000ff\">");
-        QString argText = apiVariantToString(argValues[i]);
-
-        //if arguments are really long (e.g. shader text), cut them
-        // and elide it
-        if (argText.length() > 40) {
-            QString shortened = argText.mid(0, 40);
-            shortened[argText.length() - 5] = '.';
-            shortened[argText.length() - 4] = '.';
-            shortened[argText.length() - 3] = '.';
-            shortened[argText.length() - 2] = argText.at(argText.length() - 2);
-            shortened[argText.length() - 1] = argText.at(argText.length() - 1);
-            richText += shortened;
-        } else {
-            richText += argText;
+    // Only edited calls differ from the summary made when loading, and
+    // their values are converted already
+    QString richText;
+    if (edited()) {
+        QStringList argTexts;
+        for (int i = 0; i < m_editedValues.count(); ++i) {
+            argTexts += apiVariantToString(m_editedValues[i]);
         }
-        richText += QLatin1String("</span>");
-        if (i < argNames.count() - 1)
-            richText += QLatin1String(", ");
-    }
-    richText += QLatin1String(")");
-    if (m_returnValue.isValid()) {
-        richText +=
-            QLatin1Literal(" = ") %
-            QLatin1Literal("<span style=\"color:#0000ff\">") %
-            apiVariantToString(m_returnValue) %
-            QLatin1Literal("</span>");
+        QString returnText;
+        if (m_returnValue.isValid()) {
+            returnText = apiVariantToString(m_returnValue);
+        }
+        richText = summaryText(m_signature->name(), argTexts, returnText);
+    } else {
+        richText = m_summary;
     }
 
     if (!m_staticText)
@@ -971,6 +1248,8 @@ ApiTraceFrame::ApiTraceFrame(ApiTrace *parentTrace)
     : ApiTraceEvent(ApiTraceEvent::Frame),
       m_parentTrace(parentTrace),
       m_binaryDataSize(0),
+      m_memorySize(0),
+      m_lastUse(0),
       m_loaded(false),
       m_callsToLoad(0),
       m_lastCallIndex(0)
@@ -1035,6 +1314,7 @@ void ApiTraceFrame::addCall(ApiTraceCall *call)
             call->arguments()[call->binaryDataIndex()].toByteArray();
         m_binaryDataSize += data.size();
     }
+    m_memorySize += call->memorySize();
 }
 
 QVector<ApiTraceCall*> ApiTraceFrame::calls() const
@@ -1083,11 +1363,25 @@ void ApiTraceFrame::setCalls(const QVector<ApiTraceCall*> &calls,
 {
     m_calls = calls;
     m_binaryDataSize = binaryDataSize;
+    m_memorySize = 0;
+    for (int i = 0; i < m_calls.count(); ++i) {
+        m_memorySize += m_calls[i]->memorySize();
+    }
     m_loaded = true;
     delete m_staticText;
     m_staticText = 0;
 }
 
+quint64 ApiTraceFrame::memorySize() const
+{
+    return m_memorySize;
+}
+
+void ApiTraceFrame::addMemorySize(quint64 size)
+{
+    m_memorySize += size;
+}
+
 bool ApiTraceFrame::isLoaded() const
 {
     return m_loaded;
@@ -1098,6 +1392,34 @@ void ApiTraceFrame::setLoaded(bool l)
     m_loaded = l;
 }
 
+/*
+ * Release the calls, which can be loaded again from the trace.  The
+ * binary data size is kept, as it is still shown for the frame.
+ */
+void ApiTraceFrame::unload()
+{
+    Q_ASSERT(m_loaded);
+
+    m_callsToLoad = m_calls.count();
+    m_lastCallIndex = lastCallIndex();
+    qDeleteAll(m_calls);
+    m_calls.clear();
+    m_memorySize = 0;
+    m_loaded = false;
+    delete m_staticText;
+    m_staticText = 0;
+}
+
+quint64 ApiTraceFrame::lastUse() const
+{
+    return m_lastUse;
+}
+
+void ApiTraceFrame::setLastUse(quint64 use)
+{
+    m_lastUse = use;
+}
+
 void ApiTraceFrame::setNumChildren(int num)
 {
     m_callsToLoad = num;
@@ -9,6 +9,7 @@
 #include <QVariant>
 
 #include "trace_model.hpp"
+#include "trace_parser.hpp"
 
 
 class ApiTrace;
@@ -246,6 +247,11 @@ class ApiTraceCall : public ApiTraceEvent
 public:
     ApiTraceCall(ApiTraceFrame *parentFrame, TraceLoader *loader,
                  const trace::Call *tcall);
+    /* the values are only converted when first needed, by parsing the
+     * call again from the bookmark */
+    ApiTraceCall(ApiTraceFrame *parentFrame, TraceLoader *loader,
+                 const trace::Call *tcall,
+                 const trace::ParseBookmark &bookmark);
     ~ApiTraceCall();
 
     int index() const;
@@ -280,17 +286,33 @@ public:
     int numChildren() const;
     bool hasBinaryData() const;
     int binaryDataIndex() const;
+
+    quint64 memorySize() const;
+
+    /* where the call can be parsed again, if known */
+    bool hasBookmark() const;
+    trace::ParseBookmark bookmark() const;
+private:
+    void init(TraceLoader *loader, const trace::Call *tcall);
+    void loadValues(const trace::Call *tcall) const;
+    void materialize() const;
 private:
     int m_index;
     ApiTraceCallSignature *m_signature;
-    QVector<QVariant> m_argValues;
-    QVariant m_returnValue;
+    TraceLoader *m_loader;
+    trace::ParseBookmark m_bookmark;
+    bool m_hasBookmark;
+    mutable bool m_materialized;
+    mutable QVector<QVariant> m_argValues;
+    mutable QVariant m_returnValue;
     ApiTraceFrame *m_parentFrame;
 
     QVector<QVariant> m_editedValues;
 
     QString m_error;
 
+    QString m_summary;
+
     mutable QString m_richText;
     mutable QString m_searchText;
 };
@@ -330,15 +352,23 @@ public:
                                Qt::CaseSensitivity sensitivity) const;
 
     int binaryDataSize() const;
+    quint64 memorySize() const;
+    void addMemorySize(quint64 size);
 
     bool isLoaded() const;
     void setLoaded(bool l);
+    void unload();
+
+    quint64 lastUse() const;
+    void setLastUse(quint64 use);
 
     void setLastCallIndex(unsigned index);
     unsigned lastCallIndex() const;
 private:
     ApiTrace *m_parentTrace;
     quint64 m_binaryDataSize;
+    quint64 m_memorySize;
+    quint64 m_lastUse;
     QVector<ApiTraceCall*> m_calls;
     bool m_loaded;
     unsigned m_callsToLoad;
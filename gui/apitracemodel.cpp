@@ -34,6 +34,11 @@ QVariant ApiTraceModel::data(const QModelIndex &index, int role) const
         return QVariant();
     }
 
+    if (itm->type() == ApiTraceEvent::Call) {
+        ApiTraceCall *call = static_cast<ApiTraceCall*>(itm);
+        m_trace->touchFrame(call->parentFrame());
+    }
+
     switch (role) {
     case Qt::DisplayRole:
         return itm->staticText().text();
@@ -254,6 +259,10 @@ void ApiTraceModel::setApiTrace(ApiTrace *trace)
             this, SLOT(beginLoadingFrame(ApiTraceFrame*,int)));
     connect(m_trace, SIGNAL(endLoadingFrame(ApiTraceFrame*)),
             this, SLOT(endLoadingFrame(ApiTraceFrame*)));
+    connect(m_trace, SIGNAL(beginUnloadingFrame(ApiTraceFrame*,int)),
+            this, SLOT(beginUnloadingFrame(ApiTraceFrame*,int)));
+    connect(m_trace, SIGNAL(endUnloadingFrame(ApiTraceFrame*)),
+            this, SLOT(endUnloadingFrame(ApiTraceFrame*)));
 
 }
 
@@ -398,4 +407,19 @@ void ApiTraceModel::endLoadingFrame(ApiTraceFrame *frame)
     m_loadingFrames.remove(frame);
 }
 
+void ApiTraceModel::beginUnloadingFrame(ApiTraceFrame *frame, int numRemoved)
+{
+    QModelIndex index = createIndex(frame->number, 0, frame);
+    beginRemoveRows(index, 0, numRemoved - 1);
+}
+
+void ApiTraceModel::endUnloadingFrame(ApiTraceFrame *frame)
+{
+    QModelIndex index = createIndex(frame->number, 0, frame);
+
+    endRemoveRows();
+
+    emit dataChanged(index, index);
+}
+
 #include "apitracemodel.moc"
@@ -57,6 +57,8 @@ private slots:
     void callChanged(ApiTraceCall *call);
     void beginLoadingFrame(ApiTraceFrame *frame, int numAdded);
     void endLoadingFrame(ApiTraceFrame *frame);
+    void beginUnloadingFrame(ApiTraceFrame *frame, int numRemoved);
+    void endUnloadingFrame(ApiTraceFrame *frame);
 
 private:
     ApiTraceEvent *item(const QModelIndex &index) const;
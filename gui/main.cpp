@@ -15,7 +15,10 @@ Q_DECLARE_METATYPE(ApiTrace::SearchRequest);
 
 static void usage(void)
 {
-    qWarning("usage: qapitrace [TRACE] [CALLNO]\n");
+    qWarning("usage: qapitrace [OPTIONS] [TRACE] [CALLNO]\n"
+             "\n"
+             "    --cache-size=MB     Memory used to keep the calls of frames\n"
+             "                        loaded (default 256)\n");
 }
 
 int main(int argc, char **argv)
@@ -29,6 +32,7 @@ int main(int argc, char **argv)
     qRegisterMetaType<ApiTrace::SearchResult>();
     qRegisterMetaType<ApiTrace::SearchRequest>();
     QStringList args = app.arguments();
+    int cacheSize = -1;
 
     int i = 1;
     while (i < args.count()) {
@@ -43,6 +47,13 @@ int main(int argc, char **argv)
                    arg == QLatin1String("--help")) {
             usage();
             exit(0);
+        } else if (arg.startsWith(QLatin1String("--cache-size="))) {
+            bool ok = false;
+            cacheSize = arg.section(QLatin1Char('='), 1).toInt(&ok);
+            if (!ok || cacheSize < 0) {
+                usage();
+                exit(1);
+            }
         } else {
             usage();
             exit(1);
@@ -50,6 +61,9 @@ int main(int argc, char **argv)
     }
 
     MainWindow window;
+    if (cacheSize >= 0) {
+        window.setFrameCacheSize(quint64(cacheSize) * 1024 * 1024);
+    }
     window.show();
 
     if (i < args.count()) {
@@ -81,6 +81,11 @@ void MainWindow::openTrace()
     }
 }
 
+void MainWindow::setFrameCacheSize(quint64 size)
+{
+    m_trace->setFrameCacheSize(size);
+}
+
 void MainWindow::loadTrace(const QString &fileName, int callNum)
 {
     if (!QFile::exists(fileName)) {
@@ -729,6 +734,8 @@ void MainWindow::initConnections()
             this, SLOT(slotFoundFrameEnd(ApiTraceFrame*)));
     connect(m_trace, SIGNAL(foundCallIndex(ApiTraceCall*)),
             this, SLOT(slotJumpToResult(ApiTraceCall*)));
+    connect(m_trace, SIGNAL(beginUnloadingFrame(ApiTraceFrame*,int)),
+            this, SLOT(slotFrameUnloading(ApiTraceFrame*)));
 
     connect(m_retracer, SIGNAL(finished(const QString&)),
             this, SLOT(replayFinished(const QString&)));
@@ -820,6 +827,12 @@ void MainWindow::initConnections()
 
 void MainWindow::replayStateFound(ApiTraceState *state)
 {
+    if (!m_stateEvent) {
+        // the event was unloaded while looking up the state
+        delete state;
+        m_nonDefaultsLookupEvent = 0;
+        return;
+    }
     m_stateEvent->setState(state);
     m_model->stateSetOnEvent(m_stateEvent);
     if (m_selectedEvent == m_stateEvent ||
@@ -1256,4 +1269,30 @@ void MainWindow::slotJumpToResult(ApiTraceCall *call)
     }
 }
 
+static bool
+isCallInFrame(const ApiTraceEvent *event, const ApiTraceFrame *frame)
+{
+    return event &&
+           event->type() == ApiTraceEvent::Call &&
+           static_cast<const ApiTraceCall*>(event)->parentFrame() == frame;
+}
+
+void MainWindow::slotFrameUnloading(ApiTraceFrame *frame)
+{
+    // Forget the calls of the frame, which are about to be deleted
+    if (isCallInFrame(m_selectedEvent, frame)) {
+        callItemSelected(QModelIndex());
+    }
+    if (isCallInFrame(m_stateEvent, frame)) {
+        m_stateEvent = 0;
+    }
+    if (isCallInFrame(m_nonDefaultsLookupEvent, frame)) {
+        m_nonDefaultsLookupEvent = 0;
+    }
+    if (isCallInFrame(m_argsEditor->call(), frame)) {
+        m_argsEditor->hide();
+        m_argsEditor->setCall(0);
+    }
+}
+
 #include "mainwindow.moc"
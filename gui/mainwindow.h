@@ -36,6 +36,8 @@ public:
     MainWindow();
     ~MainWindow();
 
+    void setFrameCacheSize(quint64 size);
+
 public slots:
     void loadTrace(const QString &fileName, int callNum = -1);
 
@@ -80,6 +82,7 @@ private slots:
     void slotFoundFrameStart(ApiTraceFrame *frame);
     void slotFoundFrameEnd(ApiTraceFrame *frame);
     void slotJumpToResult(ApiTraceCall *call);
+    void slotFrameUnloading(ApiTraceFrame *frame);
 
 private:
     void initObjects();
@@ -1,5 +1,9 @@
 #include "saverthread.h"
 
+#include "traceloader.h"
+
+#include "trace_file.hpp"
+#include "trace_format.hpp"
 #include "trace_writer.hpp"
 #include "trace_model.hpp"
 #include "trace_parser.hpp"
@@ -310,7 +314,7 @@ private:
     trace::Value *m_editedValue;
 };
 
-static void
+static bool
 overwriteValue(trace::Call *call, const QVariant &val, int index)
 {
     EditVisitor visitor(val);
@@ -320,11 +324,14 @@ overwriteValue(trace::Call *call, const QVariant &val, int index)
     if (visitor.value() && origValue != visitor.value()) {
         delete origValue;
         call->args[index] = visitor.value();
+        return true;
     }
+    return false;
 }
 
-SaverThread::SaverThread(QObject *parent)
-    : QThread(parent)
+SaverThread::SaverThread(TraceLoader *loader, QObject *parent)
+    : QThread(parent),
+      m_loader(loader)
 {
 }
 
@@ -342,6 +349,105 @@ void SaverThread::run()
 {
     qDebug() << "Saving  " << m_readFileName
              << ", to " << m_writeFileName;
+
+    if (!canStream() || !streamTrace()) {
+        rewriteTrace();
+    }
+
+    emit traceSaved();
+}
+
+bool SaverThread::canStream() const
+{
+    foreach(ApiTraceCall *call, m_editedCalls) {
+        if (!call->hasBookmark()) {
+            return false;
+        }
+    }
+
+    // The copied events must be understood with the version the writer
+    // puts in the header, and not be delta encoded, as the calls after an
+    // edited one could refer to its arguments
+    trace::Parser parser;
+    if (!parser.open(m_readFileName.toLocal8Bit())) {
+        return false;
+    }
+    return parser.supportsOffsets() && parser.version == TRACE_VERSION_PLAIN;
+}
+
+/*
+ * Only the edited argument values are written again, everything else is
+ * copied from the original trace as it is, mostly without even being
+ * decompressed.  The edited values never define signatures, so the ones
+ * defined in the copied events stay valid.
+ *
+ * Returns false, leaving an incomplete output behind, if an edited call
+ * can't be parsed again, so that the trace gets rewritten as a whole.
+ */
+bool SaverThread::streamTrace()
+{
+    QMap<int, ApiTraceCall*> callIndexMap;
+
+    foreach(ApiTraceCall *call, m_editedCalls) {
+        callIndexMap.insert(call->index(), call);
+    }
+
+    trace::ParseBookmark header;
+    {
+        trace::Parser parser;
+        parser.open(m_readFileName.toLocal8Bit());
+        parser.getBookmark(header);
+    }
+
+    trace::File *reader =
+        trace::File::createForRead(m_readFileName.toLocal8Bit());
+    if (!reader) {
+        return false;
+    }
+    reader->setCurrentOffset(header.offset);
+
+    trace::Writer writer;
+    writer.open(m_writeFileName.toLocal8Bit());
+
+    // Calls are numbered as they are entered, so this is also the order of
+    // their enter events in the trace
+    QMap<int, ApiTraceCall*>::const_iterator itr;
+    for (itr = callIndexMap.constBegin(); itr != callIndexMap.constEnd();
+         ++itr) {
+        ApiTraceCall *apiCall = itr.value();
+        std::vector<trace::File::Offset> begins, ends;
+        trace::Call *call = m_loader->parseCallArguments(apiCall->bookmark(),
+                                                         begins, ends);
+        if (!call) {
+            qWarning() << "Couldn't parse call" << apiCall->index()
+                       << ", rewriting the whole trace";
+            writer.close();
+            delete reader;
+            return false;
+        }
+
+        // Arguments are written in the order of their indices
+        QVector<QVariant> values = apiCall->editedValues();
+        for (int i = 0; i < values.count(); ++i) {
+            if (overwriteValue(call, values[i], i)) {
+                writer.copy(reader, begins[i]);
+                writer.writeValue(call->args[i]);
+                reader->setCurrentOffset(ends[i]);
+            }
+        }
+
+        delete call;
+    }
+
+    writer.copy(reader, trace::File::Offset(~0ULL, 0));
+
+    writer.close();
+    delete reader;
+    return true;
+}
+
+void SaverThread::rewriteTrace()
+{
     QMap<int, ApiTraceCall*> callIndexMap;
 
     foreach(ApiTraceCall *call, m_editedCalls) {
@@ -369,8 +475,6 @@ void SaverThread::run()
     }
 
     writer.close();
-
-    emit traceSaved();
 }
 
 #include "saverthread.moc"
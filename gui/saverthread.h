@@ -8,12 +8,13 @@
 
 class ApiTraceCall;
 class ApiTraceFrame;
+class TraceLoader;
 
 class SaverThread : public QThread
 {
     Q_OBJECT
 public:
-    SaverThread(QObject *parent=0);
+    SaverThread(TraceLoader *loader, QObject *parent=0);
 
 public slots:
     void saveFile(const QString &saveFileName,
@@ -27,6 +28,12 @@ protected:
     virtual void run();
 
 private:
+    bool canStream() const;
+    bool streamTrace();
+    void rewriteTrace();
+
+private:
+    TraceLoader *m_loader;
     QString m_readFileName;
     QString m_writeFileName;
     QSet<ApiTraceCall*> m_editedCalls;
@@ -1,26 +1,346 @@
 #include "traceloader.h"
 
 #include "apitrace.h"
+#include <QAtomicInt>
 #include <QDebug>
 #include <QFile>
+#include <QMutex>
+#include <QRunnable>
+#include <QThread>
+#include <QThreadPool>
+
+#include <limits.h>
+#include <stdio.h>
+#include <string.h>
 
 #define FRAMES_TO_CACHE 100
+#define CALLS_PER_SEARCH_CHUNK 4096
+
+static quint64
+blobSize(const trace::Call *call, int index)
+{
+    const trace::Blob *blob =
+        static_cast<const trace::Blob *>(call->args[index]);
+    return blob->size;
+}
 
 static ApiTraceCall *
 apiCallFromTraceCall(const trace::Call *call,
                      const QHash<QString, QUrl> &helpHash,
                      ApiTraceFrame *frame,
-                     TraceLoader *loader)
+                     TraceLoader *loader,
+                     const trace::ParseBookmark *bookmark = 0)
 {
-    ApiTraceCall *apiCall = new ApiTraceCall(frame, loader, call);
+    ApiTraceCall *apiCall;
+    if (bookmark) {
+        apiCall = new ApiTraceCall(frame, loader, call, *bookmark);
+    } else {
+        apiCall = new ApiTraceCall(frame, loader, call);
+    }
 
     apiCall->setHelpUrl(helpHash.value(apiCall->name()));
 
     return apiCall;
 }
 
+/*
+ * Matches the search text against a trace::Call as it would appear in
+ * ApiTraceCall::searchText(), but without converting it to QVariants first:
+ * against the function, argument and member names, the strings, enums and
+ * bitmask flags, and the numbers, as long as the text has digits.
+ */
+class CallMatcher : public trace::Visitor
+{
+public:
+    CallMatcher(const QString &text, Qt::CaseSensitivity sensitivity)
+        : m_text(text),
+          m_latin1(text.toLatin1()),
+          m_sensitivity(sensitivity),
+          m_numbers(false),
+          m_found(false)
+    {
+        for (int i = 0; i < text.length(); ++i) {
+            if (text[i].isDigit()) {
+                m_numbers = true;
+                break;
+            }
+        }
+    }
+
+    bool matches(trace::Call *call)
+    {
+        const trace::FunctionSig *sig = call->sig;
+        m_found = contains(sig->name);
+        for (unsigned i = 0; i < sig->num_args && !m_found; ++i) {
+            m_found = contains(sig->arg_names[i]);
+        }
+        for (unsigned i = 0; i < call->args.size() && !m_found; ++i) {
+            _visit(call->args[i]);
+        }
+        if (!m_found) {
+            _visit(call->ret);
+        }
+        return m_found;
+    }
+
+    void visit(trace::Null *)
+    {
+    }
+
+    void visit(trace::Bool *node)
+    {
+        m_found = contains(node->value ? "true" : "false");
+    }
+
+    void visit(trace::SInt *node)
+    {
+        if (m_numbers) {
+            char buf[32];
+            snprintf(buf, sizeof buf, "%lli", node->value);
+            m_found = contains(buf);
+        }
+    }
+
+    void visit(trace::UInt *node)
+    {
+        if (m_numbers) {
+            char buf[32];
+            snprintf(buf, sizeof buf, "%llu", node->value);
+            m_found = contains(buf);
+        }
+    }
+
+    void visit(trace::Float *node)
+    {
+        if (m_numbers) {
+            char buf[32];
+            snprintf(buf, sizeof buf, "%g", node->value);
+            m_found = contains(buf);
+        }
+    }
+
+    void visit(trace::Double *node)
+    {
+        if (m_numbers) {
+            char buf[32];
+            snprintf(buf, sizeof buf, "%g", node->value);
+            m_found = contains(buf);
+        }
+    }
+
+    void visit(trace::String *node)
+    {
+        m_found = contains(node->value);
+    }
+
+    void visit(trace::Enum *node)
+    {
+        m_found = contains(node->sig->name);
+    }
+
+    void visit(trace::Bitmask *node)
+    {
+        const trace::BitmaskSig *sig = node->sig;
+        for (unsigned i = 0; i < sig->num_flags && !m_found; ++i) {
+            unsigned long long value = sig->flags[i].value;
+            if (value && (node->value & value) == value) {
+                m_found = contains(sig->flags[i].name);
+            }
+        }
+        if (!m_found) {
+            visit(static_cast<trace::UInt *>(node));
+        }
+    }
+
+    void visit(trace::Struct *node)
+    {
+        const trace::StructSig *sig = node->sig;
+        for (unsigned i = 0; i < sig->num_members && !m_found; ++i) {
+            m_found = contains(sig->member_names[i]);
+            if (!m_found) {
+                _visit(node->members[i]);
+            }
+        }
+    }
+
+    void visit(trace::Array *node)
+    {
+        for (unsigned i = 0; i < node->values.size() && !m_found; ++i) {
+            _visit(node->values[i]);
+        }
+    }
+
+    void visit(trace::Blob *)
+    {
+    }
+
+    void visit(trace::Pointer *node)
+    {
+        if (m_numbers) {
+            char buf[32];
+            snprintf(buf, sizeof buf, "0x%llx", node->value);
+            m_found = contains(buf);
+        }
+    }
+
+private:
+    bool contains(const char *str) const
+    {
+        if (m_sensitivity == Qt::CaseSensitive) {
+            return strstr(str, m_latin1.constData()) != NULL;
+        }
+        return QString::fromLatin1(str).contains(m_text, m_sensitivity);
+    }
+
+    QString m_text;
+    QByteArray m_latin1;
+    Qt::CaseSensitivity m_sensitivity;
+    bool m_numbers;
+    bool m_found;
+};
+
+struct SearchFrame
+{
+    int index;
+    trace::ParseBookmark start;
+    int numberOfCalls;
+};
+
+typedef QVector<SearchFrame> SearchChunk;
+
+/*
+ * A search fanned out over chunks of frames, in search order.  Every worker
+ * takes the next chunk to search until a call is found, after which the
+ * chunks following the one it was found in are abandoned.
+ */
+struct SearchState
+{
+    QByteArray fileName;
+    const trace::Parser *parser;
+    ApiTrace::SearchRequest request;
+    QVector<SearchChunk> chunks;
+
+    QAtomicInt nextChunk;
+    QAtomicInt foundChunk;
+
+    QMutex mutex;
+    int foundFrame;
+    unsigned foundCall;
+
+    bool isCancelled(int chunkIdx) const
+    {
+        return chunkIdx > int(foundChunk);
+    }
+
+    void found(int chunkIdx, int frameIdx, unsigned callNo)
+    {
+        QMutexLocker locker(&mutex);
+        if (chunkIdx < int(foundChunk)) {
+            foundChunk = chunkIdx;
+            foundFrame = frameIdx;
+            foundCall = callNo;
+        }
+    }
+};
+
+class SearchWorker : public QRunnable
+{
+public:
+    SearchWorker(SearchState *state)
+        : m_state(state)
+    {}
+
+    void run()
+    {
+        // Every worker needs its own parser, which starts off with the
+        // signatures already scanned, so that it can jump to any frame
+        trace::Parser parser;
+        if (!parser.open(m_state->fileName.constData())) {
+            return;
+        }
+        parser.copySignatures(*m_state->parser);
+
+        CallMatcher matcher(m_state->request.text, m_state->request.cs);
+
+        int chunkIdx;
+        while ((chunkIdx = m_state->nextChunk.fetchAndAddOrdered(1)) <
+               m_state->chunks.count()) {
+            const SearchChunk &chunk = m_state->chunks[chunkIdx];
+            for (int i = 0; i < chunk.count(); ++i) {
+                if (m_state->isCancelled(chunkIdx) ||
+                    searchFrame(parser, matcher, chunkIdx, chunk[i])) {
+                    break;
+                }
+            }
+        }
+    }
+
+private:
+    bool searchFrame(trace::Parser &parser, CallMatcher &matcher,
+                     int chunkIdx, const SearchFrame &frame)
+    {
+        bool backwards =
+            m_state->request.direction == ApiTrace::SearchRequest::Prev;
+        bool found = false;
+        unsigned foundCall = 0;
+
+        parser.setBookmark(frame.start);
+        for (int i = 0; i < frame.numberOfCalls; ++i) {
+            trace::Call *call = parser.parse_call();
+            if (!call) {
+                break;
+            }
+            if (matcher.matches(call)) {
+                found = true;
+                foundCall = call->no;
+            }
+            delete call;
+
+            if ((found && !backwards) ||
+                m_state->isCancelled(chunkIdx)) {
+                break;
+            }
+        }
+
+        if (found) {
+            m_state->found(chunkIdx, frame.index, foundCall);
+        }
+        return found;
+    }
+
+    SearchState *m_state;
+};
+
+/*
+ * Builds the index of a trace in the background, for later searches.
+ */
+class IndexBuilder : public QRunnable
+{
+public:
+    IndexBuilder(const QByteArray &fileName)
+        : m_fileName(fileName)
+    {}
+
+    void run()
+    {
+        trace::Index index;
+        if (index.build(m_fileName.constData())) {
+            std::string indexFileName =
+                trace::Index::filename(m_fileName.constData());
+            if (!index.save(indexFileName.c_str())) {
+                qWarning() << "Couldn't write the trace index"
+                           << indexFileName.c_str();
+            }
+        }
+    }
+
+private:
+    QByteArray m_fileName;
+};
+
 TraceLoader::TraceLoader(QObject *parent)
     : QObject(parent),
+      m_indexLoaded(false),
       m_frameMarker(ApiTrace::FrameMarker_SwapBuffers)
 {
 }
@@ -28,6 +348,7 @@ TraceLoader::TraceLoader(QObject *parent)
 TraceLoader::~TraceLoader()
 {
     m_parser.close();
+    m_callParser.close();
     qDeleteAll(m_signatures);
     qDeleteAll(m_enumSignatures);
 }
@@ -48,7 +369,8 @@ void TraceLoader::loadTrace(const QString &filename)
         m_parser.close();
     }
 
-    if (!m_parser.open(filename.toLatin1())) {
+    m_fileName = filename.toLatin1();
+    if (!m_parser.open(m_fileName)) {
         qDebug() << "error: failed to open " << filename;
         return;
     }
@@ -56,7 +378,20 @@ void TraceLoader::loadTrace(const QString &filename)
     emit startedParsing();
 
     if (m_parser.supportsOffsets()) {
+        {
+            QMutexLocker locker(&m_callParserMutex);
+            m_callParser.close();
+            m_callParser.open(m_fileName);
+        }
+
         scanTrace();
+
+        m_index.clear();
+        m_indexLoaded = m_index.load(
+            trace::Index::filename(m_fileName).c_str(), m_fileName);
+        if (!m_indexLoaded) {
+            QThreadPool::globalInstance()->start(new IndexBuilder(m_fileName));
+        }
     } else {
         //Load the entire file into memory
         parseTrace();
@@ -213,9 +548,7 @@ void TraceLoader::parseTrace()
                 apiCallFromTraceCall(call, m_helpHash, currentFrame, this);
         calls.append(apiCall);
         if (apiCall->hasBinaryData()) {
-            QByteArray data =
-                    apiCall->arguments()[apiCall->binaryDataIndex()].toByteArray();
-            binaryDataSize += data.size();
+            binaryDataSize += blobSize(call, apiCall->binaryDataIndex());
         }
         if (ApiTrace::isCallAFrameMarker(apiCall,
                                          m_frameMarker)) {
@@ -253,6 +586,39 @@ void TraceLoader::parseTrace()
 }
 
 
+/*
+ * Parse again the call started at the bookmark.  This is called from the GUI
+ * thread, so it uses a parser of its own, which learns the signatures from the
+ * main parser as frames are loaded.
+ */
+trace::Call * TraceLoader::parseCall(const trace::ParseBookmark &bookmark,
+                                     unsigned callNo)
+{
+    QMutexLocker locker(&m_callParserMutex);
+
+    m_callParser.setBookmark(bookmark);
+
+    // Calls from other threads may complete first
+    trace::Call *call;
+    while ((call = m_callParser.parse_call())) {
+        if (call->no == callNo) {
+            return call;
+        }
+        delete call;
+    }
+    return NULL;
+}
+
+trace::Call * TraceLoader::parseCallArguments(
+    const trace::ParseBookmark &bookmark,
+    std::vector<trace::File::Offset> &begins,
+    std::vector<trace::File::Offset> &ends)
+{
+    QMutexLocker locker(&m_callParserMutex);
+
+    return m_callParser.parse_enter_event(bookmark, begins, ends);
+}
+
 ApiTraceCallSignature * TraceLoader::signature(unsigned id)
 {
     if (id >= m_signatures.count()) {
@@ -270,6 +636,8 @@ void TraceLoader::addSignature(unsigned id, ApiTraceCallSignature *signature)
 
 ApiTraceEnumSignature * TraceLoader::enumSignature(unsigned id)
 {
+    // Also used by ApiTraceCall from the GUI thread
+    QMutexLocker locker(&m_enumSignaturesMutex);
     if (id >= m_enumSignatures.count()) {
         m_enumSignatures.resize(id + 1);
         return NULL;
@@ -280,6 +648,7 @@ ApiTraceEnumSignature * TraceLoader::enumSignature(unsigned id)
 
 void TraceLoader::addEnumSignature(unsigned id, ApiTraceEnumSignature *signature)
 {
+    QMutexLocker locker(&m_enumSignaturesMutex);
     m_enumSignatures[id] = signature;
 }
 
@@ -287,141 +656,98 @@ void TraceLoader::searchNext(const ApiTrace::SearchRequest &request)
 {
     Q_ASSERT(m_parser.supportsOffsets());
     if (m_parser.supportsOffsets()) {
+        QList<int> frameIdxs;
         int startFrame = m_createdFrames.indexOf(request.frame);
-        const FrameBookmark &frameBookmark = m_frameBookmarks[startFrame];
-        m_parser.setBookmark(frameBookmark.start);
-        trace::Call *call = 0;
-        while ((call = m_parser.parse_call())) {
-
-            if (callContains(call, request.text, request.cs)) {
-                unsigned frameIdx = callInFrame(call->no);
-                ApiTraceFrame *frame = m_createdFrames[frameIdx];
-                const QVector<ApiTraceCall*> calls =
-                        fetchFrameContents(frame);
-                for (int i = 0; i < calls.count(); ++i) {
-                    if (calls[i]->index() == call->no) {
-                        emit searchResult(request, ApiTrace::SearchResult_Found,
-                                          calls[i]);
-                        break;
-                    }
-                }
-                delete call;
-                return;
-            }
-
-            delete call;
+        for (int frameIdx = startFrame; frameIdx < numberOfFrames(); ++frameIdx) {
+            frameIdxs.append(frameIdx);
+        }
+        if (searchFrames(frameIdxs, request)) {
+            return;
         }
     }
-    emit searchResult(request, ApiTrace::SearchResult_NotFound, 0);
+    emit searchResult(request, ApiTrace::SearchResult_NotFound, -1);
 }
 
 void TraceLoader::searchPrev(const ApiTrace::SearchRequest &request)
 {
     Q_ASSERT(m_parser.supportsOffsets());
     if (m_parser.supportsOffsets()) {
+        QList<int> frameIdxs;
         int startFrame = m_createdFrames.indexOf(request.frame);
-        trace::Call *call = 0;
-        QList<trace::Call*> frameCalls;
-        int frameIdx = startFrame;
-
-        const FrameBookmark &frameBookmark = m_frameBookmarks[frameIdx];
-        int numCallsToParse = frameBookmark.numberOfCalls;
-        m_parser.setBookmark(frameBookmark.start);
-
-        while ((call = m_parser.parse_call())) {
-
-            frameCalls.append(call);
-            --numCallsToParse;
-
-            if (numCallsToParse == 0) {
-                bool foundCall = searchCallsBackwards(frameCalls,
-                                                      frameIdx,
-                                                      request);
-
-                qDeleteAll(frameCalls);
-                frameCalls.clear();
-                if (foundCall) {
-                    return;
-                }
-
-                --frameIdx;
-
-                if (frameIdx >= 0) {
-                    const FrameBookmark &frameBookmark =
-                            m_frameBookmarks[frameIdx];
-                    m_parser.setBookmark(frameBookmark.start);
-                    numCallsToParse = frameBookmark.numberOfCalls;
-                }
-            }
+        for (int frameIdx = startFrame; frameIdx >= 0; --frameIdx) {
+            frameIdxs.append(frameIdx);
+        }
+        if (searchFrames(frameIdxs, request)) {
+            return;
         }
     }
-    emit searchResult(request, ApiTrace::SearchResult_NotFound, 0);
+    emit searchResult(request, ApiTrace::SearchResult_NotFound, -1);
 }
 
-bool TraceLoader::searchCallsBackwards(const QList<trace::Call*> &calls,
-                                       int frameIdx,
-                                       const ApiTrace::SearchRequest &request)
+/*
+ * Search the given frames, in order, on a pool of threads.
+ */
+bool TraceLoader::searchFrames(const QList<int> &frameIdxs,
+                               const ApiTrace::SearchRequest &request)
 {
-    for (int i = calls.count() - 1; i >= 0; --i) {
-        trace::Call *call = calls[i];
-        if (callContains(call, request.text, request.cs)) {
-            ApiTraceFrame *frame = m_createdFrames[frameIdx];
-            const QVector<ApiTraceCall*> apiCalls =
-                    fetchFrameContents(frame);
-            for (int i = 0; i < apiCalls.count(); ++i) {
-                if (apiCalls[i]->index() == call->no) {
-                    emit searchResult(request,
-                                      ApiTrace::SearchResult_Found,
-                                      apiCalls[i]);
-                    break;
-                }
-            }
-            return true;
+    SearchState state;
+    state.fileName = m_fileName;
+    state.parser = &m_parser;
+    state.request = request;
+    state.nextChunk = 0;
+    state.foundChunk = INT_MAX;
+    state.foundFrame = -1;
+    state.foundCall = 0;
+
+    // Split the frames in chunks of roughly the same number of calls
+    SearchChunk chunk;
+    int numCalls = 0;
+    for (int i = 0; i < frameIdxs.count(); ++i) {
+        const FrameBookmark &frameBookmark = m_frameBookmarks[frameIdxs[i]];
+        SearchFrame frame;
+        frame.index = frameIdxs[i];
+        frame.start = frameBookmark.start;
+        frame.numberOfCalls = frameBookmark.numberOfCalls;
+        chunk.append(frame);
+        numCalls += frame.numberOfCalls;
+        if (numCalls >= CALLS_PER_SEARCH_CHUNK) {
+            state.chunks.append(chunk);
+            chunk.clear();
+            numCalls = 0;
         }
     }
-    return false;
-}
+    if (!chunk.isEmpty()) {
+        state.chunks.append(chunk);
+    }
 
-int TraceLoader::callInFrame(int callIdx) const
-{
-    unsigned numCalls = 0;
+    QThreadPool pool;
+    int numWorkers = qMin(qMax(QThread::idealThreadCount(), 1),
+                          state.chunks.count());
+    pool.setMaxThreadCount(qMax(numWorkers, 1));
+    for (int i = 0; i < numWorkers; ++i) {
+        pool.start(new SearchWorker(&state));
+    }
+    pool.waitForDone();
 
-    for (int frameIdx = 0; frameIdx <= m_frameBookmarks.size(); ++frameIdx) {
-        const FrameBookmark &frameBookmark = m_frameBookmarks[frameIdx];
-        unsigned firstCall = numCalls;
-        unsigned endCall = numCalls + frameBookmark.numberOfCalls;
-        if (firstCall <= callIdx && endCall > callIdx) {
-            return frameIdx;
-        }
-        numCalls = endCall;
+    if (state.foundFrame < 0) {
+        return false;
     }
-    Q_ASSERT(!"call not in the trace");
-    return 0;
-}
 
-bool TraceLoader::callContains(trace::Call *call,
-                               const QString &str,
-                               Qt::CaseSensitivity sensitivity)
-{
-    /*
-     * FIXME: do string comparison directly on trace::Call
-     */
-    ApiTraceCall *apiCall = apiCallFromTraceCall(call, m_helpHash,
-                                                 0, this);
-    bool result = apiCall->contains(str, sensitivity);
-    delete apiCall;
-    return result;
+    emit searchResult(request, ApiTrace::SearchResult_Found,
+                      int(state.foundCall));
+    return true;
 }
 
-QVector<ApiTraceCall*>
-TraceLoader::fetchFrameContents(ApiTraceFrame *currentFrame)
+/*
+ * Parse the calls of a frame, which ApiTrace only asks for when the frame
+ * isn't loaded.  The calls belong to ApiTrace as soon as they are emitted,
+ * and it may unload them at any time, so the loader never keeps or hands out
+ * pointers to calls otherwise; lookups return call numbers instead.
+ */
+void TraceLoader::fetchFrameContents(ApiTraceFrame *currentFrame)
 {
     Q_ASSERT(currentFrame);
 
-    if (currentFrame->isLoaded()) {
-        return currentFrame->calls();
-    }
-
     if (m_parser.supportsOffsets()) {
         unsigned frameIdx = currentFrame->number;
         int numOfCalls = numberOfCallsInFrame(frameIdx);
@@ -433,19 +759,22 @@ TraceLoader::fetchFrameContents(ApiTraceFrame *currentFrame)
 
             m_parser.setBookmark(frameBookmark.start);
 
+            trace::ParseBookmark bookmark;
+            m_parser.getBookmark(bookmark);
+
             trace::Call *call;
             int parsedCalls = 0;
             while ((call = m_parser.parse_call())) {
+                // Calls started before the bookmark can't be found from
+                // it, so they are converted right away
+                bool lazy = call->no == bookmark.next_call_no;
                 ApiTraceCall *apiCall =
-                    apiCallFromTraceCall(call, m_helpHash,
-                                         currentFrame, this);
+                    apiCallFromTraceCall(call, m_helpHash, currentFrame,
+                                         this, lazy ? &bookmark : 0);
                 calls[parsedCalls] = apiCall;
                 Q_ASSERT(calls[parsedCalls]);
                 if (apiCall->hasBinaryData()) {
-                    QByteArray data =
-                        apiCall->arguments()[
-                            apiCall->binaryDataIndex()].toByteArray();
-                    binaryDataSize += data.size();
+                    binaryDataSize += blobSize(call, apiCall->binaryDataIndex());
                 }
 
                 ++parsedCalls;
@@ -456,54 +785,77 @@ TraceLoader::fetchFrameContents(ApiTraceFrame *currentFrame)
                     break;
                 }
 
+                m_parser.getBookmark(bookmark);
             }
             assert(parsedCalls == numOfCalls);
             Q_ASSERT(parsedCalls == calls.size());
             calls.squeeze();
 
+            // Let the calls of this frame be parsed again
+            {
+                QMutexLocker locker(&m_callParserMutex);
+                m_callParser.copySignatures(m_parser);
+            }
+
             Q_ASSERT(parsedCalls == currentFrame->numChildrenToLoad());
             emit frameContentsLoaded(currentFrame,
                                      calls, binaryDataSize);
-            return calls;
         }
     }
-    return QVector<ApiTraceCall*>();
 }
 
-void TraceLoader::findFrameStart(ApiTraceFrame *frame)
+/*
+ * Look the search text up in the trace index, if it has been built by now.
+ */
+bool TraceLoader::searchIndex(const ApiTrace::SearchRequest &request)
 {
-    if (!frame->isLoaded()) {
-        loadFrame(frame);
+    if (!m_indexLoaded) {
+        m_indexLoaded = m_index.load(
+            trace::Index::filename(m_fileName).c_str(), m_fileName);
+        if (!m_indexLoaded) {
+            return false;
+        }
     }
-    emit foundFrameStart(frame);
-}
 
-void TraceLoader::findFrameEnd(ApiTraceFrame *frame)
-{
-    if (!frame->isLoaded()) {
-        loadFrame(frame);
+    // Numbers are not indexed
+    for (int i = 0; i < request.text.length(); ++i) {
+        if (request.text[i].isDigit()) {
+            return false;
+        }
     }
-    emit foundFrameEnd(frame);
-}
 
-void TraceLoader::findCallIndex(int index)
-{
-    int frameIdx = callInFrame(index);
-    ApiTraceFrame *frame = m_createdFrames[frameIdx];
-    QVector<ApiTraceCall*> calls = fetchFrameContents(frame);
-    QVector<ApiTraceCall*>::const_iterator itr;
-    ApiTraceCall *call = 0;
-    for (itr = calls.constBegin(); itr != calls.constEnd(); ++itr) {
-        if ((*itr)->index() == index) {
-            call = *itr;
-        }
-    }
-    Q_ASSERT(call);
-    emit foundCallIndex(call);
+    trace::CallSet calls;
+    m_index.find(request.text.toLatin1().constData(),
+                 request.cs == Qt::CaseSensitive,
+                 trace::Index::KINDS_TEXT, calls);
+
+    int startFrame = m_createdFrames.indexOf(request.frame);
+    unsigned callNo;
+    if (request.direction == ApiTrace::SearchRequest::Next) {
+        callNo = calls.next(m_frameBookmarks[startFrame].start.next_call_no);
+    } else if (startFrame + 1 < numberOfFrames()) {
+        unsigned endCall =
+            m_frameBookmarks[startFrame + 1].start.next_call_no;
+        callNo = endCall ? calls.prev(endCall - 1) : ~0U;
+    } else {
+        callNo = calls.prev(~0U);
+    }
+
+    if (callNo != ~0U) {
+        emit searchResult(request, ApiTrace::SearchResult_Found,
+                          int(callNo));
+    } else {
+        emit searchResult(request, ApiTrace::SearchResult_NotFound, -1);
+    }
+    return true;
 }
 
 void TraceLoader::search(const ApiTrace::SearchRequest &request)
 {
+    if (m_parser.supportsOffsets() && searchIndex(request)) {
+        return;
+    }
+
     if (request.direction == ApiTrace::SearchRequest::Next) {
         searchNext(request);
     } else {
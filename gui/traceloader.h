@@ -4,11 +4,13 @@
 
 #include "apitrace.h"
 #include "trace_file.hpp"
+#include "trace_index.hpp"
 #include "trace_parser.hpp"
 
 #include <QObject>
 #include <QList>
 #include <QMap>
+#include <QMutex>
 
 class TraceLoader : public QObject
 {
@@ -24,13 +26,16 @@ public:
     ApiTraceEnumSignature *enumSignature(unsigned id);
     void addEnumSignature(unsigned id, ApiTraceEnumSignature *signature);
 
+    trace::Call *parseCall(const trace::ParseBookmark &bookmark,
+                           unsigned callNo);
+    trace::Call *parseCallArguments(const trace::ParseBookmark &bookmark,
+                                    std::vector<trace::File::Offset> &begins,
+                                    std::vector<trace::File::Offset> &ends);
+
 public slots:
     void loadTrace(const QString &filename);
     void loadFrame(ApiTraceFrame *frame);
     void setFrameMarker(ApiTrace::FrameMarker marker);
-    void findFrameStart(ApiTraceFrame *frame);
-    void findFrameEnd(ApiTraceFrame *frame);
-    void findCallIndex(int index);
     void search(const ApiTrace::SearchRequest &request);
 
 signals:
@@ -45,10 +50,7 @@ signals:
 
     void searchResult(const ApiTrace::SearchRequest &request,
                       ApiTrace::SearchResult result,
-                      ApiTraceCall *call);
-    void foundFrameStart(ApiTraceFrame *frame);
-    void foundFrameEnd(ApiTraceFrame *frame);
-    void foundCallIndex(ApiTraceCall *call);
+                      int callIndex);
 private:
     struct FrameBookmark {
         FrameBookmark()
@@ -73,17 +75,20 @@ private:
     void searchNext(const ApiTrace::SearchRequest &request);
     void searchPrev(const ApiTrace::SearchRequest &request);
 
-    int callInFrame(int callIdx) const;
-    bool callContains(trace::Call *call,
-                      const QString &str,
-                      Qt::CaseSensitivity sensitivity);
-     QVector<ApiTraceCall*> fetchFrameContents(ApiTraceFrame *frame);
-     bool searchCallsBackwards(const QList<trace::Call*> &calls,
-                               int frameIdx,
-                               const ApiTrace::SearchRequest &request);
+     void fetchFrameContents(ApiTraceFrame *frame);
+     bool searchFrames(const QList<int> &frameIdxs,
+                       const ApiTrace::SearchRequest &request);
+     bool searchIndex(const ApiTrace::SearchRequest &request);
 
 private:
+    QByteArray m_fileName;
     trace::Parser m_parser;
+
+    // Parses calls again for ApiTraceCall, from the GUI thread
+    trace::Parser m_callParser;
+    QMutex m_callParserMutex;
+    trace::Index m_index;
+    bool m_indexLoaded;
     ApiTrace::FrameMarker m_frameMarker;
 
     typedef QMap<int, FrameBookmark> FrameBookmarks;
@@ -94,6 +99,7 @@ private:
 
     QVector<ApiTraceCallSignature*> m_signatures;
     QVector<ApiTraceEnumSignature*> m_enumSignatures;
+    QMutex m_enumSignaturesMutex;
 };
 
 #endif
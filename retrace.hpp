@@ -31,6 +31,7 @@
 #include <list>
 #include <map>
 #include <ostream>
+#include <vector>
 
 #include "trace_model.hpp"
 
@@ -48,6 +49,14 @@ namespace retrace {
  * the implementation to generate an unique name, or pick a value never used
  * before.
  *
+ * Since names are typically small integers handed out sequentially, they are
+ * kept in a directly indexed array, whose unassigned slots simply hold their
+ * own index.  The array holds at most max_array_key + 1 entries (512KB for
+ * 64bit handles), and is only as large as the largest name assigned so far.
+ * Sparse keys (e.g., pointers, or negative locations) go to an open
+ * addressing hash table instead.  Plain lookups never grow the containers, so
+ * names which are replayed unchanged cost nothing.
+ *
  * XXX: In some cases, instead of returning the key, it would make more sense
  * to return an unused data value (e.g., container count).
  */
@@ -55,27 +64,132 @@ template <class T>
 class map
 {
 private:
-    typedef std::map<T, T> base_type;
-    base_type base;
+    typedef std::vector<T> array_type;
+    array_type array;
+
+    // Largest key kept in the array
+    static const size_t max_array_key = (1 << 16) - 1;
+
+    // Hash table of the other keys, with linear probing, never more than half
+    // full.  Entries are never removed.
+    struct Slot {
+        T key;
+        T value;
+        bool used;
+
+        Slot() : used(false) {}
+    };
+    typedef std::vector<Slot> table_type;
+    table_type table;
+    size_t count;
+
+    static inline size_t
+    index(const T &key) {
+        return (size_t)key;
+    }
+
+    static inline size_t
+    hash(const T &key) {
+        size_t h = index(key);
+        h ^= h >> 16;
+        h *= 0x45d9f3b;
+        h ^= h >> 16;
+        return h;
+    }
+
+    void
+    grow(size_t i) {
+        size_t size = array.size();
+        size_t new_size = size ? size * 2 : 64;
+        while (new_size <= i) {
+            new_size *= 2;
+        }
+        if (new_size > max_array_key + 1) {
+            new_size = max_array_key + 1;
+        }
+        array.resize(new_size);
+        for (size_t j = size; j < new_size; ++j) {
+            array[j] = (T)j;
+        }
+    }
+
+    const Slot *
+    find(const T &key) const {
+        if (table.empty()) {
+            return NULL;
+        }
+        size_t mask = table.size() - 1;
+        for (size_t i = hash(key) & mask; table[i].used; i = (i + 1) & mask) {
+            if (table[i].key == key) {
+                return &table[i];
+            }
+        }
+        return NULL;
+    }
+
+    Slot &
+    insert(const T &key) {
+        size_t mask = table.size() - 1;
+        size_t i = hash(key) & mask;
+        while (table[i].used) {
+            i = (i + 1) & mask;
+        }
+        table[i].key = key;
+        table[i].value = key;
+        table[i].used = true;
+        ++count;
+        return table[i];
+    }
+
+    void
+    rehash(void) {
+        table_type old_table;
+        old_table.swap(table);
+        table.resize(old_table.empty() ? 16 : old_table.size() * 2);
+        count = 0;
+        for (size_t i = 0; i < old_table.size(); ++i) {
+            if (old_table[i].used) {
+                insert(old_table[i].key).value = old_table[i].value;
+            }
+        }
+    }
 
 public:
+    map() : count(0) {}
 
     T & operator[] (const T &key) {
-        typename base_type::iterator it;
-        it = base.find(key);
-        if (it == base.end()) {
-            return (base[key] = key);
+        size_t i = index(key);
+        if (i <= max_array_key) {
+            if (i >= array.size()) {
+                grow(i);
+            }
+            return array[i];
         }
-        return it->second;
+
+        const Slot *slot = find(key);
+        if (slot) {
+            return const_cast<Slot *>(slot)->value;
+        }
+        if ((count + 1) * 2 > table.size()) {
+            rehash();
+        }
+        return insert(key).value;
     }
-    
-    const T & operator[] (const T &key) const {
-        typename base_type::const_iterator it;
-        it = base.find(key);
-        if (it == base.end()) {
-            return (base[key] = key);
+
+    T lookup(const T &key) const {
+        size_t i = index(key);
+        if (i < array.size()) {
+            return array[i];
+        }
+        if (i <= max_array_key) {
+            return key;
+        }
+
+        const Slot *slot = find(key);
+        if (!slot) {
+            return key;
         }
-        return it->second;
+        return slot->value;
     }
 };
 
@@ -50,6 +50,14 @@ def handle_entry(handle, value):
         return "__%s_map[%s][%s]" % (handle.name, key_name, value)
 
 
+def handle_lookup(handle, value):
+    if handle.key is None:
+        return "__%s_map.lookup(%s)" % (handle.name, value)
+    else:
+        key_name, key_type = handle.key
+        return "__%s_map[%s].lookup(%s)" % (handle.name, key_name, value)
+
+
 class ValueExtractor(stdapi.Visitor):
 
     def visit_literal(self, literal, lvalue, rvalue):
@@ -95,7 +103,7 @@ class ValueExtractor(stdapi.Visitor):
 
     def visit_handle(self, handle, lvalue, rvalue):
         OpaqueValueExtractor().visit(handle.type, lvalue, rvalue);
-        new_lvalue = handle_entry(handle, lvalue)
+        new_lvalue = handle_lookup(handle, lvalue)
         print '    if (retrace::verbosity >= 2) {'
         print '        std::cout << "%s " << size_t(%s) << " <- " << size_t(%s) << "\\n";' % (handle.name, lvalue, new_lvalue)
         print '    }'
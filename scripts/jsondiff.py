@@ -26,6 +26,9 @@
 
 
 import json
+import json.decoder
+import re
+import struct
 import sys
 
 
@@ -131,49 +134,61 @@ class Dumper(Visitor):
 
 
 
-class Comparer(Visitor):
+class Hasher:
+    '''Computes structural hashes of subtrees, bottom-up, so that identical
+    subtrees can be pruned with a single comparison.
 
-    def visit_object(self, a, b):
-        if not isinstance(b, dict):
-            return False
-        if len(a) != len(b):
-            return False
-        ak = a.keys()
-        bk = b.keys()
-        ak.sort()
-        bk.sort()
-        if ak != bk:
-            return False
-        for k in ak:
-            if not self.visit(a[k], b[k]):
-                return False
-        return True
+    Hashes of objects and arrays are memoized by identity, so the trees must
+    stay alive (and unmodified) while the hasher is in use.'''
 
-    def visit_array(self, a, b):
-        if not isinstance(b, list):
-            return False
-        if len(a) != len(b):
-            return False
-        for ae, be in zip(a, b):
-            if not self.visit(ae, be):
-                return False
-        return True
+    def __init__(self):
+        self.hashes = {}
 
-    def visit_value(self, a, b):
-        return a == b
+    def hash(self, node):
+        if isinstance(node, dict):
+            key = id(node)
+            try:
+                return self.hashes[key]
+            except KeyError:
+                pass
+            h = hash(frozenset([(name, self.hash(value)) for name, value in node.iteritems()]))
+        elif isinstance(node, list):
+            key = id(node)
+            try:
+                return self.hashes[key]
+            except KeyError:
+                pass
+            h = hash(('[]',) + tuple([self.hash(value) for value in node]))
+        else:
+            return hash(node)
+        self.hashes[key] = h
+        return h
 
-comparer = Comparer()
+    def clear(self):
+        self.hashes.clear()
 
 
 class Differ(Visitor):
 
     def __init__(self, stream = sys.stdout):
         self.dumper = Dumper(stream)
+        self.hasher = Hasher()
 
     def visit(self, a, b):
-        if comparer.visit(a, b):
+        # A plain comparison is the quickest way to rule out any difference
+        if a == b:
             return
-        Visitor.visit(self, a, b)
+        try:
+            Visitor.visit(self, a, b)
+        finally:
+            self.hasher.clear()
+
+    def _equal(self, a, b):
+        # Different hashes prove the values differ, but equal hashes may be
+        # a collision, so they must be confirmed
+        if self.hasher.hash(a) != self.hasher.hash(b):
+            return False
+        return a == b
 
     def visit_object(self, a, b):
         if not isinstance(b, dict):
@@ -188,9 +203,14 @@ class Differ(Visitor):
             for name in names:
                 ae = a.get(name, None)
                 be = b.get(name, None)
-                if not comparer.visit(ae, be):
+                if (name in a) != (name in b):
+                    # A missing member may stand for a null one
+                    self.dumper.enter_member(name)
+                    self.replace(ae, be)
+                    self.dumper.leave_member()
+                elif not self._equal(ae, be):
                     self.dumper.enter_member(name)
-                    self.visit(ae, be)
+                    Visitor.visit(self, ae, be)
                     self.dumper.leave_member()
 
             self.dumper.leave_object()
@@ -210,10 +230,12 @@ class Differ(Visitor):
                 except IndexError:
                     be = None
                 self.dumper._indent()
-                if comparer.visit(ae, be):
+                if i >= len(a) or i >= len(b):
+                    self.replace(ae, be)
+                elif self._equal(ae, be):
                     self.dumper.visit(ae)
                 else:
-                    self.visit(ae, be)
+                    Visitor.visit(self, ae, be)
                 self.dumper._newline()
 
             self.dumper.leave_array()
@@ -228,19 +250,400 @@ class Differ(Visitor):
         self.dumper.visit(b)
 
 
+class StreamDiffer(Differ):
+    '''Differ for documents which are too big to be loaded in memory.
+
+    The members of the first levels of both documents are read from the
+    readers (see JSONReader and BinaryReader) one at a time, and only the
+    values below them are materialized and compared.  Members which appear
+    in the same order in both documents (as is the case for state dumps) are
+    compared as soon as they are read; the others are held until their
+    counterpart shows up, or the enclosing object ends.'''
+
+    def __init__(self, stream = sys.stdout, depth = 2):
+        Differ.__init__(self, stream)
+        self.depth = depth
+        self.headers = []
+
+    def diff(self, a, b):
+        if a.peek() != '{' or b.peek() != '{':
+            self.visit(a.parse_value(), b.parse_value())
+            return
+        self._diff_objects(a, b, self.depth, self.dumper.enter_object)
+
+    def _flush(self):
+        '''Write the headers of the enclosing objects, which are only written
+        once the first difference inside them is found.'''
+
+        for header in self.headers:
+            header()
+        del self.headers[:]
+
+    def _diff_objects(self, a, b, depth, header):
+        self.headers.append(header)
+
+        a_names = a.iter_object()
+        b_names = b.iter_object()
+        a_pending = {}
+        b_pending = {}
+
+        while True:
+            a_name = self._next_member(a, a_names)
+            b_name = self._next_member(b, b_names)
+            if a_name is None and b_name is None:
+                break
+
+            if a_name == b_name:
+                if depth > 1 and a.peek() == '{' and b.peek() == '{':
+                    self._diff_objects(a, b, depth - 1, self._member_header(a_name))
+                else:
+                    self._diff_member(a_name, a.parse_value(), b.parse_value())
+                continue
+
+            if a_name is not None:
+                a_value = a.parse_value()
+                if a_name in b_pending:
+                    self._diff_member(a_name, a_value, b_pending.pop(a_name))
+                else:
+                    a_pending[a_name] = a_value
+            if b_name is not None:
+                b_value = b.parse_value()
+                if b_name in a_pending:
+                    self._diff_member(b_name, a_pending.pop(b_name), b_value)
+                else:
+                    b_pending[b_name] = b_value
+
+        names = set(a_pending.keys())
+        names.update(b_pending.keys())
+        names = list(names)
+        names.sort()
+        for name in names:
+            # Members only in one of the documents
+            self._flush()
+            self.dumper.enter_member(name)
+            self.replace(a_pending.get(name), b_pending.get(name))
+            self.dumper.leave_member()
+
+        if self.headers and self.headers[-1] is header:
+            # No differences
+            self.headers.pop()
+        else:
+            self.dumper.leave_object()
+            if depth != self.depth:
+                self.dumper.leave_member()
+
+    def _member_header(self, name):
+        def header():
+            self.dumper.enter_member(name)
+            self.dumper.enter_object()
+        return header
+
+    def _next_member(self, reader, names):
+        for name in names:
+            if name.startswith('__') and name.endswith('__'):
+                reader.parse_value()
+                continue
+            return name
+        return None
+
+    def _diff_member(self, name, a, b):
+        if a == b:
+            return
+        self._flush()
+        self.dumper.enter_member(name)
+        self.visit(a, b)
+        self.dumper.leave_member()
+
+
+class JSONReader:
+    '''Incremental JSON parser.
+
+    The stream is read in chunks, and the reader can either iterate over the
+    members of the object at the current position, or materialize the value
+    at the current position (with the C accelerated decoder).'''
+
+    chunk_size = 1 << 16
+
+    whitespace = re.compile(r'[ \t\n\r]*')
+    delimiters = ' \t\n\r,]}'
+
+    def __init__(self, stream, text = '', object_hook = None):
+        self.stream = stream
+        self.buffer = text
+        self.pos = 0
+        self.read_size = self.chunk_size
+        self.decoder = json.JSONDecoder(strict=False, object_hook=object_hook)
+
+    def _fill(self):
+        '''Read more data.  The amount read doubles on every call, so that
+        retrying to decode values larger than the buffer takes amortized
+        linear time.'''
+
+        data = self.stream.read(self.read_size)
+        if not data:
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        self.read_size *= 2
+        return True
+
+    def _skip_whitespace(self):
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                return
+
+    def peek(self):
+        c = self.buffer[self.pos:self.pos + 1]
+        if not c or c in self.delimiters[:4]:
+            self._skip_whitespace()
+            c = self.buffer[self.pos:self.pos + 1]
+        return c
+
+    def _expect(self, c):
+        if self.peek() != c:
+            raise ValueError('expected %r' % c)
+        self.pos += 1
+
+    def _parse_string(self):
+        if self.peek() != '"':
+            raise ValueError('expected string')
+        while True:
+            try:
+                s, end = json.decoder.scanstring(self.buffer, self.pos + 1, None, False)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            self.pos = end
+            self.read_size = self.chunk_size
+            return s
+
+    def iter_object(self):
+        '''Iterate over the names of the members of the object at the current
+        position.  Each member value must be consumed (with parse_value or
+        iter_object) before advancing to the next.'''
+
+        self._expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            name = self._parse_string()
+            self._expect(':')
+            yield name
+            c = self.peek()
+            self.pos += 1
+            if c == '}':
+                return
+            if c != ',':
+                raise ValueError('expected \',\' or \'}\'')
+
+    def parse_value(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise
+            if end == len(self.buffer) or self.buffer[end] not in self.delimiters:
+                # Numbers may continue in the next chunk
+                if self._fill():
+                    continue
+            self.pos = end
+            self.read_size = self.chunk_size
+            return value
+
+
+BINARY_MAGIC = '\x89JSB'
+
+
+class BinaryReader:
+    '''Reader for the binary state dump encoding described in json.hpp.
+
+    It provides the same incremental interface as JSONReader.'''
+
+    def __init__(self, stream, object_hook=None):
+        self.stream = stream
+        self.object_hook = object_hook
+        self.tag = None
+        self.blobs = []
+
+    def read_document(self):
+        '''Read the root object, after the magic, without applying the
+        object hook to it.'''
+
+        self.blobs = []
+        tag = self._read_tag()
+        if tag != '{':
+            raise ValueError('expected object in binary state dump')
+        return self._read_object(hook=False)
+
+    def peek(self):
+        if self.tag is None:
+            self.tag = self._read(1)
+        return self.tag
+
+    def iter_object(self):
+        if self._read_tag() != '{':
+            raise ValueError('expected object in binary state dump')
+        while True:
+            tag = self._read_tag()
+            if tag == '}':
+                return
+            assert tag == ':'
+            yield self._read_bytes().decode('utf-8', 'replace')
+
+    def parse_value(self):
+        return self._read_value(self._read_tag())
+
+    def _read(self, size):
+        data = self.stream.read(size)
+        if len(data) != size:
+            raise ValueError('unexpected end of binary state dump')
+        return data
+
+    def _read_tag(self):
+        tag = self.peek()
+        self.tag = None
+        return tag
+
+    def _read_varuint(self):
+        result = 0
+        shift = 0
+        while True:
+            byte = ord(self._read(1))
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def _read_bytes(self):
+        return self._read(self._read_varuint())
+
+    def _read_object(self, hook=True):
+        obj = {}
+        while True:
+            tag = self._read_tag()
+            if tag == '}':
+                break
+            assert tag == ':'
+            name = self._read_bytes().decode('utf-8', 'replace')
+            obj[name] = self._read_value(self._read_tag())
+        if hook and self.object_hook is not None:
+            obj = self.object_hook(obj)
+        return obj
+
+    def _read_array(self):
+        array = []
+        while True:
+            tag = self._read_tag()
+            if tag == ']':
+                return array
+            array.append(self._read_value(tag))
+
+    def _read_value(self, tag):
+        if tag == '{':
+            return self._read_object()
+        elif tag == '[':
+            return self._read_array()
+        elif tag == 'n':
+            return None
+        elif tag == 't':
+            return True
+        elif tag == 'f':
+            return False
+        elif tag == 'i':
+            n = self._read_varuint()
+            return (n >> 1) ^ -(n & 1)
+        elif tag == 'd':
+            return struct.unpack('<d', self._read(8))[0]
+        elif tag == 's':
+            return self._read_bytes().decode('utf-8', 'replace')
+        elif tag == 'b':
+            blob = self._read_bytes()
+            self.blobs.append(blob)
+            return blob
+        elif tag == 'r':
+            return self.blobs[self._read_varuint()]
+        else:
+            raise ValueError('unexpected tag %r in binary state dump' % tag)
+
+
+def open_reader(stream):
+    '''Return an incremental reader for the JSON or binary state dump in the
+    stream.'''
+
+    magic = stream.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        return BinaryReader(stream, object_hook)
+    return JSONReader(stream, magic, object_hook)
+
+
 def load(stream):
-    return json.load(stream, strict=False, object_hook = object_hook)
+    magic = stream.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        reader = BinaryReader(stream, object_hook)
+        return object_hook(reader.read_document())
+    return json.loads(magic + stream.read(), strict=False, object_hook = object_hook)
+
+
+def load_all(stream):
+    '''Load a stream of concatenated JSON documents, as written by glretrace
+    when dumping the state at several calls, yielding (call_no, document)
+    pairs as soon as each document is complete.'''
+
+    magic = stream.read(len(BINARY_MAGIC))
+    if magic == BINARY_MAGIC:
+        reader = BinaryReader(stream, object_hook)
+        while magic == BINARY_MAGIC:
+            obj = reader.read_document()
+            call_no = obj.get('__call__')
+            yield call_no, object_hook(obj)
+            magic = stream.read(len(BINARY_MAGIC))
+        return
+
+    decoder = json.JSONDecoder(strict=False)
+    text = magic
+    for line in iter(stream.readline, ''):
+        text += line
+        # Documents can only end on a closing brace at the start of a line,
+        # so don't bother decoding otherwise.
+        if not line.startswith('}'):
+            continue
+        try:
+            obj, end = decoder.raw_decode(text)
+        except ValueError:
+            continue
+        text = text[end:].lstrip()
+        call_no = obj.get('__call__')
+        yield call_no, strip(obj)
+
+
+def strip(node):
+    '''Apply object_hook to a document which was decoded without it.'''
+
+    if isinstance(node, dict):
+        for name, value in node.items():
+            node[name] = strip(value)
+        return object_hook(node)
+    elif isinstance(node, list):
+        return [strip(value) for value in node]
+    else:
+        return node
 
 
 def main():
-    a = load(open(sys.argv[1], 'rt'))
-    b = load(open(sys.argv[2], 'rt'))
+    a = open_reader(open(sys.argv[1], 'rb'))
+    b = open_reader(open(sys.argv[2], 'rb'))
 
     #dumper = Dumper()
-    #dumper.visit(a)
+    #dumper.visit(load(open(sys.argv[1], 'rb')))
 
-    differ = Differ()
-    differ.visit(a, b)
+    differ = StreamDiffer()
+    differ.diff(a, b)
 
 
 if __name__ == '__main__':
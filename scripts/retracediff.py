@@ -28,15 +28,18 @@
 '''
 
 
+import io
 import optparse
 import os.path
+import Queue
 import subprocess
 import platform
 import sys
+import threading
 
 from PIL import Image
 
-from snapdiff import Comparer
+from snapdiff import Comparer, error_precision, numpy
 from highlight import Highlighter
 import jsondiff
 
@@ -70,46 +73,184 @@ class Setup:
             '-S', options.snapshot_frequency,
         ])
 
-    def dump_state(self, call_no):
-        '''Get the state dump at the specified call no.'''
+    def dump_states(self, call_nos):
+        '''Get the state dumps at the specified calls, in a single run.'''
 
+        call_nos = sorted(set(call_nos))
         p = self._retrace([
-            '-D', str(call_no),
+            '-D', ','.join([str(call_no) for call_no in call_nos]),
+            '--dump-sections', 'parameters',
         ])
-        state = jsondiff.load(p.stdout)
+        states = {}
+        pending = list(call_nos)
+        for call_no, state in jsondiff.load_all(p.stdout):
+            state = state.get('parameters', {})
+            # The state of calls inside glBegin/glEnd is only dumped afterwards
+            while pending and pending[0] <= call_no:
+                states[pending.pop(0)] = state
         p.wait()
-        return state.get('parameters', {})
+        return states
 
-    def diff_state(self, ref_call_no, src_call_no):
-        '''Compare the state between two calls.'''
+    def diff_states(self, call_pairs):
+        '''Compare the state between several pairs of calls.'''
 
-        ref_state = self.dump_state(ref_call_no)
-        src_state = self.dump_state(src_call_no)
+        call_nos = []
+        for ref_call_no, src_call_no in call_pairs:
+            call_nos.append(ref_call_no)
+            call_nos.append(src_call_no)
+        states = self.dump_states(call_nos)
 
-        sys.stdout.flush()
-        differ = jsondiff.Differ(sys.stdout)
-        differ.visit(ref_state, src_state)
-        sys.stdout.write('\n')
+        for ref_call_no, src_call_no in call_pairs:
+            sys.stdout.write('state %u -> %u\n' % (ref_call_no, src_call_no))
+            sys.stdout.flush()
+            differ = jsondiff.Differ(sys.stdout)
+            differ.visit(states.get(ref_call_no, {}), states.get(src_call_no, {}))
+            sys.stdout.write('\n')
 
 
-def read_pnm(stream):
-    '''Read a PNM from the stream, and return the image object, and the comment.'''
+class Snapshot:
+    '''A PNM snapshot, whose pixels live in a buffer owned by the reader.'''
 
-    magic = stream.readline()
-    if not magic:
-        return None, None
-    assert magic.rstrip() == 'P6'
-    comment = ''
-    line = stream.readline()
-    while line.startswith('#'):
-        comment += line[1:]
+    def __init__(self, call_no, width, height, buffer):
+        self.call_no = call_no
+        self.width = width
+        self.height = height
+        self.buffer = buffer
+
+    def image(self):
+        '''PIL image of the pixels.  PIL can't map RGB buffers, so this
+        copies; it is only needed when writing images out.'''
+
+        return Image.frombuffer('RGB', (self.width, self.height), buffer(self.buffer), 'raw', 'RGB', 0, 1)
+
+    def pixels(self, top = 0, bottom = None):
+        '''NumPy array sharing the pixels of the given scanlines with the
+        buffer, or a PIL image of them when NumPy is not available.'''
+
+        if bottom is None:
+            bottom = self.height
+        if numpy is None:
+            image = self.image()
+            if top != 0 or bottom != self.height:
+                image = image.crop((0, top, self.width, bottom))
+            return image
+        stride = self.width*3
+        pixels = numpy.frombuffer(self.buffer, numpy.uint8, (bottom - top)*stride, top*stride)
+        return pixels.reshape(bottom - top, self.width, 3)
+
+
+def dirty_rows(ref_snapshot, src_snapshot, band = 16):
+    '''Find the range of scanlines which differ between two snapshots of the
+    same size, or None if they are identical.
+
+    The whole buffers are compared first, and then bands of scanlines from
+    either end, all with memcmp and without copying.'''
+
+    if ref_snapshot.buffer == src_snapshot.buffer:
+        return None
+
+    stride = ref_snapshot.width*3
+    height = ref_snapshot.height
+
+    def band_differs(row):
+        offset = row*stride
+        size = min(band, height - row)*stride
+        return buffer(ref_snapshot.buffer, offset, size) != buffer(src_snapshot.buffer, offset, size)
+
+    rows = range(0, height, band)
+    top = next(row for row in rows if band_differs(row))
+    bottom = next(row for row in reversed(rows) if band_differs(row))
+    return top, min(bottom + band, height)
+
+
+def compare(ref_snapshot, src_snapshot):
+    '''Precision of the source snapshot, in bits.
+
+    Identical snapshots, by far the most common case, cost a memcmp, and
+    otherwise only the scanlines which differ are compared in full.'''
+
+    width = ref_snapshot.width
+    height = ref_snapshot.height
+    if (src_snapshot.width, src_snapshot.height) != (width, height):
+        return Comparer(ref_snapshot.pixels(), src_snapshot.pixels()).precision()
+
+    rows = dirty_rows(ref_snapshot, src_snapshot)
+    if rows is None:
+        return error_precision(0, width*height)
+
+    top, bottom = rows
+    comparer = Comparer(ref_snapshot.pixels(top, bottom), src_snapshot.pixels(top, bottom))
+    return comparer.precision(width*height)
+
+
+class PNMReader(threading.Thread):
+    '''Reads the PNM snapshots written by glretrace on a separate thread, so
+    that the reference and source retraces can make progress independently
+    of each other, up to a bounded number of snapshots ahead.
+
+    Pixels are read with readinto() into buffers which are recycled once
+    the snapshots are released.'''
+
+    def __init__(self, stream, lookahead = 8):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stream = io.open(stream.fileno(), 'rb', closefd=False)
+        self.snapshots = Queue.Queue(lookahead)
+        self.buffers = Queue.Queue()
+
+    def run(self):
+        try:
+            while True:
+                snapshot = self._read_snapshot()
+                self.snapshots.put(snapshot)
+                if snapshot is None:
+                    break
+        except:
+            self.snapshots.put(None)
+            raise
+
+    def get(self):
+        '''Get the next snapshot, or None at the end of the stream.'''
+
+        return self.snapshots.get()
+
+    def release(self, snapshot):
+        '''Give back the buffer of a snapshot for reuse.'''
+
+        self.buffers.put(snapshot.buffer)
+
+    def _read_snapshot(self):
+        stream = self.stream
+        magic = stream.readline()
+        if not magic:
+            return None
+        assert magic.rstrip() == 'P6'
+        comment = ''
         line = stream.readline()
-    width, height = map(int, line.strip().split())
-    maximum = int(stream.readline().strip())
-    assert maximum == 255
-    data = stream.read(height * width * 3)
-    image = Image.frombuffer('RGB', (width, height), data, 'raw', 'RGB', 0, 1)
-    return image, comment
+        while line.startswith('#'):
+            comment += line[1:]
+            line = stream.readline()
+        width, height = map(int, line.strip().split())
+        maximum = int(stream.readline().strip())
+        assert maximum == 255
+
+        size = width * height * 3
+        try:
+            buffer = self.buffers.get_nowait()
+        except Queue.Empty:
+            buffer = bytearray(size)
+        if len(buffer) != size:
+            buffer = bytearray(size)
+
+        view = memoryview(buffer)
+        offset = 0
+        while offset < size:
+            count = stream.readinto(view[offset:])
+            if not count:
+                return None
+            offset += count
+
+        return Snapshot(int(comment.strip()), width, height, buffer)
 
 
 def parse_env(optparser, entries):
@@ -175,28 +316,37 @@ def main():
 
     last_bad = -1
     last_good = 0
+    state_pairs = []
     ref_proc = ref_setup.retrace()
     try:
         src_proc = src_setup.retrace()
         try:
-            while True:
-                # Get the reference image
-                ref_image, ref_comment = read_pnm(ref_proc.stdout)
-                if ref_image is None:
-                    break
+            ref_reader = PNMReader(ref_proc.stdout)
+            src_reader = PNMReader(src_proc.stdout)
+            ref_reader.start()
+            src_reader.start()
 
-                # Get the source image
-                src_image, src_comment = read_pnm(src_proc.stdout)
-                if src_image is None:
+            while True:
+                ref_snapshot = ref_reader.get()
+                src_snapshot = src_reader.get()
+
+                # Pair the snapshots by call number
+                while ref_snapshot is not None and src_snapshot is not None \
+                      and ref_snapshot.call_no != src_snapshot.call_no:
+                    if ref_snapshot.call_no < src_snapshot.call_no:
+                        ref_reader.release(ref_snapshot)
+                        ref_snapshot = ref_reader.get()
+                    else:
+                        src_reader.release(src_snapshot)
+                        src_snapshot = src_reader.get()
+
+                if ref_snapshot is None or src_snapshot is None:
                     break
 
-                assert ref_comment == src_comment
-
-                call_no = int(ref_comment.strip())
+                call_no = ref_snapshot.call_no
 
                 # Compare the two images
-                comparer = Comparer(ref_image, src_image)
-                precision = comparer.precision()
+                precision = compare(ref_snapshot, src_snapshot)
 
                 mismatch = precision < options.threshold
 
@@ -213,21 +363,30 @@ def main():
                         prefix_dir = os.path.dirname(prefix)
                         if not os.path.isdir(prefix_dir):
                             os.makedirs(prefix_dir)
-                        ref_image.save(prefix + '.ref.png')
-                        src_image.save(prefix + '.src.png')
+                        ref_snapshot.image().save(prefix + '.ref.png')
+                        src_snapshot.image().save(prefix + '.src.png')
+                        comparer = Comparer(ref_snapshot.pixels(), src_snapshot.pixels())
                         comparer.write_diff(prefix + '.diff.png')
+                        del comparer
                     if last_bad < last_good:
-                        src_setup.diff_state(last_good, call_no)
+                        state_pairs.append((last_good, call_no))
                     last_bad = call_no
                 else:
                     last_good = call_no
 
                 highligher.flush()
+
+                ref_reader.release(ref_snapshot)
+                src_reader.release(src_snapshot)
         finally:
             src_proc.terminate()
     finally:
         ref_proc.terminate()
 
+    # Dump the state of all mismatches in a single replay
+    if state_pairs:
+        src_setup.diff_states(state_pairs)
+
 
 if __name__ == '__main__':
     main()
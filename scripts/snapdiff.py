@@ -35,78 +35,223 @@ import os.path
 import optparse
 import math
 import operator
+import cgi
+import hashlib
+import itertools
+import json
+import multiprocessing
 
 from PIL import Image
 from PIL import ImageChops
-from PIL import ImageEnhance
+from PIL import ImageStat
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 thumb_size = 320, 320
 
 
+def error_precision(square_error, area):
+    '''Precision in bits, given the sum of the squared errors of the RGB
+    channels over an area of so many pixels.'''
+
+    # See also http://effbot.org/zone/pil-comparing-images.htm
+    rel_error = float(square_error*2 + 1) / float(area*3*255*255*2)
+    bits = -math.log(rel_error)/math.log(2.0)
+    return bits
+
+
 class Comparer:
-    '''Image comparer.'''
+    '''Image comparer.
 
-    def __init__(self, ref_image, src_image, alpha = False):
-        if isinstance(ref_image, basestring):
-            self.ref_im = Image.open(ref_image)
-        else:
-            self.ref_im = ref_image
+    Images can be given as file names, PIL images, or (when NumPy is
+    available) height x width x channels uint8 arrays, such as views of the
+    snapshots read by retracediff.py.
+
+    The absolute difference is computed once, and every statistic derived
+    from its histogram (one pass in C), or from NumPy views of it.'''
 
-        if isinstance(src_image, basestring):
-            self.src_im = Image.open(src_image)
+    def __init__(self, ref_image, src_image, alpha = False):
+        self.alpha = alpha
+        self._diff_array = None
+        self._histogram = None
+
+        if numpy is not None \
+           and isinstance(ref_image, numpy.ndarray) \
+           and isinstance(src_image, numpy.ndarray):
+            ref = self._pixels(ref_image)
+            src = self._pixels(src_image)
+
+            # Compare the common area only, like ImageChops.difference
+            height = min(ref.shape[0], src.shape[0])
+            width = min(ref.shape[1], src.shape[1])
+            ref = ref[:height, :width]
+            src = src[:height, :width]
+
+            # Absolute difference without overflowing uint8
+            diff = numpy.maximum(ref, src)
+            diff -= numpy.minimum(ref, src)
+            self._diff_array = diff
+
+            self.src_im = self._frombuffer(src)
+            self.diff = self._frombuffer(diff)
         else:
-            self.src_im = src_image
+            self.ref_im = self._image(ref_image)
+            self.src_im = self._image(src_image)
+            self.diff = ImageChops.difference(self.src_im, self.ref_im)
 
+    def _image(self, image):
+        if isinstance(image, basestring):
+            image = Image.open(image)
         # Ignore
-        if not alpha:
-            self.ref_im = self.ref_im.convert('RGB')
-            self.src_im = self.src_im.convert('RGB')
+        if not self.alpha:
+            image = image.convert('RGB')
+        return image
+
+    def _pixels(self, image):
+        if image.ndim == 2:
+            image = image[:, :, numpy.newaxis].repeat(3, axis=2)
+        if not self.alpha and image.shape[2] > 3:
+            image = image[:, :, :3]
+        return image
+
+    def _frombuffer(self, pixels):
+        '''Wrap the pixels in a PIL image, without copying them if possible.'''
+
+        height, width, channels = pixels.shape
+        mode = {3: 'RGB', 4: 'RGBA'}[channels]
+        pixels = numpy.ascontiguousarray(pixels)
+        return Image.frombuffer(mode, (width, height), pixels, 'raw', mode, 0, 1)
+
+    def diff_array(self):
+        '''Absolute difference, as a height x width x channels NumPy array.'''
+
+        if self._diff_array is None:
+            self._diff_array = numpy.asarray(self.diff)
+        return self._diff_array
+
+    def histograms(self):
+        '''Histograms of the absolute difference of every channel.'''
 
-        self.diff = ImageChops.difference(self.src_im, self.ref_im)
+        if self._histogram is None:
+            self._histogram = self.diff.histogram()
+        h = self._histogram
+        return [h[i : i + 256] for i in range(0, len(h), 256)]
+
+    def square_errors(self):
+        '''Sum of the squared errors of every channel.'''
+
+        if numpy is not None:
+            squares = numpy.arange(256, dtype=numpy.float64)**2
+            return [float(e) for e in numpy.dot(self.histograms(), squares)]
+
+        squares = [i*i for i in range(256)]
+        return [float(sum(map(operator.mul, h, squares))) for h in self.histograms()]
 
     def write_diff(self, diff_image, fuzz = 0.05):
         # make a difference image similar to ImageMagick's compare utility
-        mask = ImageEnhance.Brightness(self.diff).enhance(1.0/fuzz)
+        scale = 1.0/fuzz
+        mask = self.diff.point([min(int(i*scale), 255) for i in range(256)] * len(self.diff.getbands()))
         mask = mask.convert('L')
 
         lowlight = Image.new('RGB', self.src_im.size, (0xff, 0xff, 0xff))
         highlight = Image.new('RGB', self.src_im.size, (0xf1, 0x00, 0x1e))
         diff_im = Image.composite(highlight, lowlight, mask)
 
-        diff_im = Image.blend(self.src_im, diff_im, 0xcc/255.0)
+        src_im = self.src_im
+        if src_im.mode != 'RGB':
+            src_im = src_im.convert('RGB')
+        diff_im = Image.blend(src_im, diff_im, 0xcc/255.0)
         diff_im.save(diff_image)
 
-    def precision(self):
-        # See also http://effbot.org/zone/pil-comparing-images.htm
-        h = self.diff.histogram()
-        square_error = 0
-        for i in range(1, 256):
-            square_error += sum(h[i : 3*256: 256])*i*i
-        rel_error = float(square_error*2 + 1) / float(self.diff.size[0]*self.diff.size[1]*3*255*255*2)
-        bits = -math.log(rel_error)/math.log(2.0)
-        return bits
-
-    def ae(self):
-        # Compute absolute error
-        # TODO: this is approximate due to the grayscale conversion
-        h = self.diff.convert('L').histogram()
-        ae = sum(h[int(255 * fuzz) + 1 : 256])
-        return ae
+    def precision(self, area = None):
+        '''Precision in bits.  The error is averaged over the given number of
+        pixels, which defaults to the compared area, but can be larger when
+        only a region of otherwise identical images was compared.'''
+
+        if area is None:
+            area = self.diff.size[0]*self.diff.size[1]
+        return error_precision(sum(self.square_errors()[:3]), area)
+
+    def ae(self, fuzz = 0.05):
+        '''Absolute error: number of pixels for which the difference of any
+        channel exceeds the fuzz ratio.'''
+
+        threshold = int(255 * fuzz)
+        if numpy is not None:
+            # Reducing channel by channel is much faster than along the
+            # innermost axis
+            diff = self.diff_array()
+            maximum = diff[:, :, 0]
+            for channel in range(1, diff.shape[2]):
+                maximum = numpy.maximum(maximum, diff[:, :, channel])
+            return int(numpy.count_nonzero(maximum > threshold))
+
+        mask = None
+        for band in self.diff.split():
+            band = band.point(lambda i: i > threshold and 255)
+            if mask is None:
+                mask = band
+            else:
+                mask = ImageChops.lighter(mask, band)
+        return mask.histogram()[255]
+
+    def error_map(self, tile_size = 32):
+        '''Mean squared error (over all channels) of every tile_size x
+        tile_size tile, indexed by tile row and column, to locate where the
+        images differ.'''
+
+        if numpy is not None:
+            diff = self.diff_array()
+            height, width, channels = diff.shape
+            rows = (height + tile_size - 1) // tile_size
+            columns = (width + tile_size - 1) // tile_size
+            squares = numpy.zeros((rows*tile_size, columns*tile_size), dtype=numpy.float32)
+            for channel in range(channels):
+                plane = diff[:, :, channel].astype(numpy.float32)
+                squares[:height, :width] += plane*plane
+            sums = squares.reshape(rows, tile_size, columns, tile_size).sum(axis=3, dtype=numpy.float64).sum(axis=1)
+
+            # Tiles on the right and bottom edges may be partial
+            tile_heights = numpy.minimum(tile_size, height - numpy.arange(rows)*tile_size)
+            tile_widths = numpy.minimum(tile_size, width - numpy.arange(columns)*tile_size)
+            areas = numpy.outer(tile_heights, tile_widths)
+            return sums / (areas * channels)
+
+        width, height = self.diff.size
+        error_map = []
+        for y in range(0, height, tile_size):
+            row = []
+            for x in range(0, width, tile_size):
+                box = (x, y, min(x + tile_size, width), min(y + tile_size, height))
+                stat = ImageStat.Stat(self.diff.crop(box))
+                area = (box[2] - box[0]) * (box[3] - box[1])
+                row.append(sum(stat.sum2) / (area * len(stat.sum2)))
+            error_map.append(row)
+        return error_map
+
+
+def thumbnail_name(image):
+    name, ext = os.path.splitext(image)
+    return name + '.thumb' + ext
+
+
+def thumbnail(image):
+    thumb = thumbnail_name(image)
+    if os.path.exists(image) \
+       and (not os.path.exists(thumb) \
+            or os.path.getmtime(thumb) < os.path.getmtime(image)):
+        im = Image.open(image)
+        im.thumbnail(thumb_size)
+        im.save(thumb)
+    return thumb
 
 
 def surface(html, image):
-    if True:
-        name, ext = os.path.splitext(image)
-        thumb = name + '.thumb' + ext
-        if os.path.exists(image) \
-           and (not os.path.exists(thumb) \
-                or os.path.getmtime(thumb) < os.path.getmtime(image)):
-            im = Image.open(image)
-            im.thumbnail(thumb_size)
-            im.save(thumb)
-    else:
-        thumb = image
+    thumb = thumbnail_name(image)
     html.write('        <td><a href="%s"><img src="%s"/></a></td>\n' % (image, thumb))
 
 
@@ -134,6 +279,85 @@ def find_images(prefix):
     return images
 
 
+def file_hash(path):
+    digest = hashlib.md5()
+    stream = open(path, 'rb')
+    try:
+        while True:
+            data = stream.read(1 << 16)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        stream.close()
+    return digest.hexdigest()
+
+
+def file_signature(path, hash = None):
+    '''Signature of a file, as a [mtime, size, hash] list.'''
+
+    st = os.stat(path)
+    if hash is None:
+        hash = file_hash(path)
+    return [st.st_mtime, st.st_size, hash]
+
+
+def signature_matches(signature, path):
+    '''Whether the file is unchanged since its signature was taken.  When only
+    the modification time differs the contents are hashed, and the signature
+    is updated if they match.'''
+
+    mtime, size, hash = signature
+    st = os.stat(path)
+    if st.st_size != size:
+        return False
+    if st.st_mtime == mtime:
+        return True
+    if file_hash(path) != hash:
+        return False
+    signature[0] = st.st_mtime
+    return True
+
+
+def compare_task(task):
+    '''Compare one pair of images, writing the difference image and all the
+    thumbnails.  Runs in the worker processes.'''
+
+    image, ref_image, src_image, delta_image, fuzz = task
+
+    comparer = Comparer(ref_image, src_image)
+    precision = comparer.precision()
+    comparer.write_diff(delta_image, fuzz=fuzz)
+    del comparer
+
+    for path in (ref_image, src_image, delta_image):
+        thumbnail(path)
+
+    return image, precision, file_signature(ref_image), file_signature(src_image)
+
+
+def load_cache(filename):
+    try:
+        stream = open(filename, 'rt')
+    except IOError:
+        return {}
+    try:
+        try:
+            return json.load(stream)
+        except ValueError:
+            return {}
+    finally:
+        stream.close()
+
+
+def save_cache(filename, cache):
+    stream = open(filename, 'wt')
+    try:
+        json.dump(cache, stream)
+    finally:
+        stream.close()
+
+
 def main():
     global options
 
@@ -151,6 +375,18 @@ def main():
         '--overwrite',
         action="store_true", dest="overwrite", default=False,
         help="overwrite")
+    optparser.add_option(
+        '-j', '--jobs', metavar='N',
+        type="int", dest="jobs", default=1,
+        help="number of images to compare in parallel [default: %default]")
+    optparser.add_option(
+        '--cache', metavar='FILE',
+        type="string", dest="cache", default=None,
+        help="file to cache comparison results in, so that unchanged images are skipped [default: OUTPUT.cache]")
+    optparser.add_option(
+        '--worst', metavar='N',
+        type="int", dest="worst", default=20,
+        help="number of worst images to summarize [default: %default]")
 
     (options, args) = optparser.parse_args(sys.argv[1:])
 
@@ -165,34 +401,93 @@ def main():
     images = list(set(ref_images).intersection(set(src_images)))
     images.sort()
 
+    cache_filename = options.cache
+    if cache_filename is None and options.output:
+        cache_filename = options.output + '.cache'
+    cache = {}
+    if cache_filename and not options.overwrite:
+        cache = load_cache(cache_filename)
+
+    # Find the pairs which need to be compared
+    precisions = {}
+    tasks = []
+    for image in images:
+        ref_image = ref_prefix + image
+        src_image = src_prefix + image
+        root, ext = os.path.splitext(src_image)
+        delta_image = "%s.diff.png" % (root, )
+        if not os.path.exists(ref_image) or not os.path.exists(src_image):
+            continue
+
+        entry = cache.get(image)
+        if entry is not None \
+           and entry['fuzz'] == options.fuzz \
+           and signature_matches(entry['ref'], ref_image) \
+           and signature_matches(entry['src'], src_image) \
+           and os.path.exists(thumbnail_name(ref_image)) \
+           and os.path.exists(thumbnail_name(src_image)) \
+           and os.path.exists(thumbnail_name(delta_image)):
+            precisions[image] = entry['precision']
+        else:
+            tasks.append((image, ref_image, src_image, delta_image, options.fuzz))
+
+    if options.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(options.jobs)
+        results = pool.imap_unordered(compare_task, tasks)
+    else:
+        pool = None
+        results = itertools.imap(compare_task, tasks)
+
+    for image, precision, ref_signature, src_signature in results:
+        precisions[image] = precision
+        cache[image] = {
+            'fuzz': options.fuzz,
+            'precision': precision,
+            'ref': ref_signature,
+            'src': src_signature,
+        }
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    if cache_filename:
+        save_cache(cache_filename, cache)
+
     if options.output:
         html = open(options.output, 'wt')
     else:
         html = sys.stdout
     html.write('<html>\n')
     html.write('  <body>\n')
+
+    # Summary of the worst images
+    worst = [(precision, image) for image, precision in precisions.iteritems()]
+    worst.sort()
+    worst = worst[:options.worst]
+    if worst:
+        html.write('    <table border="1">\n')
+        html.write('      <tr><th>Worst</th><th>Precision (bits)</th></tr>\n')
+        for precision, image in worst:
+            html.write('      <tr><td><a href="#%s">%s</a></td><td>%.1f</td></tr>\n' % (cgi.escape(image, True), cgi.escape(image), precision))
+        html.write('    </table>\n')
+        html.write('    <br/>\n')
+
     html.write('    <table border="1">\n')
-    html.write('      <tr><th>%s</th><th>%s</th><th>&Delta;</th></tr>\n' % (ref_prefix, src_prefix))
+    html.write('      <tr><th>%s</th><th>%s</th><th>&Delta;</th><th>Precision (bits)</th></tr>\n' % (ref_prefix, src_prefix))
     for image in images:
+        if image not in precisions:
+            continue
         ref_image = ref_prefix + image
         src_image = src_prefix + image
         root, ext = os.path.splitext(src_image)
         delta_image = "%s.diff.png" % (root, )
-        if os.path.exists(ref_image) and os.path.exists(src_image):
-            if options.overwrite \
-               or not os.path.exists(delta_image) \
-               or (os.path.getmtime(delta_image) < os.path.getmtime(ref_image) \
-                   and os.path.getmtime(delta_image) < os.path.getmtime(src_image)):
-
-                comparer = Comparer(ref_image, src_image)
-                comparer.write_diff(delta_image, fuzz=options.fuzz)
-
-            html.write('      <tr>\n')
-            surface(html, ref_image)
-            surface(html, src_image)
-            surface(html, delta_image)
-            html.write('      </tr>\n')
-            html.flush()
+        html.write('      <tr id="%s">\n' % cgi.escape(image, True))
+        surface(html, ref_image)
+        surface(html, src_image)
+        surface(html, delta_image)
+        html.write('        <td>%.1f</td>\n' % precisions[image])
+        html.write('      </tr>\n')
     html.write('    </table>\n')
     html.write('  </body>\n')
     html.write('</html>\n')
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+##########################################################################
+#
+# Copyright 2012 Jose Fonseca
+# All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the 'Software'), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED 'AS IS', WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+##########################################################################/
+
+'''Multi-way bisection of a regression with tracecheck.py.
+
+Instead of checking one commit at a time, as `git bisect run` does, several
+commits are checked concurrently per round, each in its own git worktree,
+narrowing the range (jobs + 1)-ways.  Worktrees are kept between rounds and
+runs, so that builds are incremental, and verdicts are cached by commit hash.
+
+Every check must replay with the build of its own worktree, so `{worktree}`
+is replaced by the worktree path in the tracecheck arguments and in the
+environment given with --env.  Frame rate checks are serialized, as replays
+sharing the GPU would skew the timings.
+'''
+
+
+import json
+import optparse
+import os.path
+import subprocess
+import sys
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+
+GOOD, BAD, SKIP = 'good', 'bad', 'skip'
+
+verdicts = {
+    0: GOOD,
+    1: BAD,
+    125: SKIP,
+}
+
+
+def git(*args, **kwargs):
+    '''Run a git command, returning its output.'''
+
+    return subprocess.check_output(('git',) + args, **kwargs)
+
+
+class Worktree:
+    '''A git worktree in which commits are checked out, built, and checked.'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def checkout(self, commit):
+        if os.path.isdir(self.path):
+            git('checkout', '--quiet', '--force', '--detach', commit, cwd=self.path)
+        else:
+            git('worktree', 'add', '--detach', self.path, commit)
+
+    def substitute(self, value):
+        return value.replace('{worktree}', self.path)
+
+    def check(self, commit, command, env, log_path):
+        '''Run tracecheck.py on a commit, returning the verdict.'''
+
+        self.checkout(commit)
+        command = [self.substitute(arg) for arg in command]
+        environ = dict(os.environ)
+        for name, value in env:
+            environ[name] = self.substitute(value)
+        log = open(log_path, 'wt')
+        try:
+            returncode = subprocess.call(command, cwd=self.path, env=environ, stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            log.close()
+        try:
+            return verdicts[returncode]
+        except KeyError:
+            raise Exception('%s aborted on %s (see %s)' % (command[1], commit, log_path))
+
+
+class Bisector:
+    '''Bisects a linear range of commits.'''
+
+    def __init__(self, commits, command, env, worktrees_dir, jobs, cache):
+        # commits[0] is known to be good and commits[-1] bad
+        self.commits = commits
+        self.command = command
+        self.env = env
+        self.worktrees_dir = worktrees_dir
+        self.jobs = jobs
+        self.cache = cache
+
+        self.worktrees = [Worktree(os.path.join(worktrees_dir, '%u' % i)) for i in range(jobs)]
+        self.free_worktrees = list(self.worktrees)
+        self.lock = threading.Lock()
+
+    def verdict(self, index):
+        commit = self.commits[index]
+        if index == 0:
+            return GOOD
+        if index == len(self.commits) - 1:
+            return BAD
+        return self.cache.get(commit)
+
+    def candidates(self, good, bad):
+        '''Commits strictly between good and bad which haven't been skipped.'''
+
+        return [index for index in range(good + 1, bad) if self.verdict(index) != SKIP]
+
+    def pick(self, candidates):
+        '''Pick commits splitting the candidates in jobs + 1 even parts.'''
+
+        count = min(self.jobs, len(candidates))
+        picks = []
+        for i in range(count):
+            index = candidates[(i + 1) * len(candidates) // (count + 1)]
+            if index not in picks:
+                picks.append(index)
+        return picks
+
+    def check(self, index):
+        commit = self.commits[index]
+
+        self.lock.acquire()
+        worktree = self.free_worktrees.pop()
+        self.lock.release()
+
+        try:
+            log_path = os.path.join(self.worktrees_dir, commit + '.log')
+            verdict = worktree.check(commit, self.command, self.env, log_path)
+        finally:
+            self.lock.acquire()
+            self.free_worktrees.append(worktree)
+            self.lock.release()
+
+        return index, verdict
+
+    def bisect(self):
+        '''Returns the first bad commit, and the skipped commits which could be
+        the first bad commit too.'''
+
+        pool = ThreadPool(self.jobs)
+        try:
+            while True:
+                # Narrow the range with the verdicts known so far
+                good = 0
+                bad = len(self.commits) - 1
+                for index in range(1, bad):
+                    verdict = self.verdict(index)
+                    if verdict == BAD:
+                        bad = index
+                        break
+                    if verdict == GOOD:
+                        good = index
+
+                candidates = self.candidates(good, bad)
+                if not candidates:
+                    skipped = [self.commits[index] for index in range(good + 1, bad)]
+                    return self.commits[bad], skipped
+
+                sys.stdout.write('%u commits left to test\n' % len(candidates))
+                sys.stdout.flush()
+
+                for index, verdict in pool.imap_unordered(self.check, self.pick(candidates)):
+                    commit = self.commits[index]
+                    self.cache[commit] = verdict
+                    sys.stdout.write('%s %s\n' % (commit, verdict.upper()))
+                    sys.stdout.flush()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def measures_performance(tracecheck_args):
+    '''Whether tracecheck.py is to compare frame rates.'''
+
+    for arg in tracecheck_args:
+        if arg == '--':
+            break
+        if arg == '--baseline' or arg.startswith('--baseline='):
+            return True
+    return False
+
+
+def load_cache(path, key):
+    try:
+        stream = open(path, 'rt')
+    except IOError:
+        return {}, {}
+    try:
+        caches = json.load(stream)
+    except ValueError:
+        caches = {}
+    stream.close()
+    return caches, caches.get(key, {})
+
+
+def save_cache(path, caches, key, cache):
+    caches[key] = cache
+    stream = open(path, 'wt')
+    json.dump(caches, stream, indent=2, sort_keys=True)
+    stream.close()
+
+
+def main():
+    '''Main program.'''
+
+    git_dir = os.path.abspath(git('rev-parse', '--git-common-dir').strip())
+
+    # Parse command line options
+    optparser = optparse.OptionParser(
+        usage='\n\t%prog [options] <good> <bad> [tracecheck options] -- [glretrace options] <trace>',
+        version='%%prog')
+    optparser.disable_interspersed_args()
+    optparser.add_option(
+        '-j', '--jobs', metavar='N',
+        type='int', dest='jobs', default=2,
+        help='number of commits to check concurrently [default: %default]')
+    optparser.add_option(
+        '-p', '--path', metavar='PATH',
+        type='string', action='append', dest='paths', default=[],
+        help='only consider commits touching the given path')
+    optparser.add_option(
+        '-e', '--env', metavar='NAME=VALUE',
+        type='string', action='append', dest='env', default=[],
+        help='set an environment variable for the checks, where {worktree} is replaced by the worktree path')
+    optparser.add_option(
+        '--worktrees', metavar='DIR',
+        type='string', dest='worktrees', default=os.path.join(git_dir, 'tracebisect'),
+        help='directory for the worktrees and logs [default: %default]')
+    optparser.add_option(
+        '--cache', metavar='FILE',
+        type='string', dest='cache', default=os.path.join(git_dir, 'tracebisect.json'),
+        help='verdict cache [default: %default]')
+
+    (options, args) = optparser.parse_args(sys.argv[1:])
+    if len(args) < 3:
+        optparser.error("incorrect number of arguments")
+    if options.jobs < 1:
+        optparser.error("invalid number of jobs")
+    env = []
+    for assignment in options.env:
+        name, sep, value = assignment.partition('=')
+        if not name or not sep:
+            optparser.error("invalid environment variable %r" % assignment)
+        env.append((name, value))
+
+    good = git('rev-parse', '--verify', args[0] + '^{commit}').strip()
+    bad = git('rev-parse', '--verify', args[1] + '^{commit}').strip()
+    tracecheck_args = args[2:]
+
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tracecheck.py')]
+    command += tracecheck_args
+
+    if options.jobs > 1 and measures_performance(tracecheck_args):
+        command.insert(2, '--lock=' + os.path.join(options.worktrees, 'replay.lock'))
+
+    # Linear range of commits, from good to bad
+    rev_list = ['rev-list', '--reverse', '--first-parent', good + '..' + bad]
+    if options.paths:
+        rev_list += ['--'] + options.paths
+    commits = [good] + git(*rev_list).split()
+    if commits[-1] != bad:
+        commits.append(bad)
+
+    if not os.path.isdir(options.worktrees):
+        os.makedirs(options.worktrees)
+
+    # Verdicts depend on the trace and the criteria, so they are cached
+    # separately for every set of tracecheck arguments
+    key = ' '.join(['--env=' + assignment for assignment in options.env] + tracecheck_args)
+    caches, cache = load_cache(options.cache, key)
+
+    bisector = Bisector(commits, command, env, options.worktrees, options.jobs, cache)
+    try:
+        first_bad, skipped = bisector.bisect()
+    finally:
+        save_cache(options.cache, caches, key, cache)
+
+    if skipped:
+        sys.stdout.write('There are only skipped commits left to test.\n')
+        sys.stdout.write('The first bad commit could be any of:\n')
+        for commit in skipped + [first_bad]:
+            sys.stdout.write(commit + '\n')
+    else:
+        sys.stdout.write('%s is the first bad commit\n' % first_bad)
+        sys.stdout.write(git('log', '-1', '--stat', first_bad))
+
+
+if __name__ == '__main__':
+    main()
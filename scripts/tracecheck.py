@@ -31,6 +31,8 @@ details.
 '''
 
 
+import json
+import math
 import optparse
 import os.path
 import platform
@@ -84,6 +86,118 @@ def which(executable):
     return False
 
 
+# One-sided 95% critical values of Student's t distribution, by degrees of
+# freedom, tending to the normal distribution's
+t_95 = [
+    None,  6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833,
+    1.812, 1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729,
+    1.725, 1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699,
+    1.697,
+]
+
+
+def mean(samples):
+    return sum(samples) / float(len(samples))
+
+
+def variance(samples):
+    '''Unbiased sample variance.'''
+
+    m = mean(samples)
+    return sum([(x - m)**2 for x in samples]) / float(len(samples) - 1)
+
+
+def slower(baseline, samples):
+    '''Whether the samples are significantly smaller than the baseline, per
+    Welch's t-test at the 95% confidence level.'''
+
+    se2_baseline = variance(baseline) / len(baseline)
+    se2_samples = variance(samples) / len(samples)
+    se2 = se2_baseline + se2_samples
+    difference = mean(baseline) - mean(samples)
+    if se2 == 0.0:
+        return difference > 0.0
+
+    # Welch-Satterthwaite degrees of freedom
+    df = se2**2 / (se2_baseline**2 / (len(baseline) - 1) + se2_samples**2 / (len(samples) - 1))
+    df = max(int(df), 1)
+    if df < len(t_95):
+        critical = t_95[df]
+    else:
+        critical = 1.645
+
+    return difference / math.sqrt(se2) > critical
+
+
+fps_re = re.compile(r'^Rendered (\d+) frames in (\S+) secs, average of (\S+) fps$')
+
+
+def benchmark(command):
+    '''Run glretrace in benchmark mode, returning the average frame rate.'''
+
+    p = subprocess.Popen(command, stdout=subprocess.PIPE)
+    stdout, stderr = p.communicate()
+    if p.returncode:
+        bad()
+
+    for line in stdout.split('\n'):
+        mo = fps_re.match(line)
+        if mo:
+            return float(mo.group(3))
+
+    sys.stderr.write('Frame rate not found in glretrace output.\n')
+    skip()
+
+
+def check_performance(options, args):
+    '''Compare the frame rate against the baseline, when one is given.'''
+
+    command = [options.retrace, '-b'] + args
+    sys.stdout.write(' '.join(command) + '\n')
+    sys.stdout.flush()
+
+    samples = []
+    for run in range(options.warmup + options.runs):
+        fps = benchmark(command)
+        if run >= options.warmup:
+            samples.append(fps)
+        sys.stdout.write('%f fps%s\n' % (fps, ['', ' (warmup)'][run < options.warmup]))
+        sys.stdout.flush()
+
+    if options.save_baseline:
+        stream = open(options.baseline, 'wt')
+        json.dump({'fps': samples}, stream)
+        stream.close()
+        return
+
+    try:
+        stream = open(options.baseline, 'rt')
+    except IOError:
+        sys.stderr.write('Failed to open baseline %s.\n' % options.baseline)
+        abort()
+    baseline = json.load(stream)['fps']
+    stream.close()
+
+    # Regressions smaller than the threshold are not interesting, no matter
+    # how significant they are
+    slowdown = 1.0 - mean(samples) / mean(baseline)
+    sys.stdout.write('%f fps, baseline %f fps, %+.1f%%\n' % (mean(samples), mean(baseline), -100.0*slowdown))
+    if slowdown*100.0 < options.fps_threshold:
+        return
+
+    # Without enough samples to estimate the noise, go by the threshold alone
+    if len(samples) < 2 or len(baseline) < 2:
+        bad()
+
+    for name, values in (('baseline', baseline), ('samples', samples)):
+        sys.stdout.write('%s noise %.1f%%\n' % (name, 100.0*math.sqrt(variance(values))/mean(values)))
+    if slower(baseline, samples):
+        bad()
+
+    # Too noisy to tell
+    skip()
+
+
 def main():
     '''Main program.
 
@@ -122,10 +236,38 @@ def main():
         '--gl-renderer', metavar='REGEXP',
         type='string', dest='gl_renderer_re', default='^.*$',
         help='require a matching GL_RENDERER string [default: %default]')
+    optparser.add_option(
+        '--baseline', metavar='FILE',
+        type='string', dest='baseline', default=None,
+        help='check the frame rate against the baseline in FILE')
+    optparser.add_option(
+        '--save-baseline',
+        action='store_true', dest='save_baseline', default=False,
+        help='save the frame rate as the baseline instead')
+    optparser.add_option(
+        '--runs', metavar='N',
+        type='int', dest='runs', default=5,
+        help='number of benchmark runs [default: %default]')
+    optparser.add_option(
+        '--warmup', metavar='N',
+        type='int', dest='warmup', default=1,
+        help='number of initial benchmark runs to discard [default: %default]')
+    optparser.add_option(
+        '--fps-threshold', metavar='PERCENT',
+        type='float', dest='fps_threshold', default=5.0,
+        help='frame rate regression threshold [default: %default]')
+    optparser.add_option(
+        '--lock', metavar='FILE',
+        type='string', dest='lock', default=None,
+        help='replay only while holding a lock on FILE, to not share the GPU with other checks')
 
     (options, args) = optparser.parse_args(sys.argv[1:])
     if not args:
         optparser.error("incorrect number of arguments")
+    if options.save_baseline and not options.baseline:
+        optparser.error("--save-baseline requires --baseline")
+    if options.runs < 1 or options.warmup < 0:
+        optparser.error("invalid number of runs")
 
     # Build the source
     if options.build:
@@ -138,6 +280,13 @@ def main():
     # TODO: For this to be useful on Windows we'll also need an installation
     # procedure here.
 
+    # Wait for concurrent checks to be done with the GPU.  The lock is
+    # released when exiting.
+    if options.lock:
+        import fcntl
+        lock = open(options.lock, 'a')
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
     # Do some sanity checks.  In particular we want to make sure that the GL
     # implementation is usable, and is the right one (i.e., we didn't fallback
     # to a different OpenGL implementation due to missing symbols).
@@ -194,7 +343,8 @@ def main():
         if failed:
             bad()
 
-    # TODO: allow more criterias here, such as, performance threshold
+    if options.baseline:
+        check_performance(options, args)
 
     # Success
     good()